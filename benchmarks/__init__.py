@@ -0,0 +1,9 @@
+"""asv benchmarks for iscaxr.
+
+Run from the repository root with
+
+    $ asv run
+
+or `asv dev` to time the working tree once.  All benchmarks run on
+synthetic datasets from `iscaxr.synthetic`, parameterised by resolution.
+"""
@@ -0,0 +1,32 @@
+import iscaxr
+from iscaxr.analysis import atmosphere
+
+from .common import ResolutionBenchmark
+
+
+class Atmosphere(ResolutionBenchmark):
+    def time_pot_temp(self, resolution, ntime):
+        iscaxr.pot_temp(self.data)
+
+    def time_brunt_vaisala(self, resolution, ntime):
+        iscaxr.brunt_vaisala(self.data)
+
+    def peakmem_brunt_vaisala(self, resolution, ntime):
+        iscaxr.brunt_vaisala(self.data)
+
+    def time_eady_growth_rate(self, resolution, ntime):
+        iscaxr.eady_growth_rate(self.data)
+
+    def peakmem_eady_growth_rate(self, resolution, ntime):
+        iscaxr.eady_growth_rate(self.data)
+
+    def time_eddy(self, resolution, ntime):
+        atmosphere.eddy(self.data.ucomp)
+
+
+class MassStreamfunction(ResolutionBenchmark):
+    def time_mass_streamfunction(self, resolution, ntime):
+        iscaxr.mass_streamfunction(self.data)
+
+    def peakmem_mass_streamfunction(self, resolution, ntime):
+        iscaxr.mass_streamfunction(self.data)
@@ -0,0 +1,44 @@
+import iscaxr.synthetic
+
+RESOLUTIONS = ['T42', 'T85', 'T170']
+
+# run lengths, in timesteps: about a month and a year of daily output
+TIME_LENGTHS = [30, 360]
+
+# combinations of resolution and run length whose dataset would be larger
+# than this are skipped
+MAX_DATASET_BYTES = 2*1024**3
+
+_datasets = {}
+
+
+def dataset_bytes(resolution, ntime, nlev=25):
+    nlat, nlon = iscaxr.synthetic.RESOLUTIONS[resolution]
+    # four (time, pfull, lat, lon) float32 fields and ps
+    return 4*ntime*(4*nlev + 1)*nlat*nlon
+
+def dataset(resolution, chunks=None, ntime=TIME_LENGTHS[0], nlev=25):
+    """A (cached) synthetic dataset for `resolution` with `ntime` timesteps."""
+    key = (resolution, ntime, nlev)
+    if key not in _datasets:
+        _datasets[key] = iscaxr.synthetic.make_dataset(resolution, ntime=ntime, nlev=nlev)
+    data = _datasets[key]
+    if chunks is not None:
+        data = data.chunk(chunks)
+    return data
+
+
+class ResolutionBenchmark(object):
+    """Benchmarks at each resolution and run length."""
+    params = [RESOLUTIONS, TIME_LENGTHS]
+    param_names = ['resolution', 'ntime']
+    timeout = 300
+
+    def setup(self, resolution, ntime):
+        skip_if_too_large(resolution, ntime)
+        self.data = dataset(resolution, ntime=ntime)
+
+def skip_if_too_large(resolution, ntime):
+    if dataset_bytes(resolution, ntime) > MAX_DATASET_BYTES:
+        # asv skips benchmarks whose setup raises NotImplementedError
+        raise NotImplementedError('{} x {:d} timesteps is too large'.format(resolution, ntime))
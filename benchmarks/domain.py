@@ -0,0 +1,49 @@
+import iscaxr
+from iscaxr import domain
+
+from .common import ResolutionBenchmark, dataset, skip_if_too_large
+
+
+class Grid(ResolutionBenchmark):
+    def time_grid_from_dataset(self, resolution, ntime):
+        iscaxr.IscaGrid.from_dataset(self.data)
+
+    def time_calculate_dA(self, resolution, ntime):
+        domain.calculate_dA(self.data)
+
+    def time_surf_integral(self, resolution, ntime):
+        domain.make_surf_integrator(self.data)(self.data.temp)
+
+    def peakmem_surf_integral(self, resolution, ntime):
+        domain.make_surf_integrator(self.data)(self.data.temp)
+
+
+class Vertical(ResolutionBenchmark):
+    def time_pfull_to_phalf(self, resolution, ntime):
+        domain.pfull_to_phalf(self.data.temp, self.data)
+
+    def time_dfdp(self, resolution, ntime):
+        domain.dfdp(self.data.temp, self.data)
+
+    def time_calculate_dz(self, resolution, ntime):
+        domain.calculate_dz(self.data)
+
+    def peakmem_calculate_dz(self, resolution, ntime):
+        domain.calculate_dz(self.data)
+
+
+class CenterLon(ResolutionBenchmark):
+    def time_center_lon(self, resolution, ntime):
+        domain.center_lon(self.data.temp, lon=180, wrap=True)
+
+
+class LazyVertical(ResolutionBenchmark):
+    def setup(self, resolution, ntime):
+        skip_if_too_large(resolution, ntime)
+        self.data = dataset(resolution, chunks={'time': 1}, ntime=ntime)
+
+    def time_calculate_dz_dask(self, resolution, ntime):
+        domain.calculate_dz(self.data).compute()
+
+    def peakmem_calculate_dz_dask(self, resolution, ntime):
+        domain.calculate_dz(self.data).compute()
@@ -0,0 +1,35 @@
+# registers the accessors, e.g. the .in_units used by g_sublon
+import iscaxr.xarray_extensions
+from iscaxr.analysis import exoplanet
+
+from .common import ResolutionBenchmark
+
+
+class SubstellarFrame(ResolutionBenchmark):
+    def setup(self, resolution, ntime):
+        super(SubstellarFrame, self).setup(resolution, ntime)
+        self.sublon = exoplanet.g_sublon(self.data, omega=1e-5, alpha=10.0)
+
+    def time_lon_to_xi(self, resolution, ntime):
+        exoplanet.lon_to_xi(self.data.temp, self.sublon)
+
+    def time_lon_to_xi_dataset(self, resolution, ntime):
+        exoplanet.lon_to_xi(self.data, self.sublon)
+
+    def peakmem_lon_to_xi(self, resolution, ntime):
+        exoplanet.lon_to_xi(self.data.temp, self.sublon)
+
+
+class PhaseCurve(ResolutionBenchmark):
+    def setup(self, resolution, ntime):
+        super(PhaseCurve, self).setup(resolution, ntime)
+        self.surface = self.data.temp.isel(pfull=-1)
+
+    def time_phase_curve(self, resolution, ntime):
+        exoplanet.make_phase_curve_calculator(self.data)(self.surface)
+
+    def peakmem_phase_curve(self, resolution, ntime):
+        exoplanet.make_phase_curve_calculator(self.data)(self.surface)
+
+    def time_phase_curve_mean(self, resolution, ntime):
+        exoplanet.make_phase_curve_calculator_mean(self.data)(self.surface)
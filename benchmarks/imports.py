@@ -0,0 +1,14 @@
+"""Import time of iscaxr, each measured in a fresh interpreter."""
+
+
+def timeraw_import_iscaxr():
+    return "import iscaxr"
+
+def timeraw_import_xarray_extensions():
+    return "import iscaxr.xarray_extensions"
+
+def timeraw_import_analysis():
+    return """
+    import iscaxr.analysis.spectral
+    import iscaxr.analysis.exoplanet
+    """
@@ -0,0 +1,80 @@
+import importlib.util
+
+from iscaxr.analysis import spectral
+
+from .common import ResolutionBenchmark, dataset, skip_if_too_large
+
+
+class Spectral(ResolutionBenchmark):
+    def setup(self, resolution, ntime):
+        skip_if_too_large(resolution, ntime)
+        data = dataset(resolution, ntime=ntime)
+        self.surface = data.temp.isel(pfull=-1)
+
+    def time_fft(self, resolution, ntime):
+        spectral.fft(self.surface, dim='lon')
+
+    def time_fft_real_power(self, resolution, ntime):
+        spectral.fft(self.surface, dim='lon', real=True, power=True)
+
+    def peakmem_fft(self, resolution, ntime):
+        spectral.fft(self.surface, dim='lon')
+
+    def peakmem_fft_real_power(self, resolution, ntime):
+        spectral.fft(self.surface, dim='lon', real=True, power=True)
+
+    def time_equatorial_waves(self, resolution, ntime):
+        spectral.equatorial_waves(self.surface.isel(time=0))
+
+
+class ZonalDispersion(object):
+    params = [[256, 1024], [None, 64]]
+    param_names = ['ntime', 'nperseg']
+    timeout = 300
+
+    def setup(self, ntime, nperseg):
+        # long time series: only a few levels are needed
+        data = dataset('T42', ntime=ntime, nlev=4)
+        self.field = data.ucomp.isel(pfull=-2).sel(lat=slice(-15, 15))
+
+    def time_zonal_dispersion(self, ntime, nperseg):
+        spectral.zonal_dispersion(self.field, nperseg=nperseg)
+
+    def peakmem_zonal_dispersion(self, ntime, nperseg):
+        spectral.zonal_dispersion(self.field, nperseg=nperseg)
+
+
+class WheelerKiladis(object):
+    params = [1024]
+    param_names = ['ntime']
+    timeout = 300
+
+    def setup(self, ntime):
+        data = dataset('T42', ntime=ntime, nlev=4)
+        self.field = data.ucomp.isel(pfull=-2)
+
+    def time_wheeler_kiladis(self, ntime):
+        spectral.wheeler_kiladis(self.field, nperseg=96)
+
+    def peakmem_wheeler_kiladis_streamed(self, ntime):
+        wk = spectral.WheelerKiladis(nperseg=96)
+        for i0 in range(0, ntime, 128):
+            wk.update(self.field.isel(time=slice(i0, i0+128)))
+        wk.result()
+
+
+class SphericalHarmonics(ResolutionBenchmark):
+    def setup(self, resolution, ntime):
+        if importlib.util.find_spec('spharm') is None:
+            raise NotImplementedError('spharm is not installed')
+        skip_if_too_large(resolution, ntime)
+        self.surface = dataset(resolution, ntime=ntime).temp.isel(pfull=-1)
+
+    def time_spht(self, resolution, ntime):
+        spectral.spht(self.surface)
+
+    def time_sph_filter(self, resolution, ntime):
+        spectral.sph_filter(self.surface, 21)
+
+    def peakmem_sph_filter(self, resolution, ntime):
+        spectral.sph_filter(self.surface, 21)
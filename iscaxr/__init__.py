@@ -1,5 +1,22 @@
+import importlib
+
 from iscaxr import util
 from iscaxr import domain
 from iscaxr import constants
+from iscaxr.grid import IscaGrid
+from iscaxr.loader import open_runs
+
+from iscaxr.analysis import mass_streamfunction, pot_temp, brunt_vaisala, eady_growth_rate
+
+# submodules with heavy dependencies (matplotlib, cartopy, astropy, h5py,
+# scipy.sparse) are imported on first access, e.g. `iscaxr.plotting`, so
+# that `import iscaxr` stays fast.
+_LAZY_SUBMODULES = ('cmap', 'dedalus_util', 'plotting', 'regrid', 'synthetic', 'vertical', 'xarray_extensions')
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module('iscaxr.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-from iscaxr.analysis import mass_streamfunction, pot_temp, brunt_vaisala, eady_growth_rate
\ No newline at end of file
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_SUBMODULES))
@@ -1,7 +1,8 @@
-from .mass_streamfunction import mass_streamfunction
+from .mass_streamfunction import mass_streamfunction, meridional_transports
 from .thermodynamics import pot_temp
 from .atmosphere import brunt_vaisala, eady_growth_rate, eddy
 from .spectral import zonal_dispersion
+from .accumulate import Accumulator, accumulate
 
 from . import spectral
 from . import thermodynamics
@@ -0,0 +1,174 @@
+"""Single-pass means, variances and eddy covariances of Isca output.
+
+`eddy` and friends need the whole time series at once: first the mean,
+then a second pass for the deviations from it.  An `Accumulator` instead
+consumes a dataset piece by piece, e.g. one Isca output file at a time,
+and keeps only a running count, mean and co-moment of each field:
+
+    >>> acc = Accumulator(['ucomp', 'vcomp', 'temp'],
+    ...                   covariances=[('ucomp', 'vcomp'), ('vcomp', 'temp')])
+    >>> for path in files:
+    ...     with xr.open_dataset(path) as ds:
+    ...         acc.update(ds)
+    >>> upvp = acc.covariance('ucomp', 'vcomp')
+
+Each piece is reduced on its own, and combined with the running state using
+the pairwise update of Chan et al. (1979), a generalisation of Welford's
+algorithm which is stable even when the mean is large compared to the eddies.
+The same update merges the states of accumulators that have seen different
+parts of a dataset, so the work can be shared between processes:
+
+    >>> total = Accumulator.combine([acc1, acc2, acc3])
+"""
+import numpy as np
+import xarray as xr
+
+
+def _pair(a, b):
+    # co-moments are symmetric, so are stored under a canonical key
+    return (a, b) if a <= b else (b, a)
+
+
+class Accumulator(object):
+    """Running mean, variance and covariance of the fields of a dataset.
+
+    Parameters
+    ----------
+    fields : sequence of str
+        The variables to accumulate.  The mean and variance of each is kept.
+    covariances : sequence of (str, str), optional
+        Pairs of fields whose covariance is kept, e.g. [('ucomp', 'vcomp')]
+        for the eddy momentum flux u'v'.  Both must be in `fields`.
+    dim : str or sequence of str, optional
+        The dimension(s) the statistics are taken over.  Default: 'time'
+
+    Statistics are accumulated in float64.  Missing values are not skipped:
+    every piece is assumed to be complete.
+    """
+    def __init__(self, fields, covariances=(), dim='time'):
+        self.fields = tuple(fields)
+        self.dims = (dim,) if isinstance(dim, str) else tuple(dim)
+        pairs = [(f, f) for f in self.fields] + [tuple(p) for p in covariances]
+        for a, b in pairs:
+            if a not in self.fields or b not in self.fields:
+                raise ValueError('covariance ({!r}, {!r}) of a field that is not accumulated'.format(a, b))
+        self.pairs = tuple(dict.fromkeys(_pair(a, b) for a, b in pairs))
+        self.count = 0
+        self.means = {}
+        self.comoments = {}
+
+    def _empty_like(self):
+        return Accumulator(self.fields, [p for p in self.pairs if p[0] != p[1]], self.dims)
+
+    def update(self, data):
+        """Add the values of `data`, a Dataset containing all of the fields.
+
+        The statistics of `data` are computed straight away, so a dask-backed
+        piece is evaluated and can then be released.  Returns self.
+        """
+        count = int(np.prod([data.sizes[d] for d in self.dims]))
+        if count == 0:
+            return self
+        fields = {f: data[f].astype(np.float64) for f in self.fields}
+        means = {f: v.mean(self.dims) for f, v in fields.items()}
+        anomalies = {f: fields[f] - means[f] for f in self.fields}
+        stats = {'mean|{}'.format(f): m for f, m in means.items()}
+        stats.update({'comoment|{}|{}'.format(a, b): (anomalies[a]*anomalies[b]).sum(self.dims)
+                      for a, b in self.pairs})
+        # evaluate the (small) reduced statistics together, so that a
+        # dask-backed piece is only read once
+        stats = xr.Dataset(stats).compute()
+
+        piece = self._empty_like()
+        piece.count = count
+        piece.means = {f: stats['mean|{}'.format(f)] for f in self.fields}
+        piece.comoments = {(a, b): stats['comoment|{}|{}'.format(a, b)] for a, b in self.pairs}
+        self._merge_state(piece)
+        return self
+
+    def _merge_state(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.means = dict(other.means)
+            self.comoments = dict(other.comoments)
+            return
+        n_a, n_b = self.count, other.count
+        n = n_a + n_b
+        # pieces must share a grid: never let xarray silently intersect them
+        with xr.set_options(arithmetic_join='exact'):
+            deltas = {f: other.means[f] - self.means[f] for f in self.fields}
+            self.comoments = {(a, b): self.comoments[(a, b)] + other.comoments[(a, b)]
+                                      + deltas[a]*deltas[b]*(n_a*n_b/n)
+                              for a, b in self.pairs}
+            self.means = {f: self.means[f] + deltas[f]*(n_b/n) for f in self.fields}
+        self.count = n
+
+    def merge(self, other):
+        """Return a new Accumulator with the combined state of self and `other`."""
+        if set(self.pairs) != set(other.pairs) or self.dims != other.dims:
+            raise ValueError('can only merge accumulators of the same fields, covariances and dims')
+        merged = self._empty_like()
+        merged._merge_state(self)
+        merged._merge_state(other)
+        return merged
+
+    @classmethod
+    def combine(cls, accumulators):
+        """Merge a sequence of accumulators, e.g. returned by worker processes."""
+        accumulators = list(accumulators)
+        total = accumulators[0]._empty_like()
+        for acc in accumulators:
+            total = total.merge(acc)
+        return total
+
+    @classmethod
+    def from_dataset(cls, data, fields, covariances=(), dim='time', ddof=0):
+        """Rebuild an Accumulator from the output of `to_dataset`, e.g. to
+        merge statistics that were saved to disk."""
+        acc = cls(fields, covariances, dim)
+        acc.count = int(data.attrs['count'])
+        acc.means = {f: data[f] for f in acc.fields}
+        for a, b in acc.pairs:
+            stat = data['{}_var'.format(a) if a == b else '{}_{}_cov'.format(a, b)]
+            acc.comoments[(a, b)] = stat*(acc.count - ddof)
+        return acc
+
+    def mean(self, field):
+        """The mean of `field`."""
+        return self.means[field].rename(field)
+
+    def covariance(self, a, b, ddof=0):
+        """The covariance of fields `a` and `b`, e.g. the eddy flux a'b'."""
+        key = _pair(a, b)
+        if key not in self.comoments:
+            raise KeyError('covariance of {!r} and {!r} was not accumulated'.format(a, b))
+        if self.count <= ddof:
+            raise ValueError('not enough values for ddof={:d}'.format(ddof))
+        return (self.comoments[key] / (self.count - ddof)).rename('{}_{}_cov'.format(a, b) if a != b else '{}_var'.format(a))
+
+    def variance(self, field, ddof=0):
+        """The variance of `field`."""
+        return self.covariance(field, field, ddof=ddof)
+
+    def to_dataset(self, ddof=0):
+        """All statistics as a Dataset: the mean of each field under its own
+        name, variances as '<field>_var', covariances as '<a>_<b>_cov'."""
+        stats = [self.mean(f) for f in self.fields]
+        stats += [self.covariance(a, b, ddof=ddof) for a, b in self.pairs]
+        result = xr.merge(stats)
+        result.attrs['count'] = self.count
+        return result
+
+
+def accumulate(pieces, fields, covariances=(), dim='time'):
+    """Accumulate the statistics of an iterable of datasets in one pass.
+
+    `pieces` may be e.g. the datasets of consecutive output files, or the
+    time slices of one large dataset.  Returns an `Accumulator`.
+    """
+    acc = Accumulator(fields, covariances, dim)
+    for piece in pieces:
+        acc.update(piece)
+    return acc
@@ -1,12 +1,12 @@
 # -*- coding:utf-8 -*-
 import numpy as np
-import xarray.ufuncs as xruf
 
 import iscaxr as ixr
+from iscaxr.util import extremum_coord
 from iscaxr.constants import grav, R_dry, omega
 
 
-def brunt_vaisala(data):
+def brunt_vaisala(data, theta=None, dz=None):
     """Calculate the Brunt-Vaisala (N^2) frequency for an Isca dataset.
     Following Vallis (2017) p.97
 
@@ -16,17 +16,26 @@ def brunt_vaisala(data):
     ----------
         data : xarray.DataSet
         The Isca dataset.  Requires fields 'temp', 'ps', 'pfull' and 'phalf'
+        theta, dz : xarray.DataArray, optional
+        Precomputed potential temperature and layer thickness for `data`.
+        Calculated if not given.
 
     Returns a new xarray.DataArray of N^2 values on phalf levels, in s^-2.
     """
     # Brunt Vaisala on phalf as per src/atmos_param/mg_drag/mg_drag.f90
-    theta = ixr.pot_temp(data)
+    if theta is None:
+        theta = ixr.pot_temp(data)
+    if dz is None:
+        dz = ixr.domain.calculate_dz(data)
     theta_h = ixr.domain.pfull_to_phalf(theta, data)
-    dz = ixr.domain.calculate_dz(data)
     dtheta = ixr.domain.diff_pfull(theta, data)
     return grav/theta_h*dtheta/dz
 
-def eady_growth_rate(data):
+def coriolis(lat, omega=omega):
+    """The Coriolis parameter f = 2Ω sin(lat), for latitude in degrees."""
+    return 2.0*omega*np.sin(np.deg2rad(lat))
+
+def eady_growth_rate(data, N2=None, dz=None):
     """Calculate the local Eady Growth rate.
     Following Vallis (2017) p.354.
 
@@ -36,21 +45,69 @@ def eady_growth_rate(data):
     ----------
         data : xarray.DataSet
         The Isca dataset.  Requires fields 'temp', 'ps', 'pfull' and 'phalf'
+        N2, dz : xarray.DataArray, optional
+        Precomputed Brunt-Vaisala frequency and layer thickness for `data`.
+        Calculated if not given.
 
     Returns a new xarray.DataArray of growth rate values on phalf levels,
     in s^-1.
     """
-    N2 = ixr.brunt_vaisala(data)
-    f = 2.0*omega*xruf.sin(xruf.deg2rad(data.lat))
+    if dz is None:
+        dz = ixr.domain.calculate_dz(data)
+    if N2 is None:
+        N2 = ixr.brunt_vaisala(data, dz=dz)
+    f = coriolis(data.lat)
 
-    dz = ixr.domain.calculate_dz(data)
     du = ixr.domain.diff_pfull(data.ucomp, data)
 
-    N = xruf.sqrt(N2.where(N2 > 0))
+    N = np.sqrt(N2.where(N2 > 0))
 
     egr = 0.31*du/dz*f/N
     return np.abs(egr)
 
 
 def eddy(field, dim='time'):
-    return field - field.mean(dim)
\ No newline at end of file
+    return field - field.mean(dim)
+
+
+def _in_lat_range(field, lat_range):
+    if 'lon' in field.dims:
+        field = field.mean('lon')
+    if lat_range is not None:
+        lat = field.lat.values
+        field = field.isel(lat=np.flatnonzero((lat >= min(lat_range)) & (lat <= max(lat_range))))
+    return field
+
+def jet_latitude(u, lat_range=None, refine=True):
+    """The latitude of the maximum zonal-mean zonal wind.
+
+    Parameters
+    ----------
+        u : xarray.DataArray
+        Zonal wind, e.g. `data.ucomp.sel(pfull=250, method='nearest')` or
+        vertically averaged.  The zonal mean is taken if `u` has a `lon` dimension.
+        lat_range : (float, float), optional
+        Only search between these latitudes, e.g. (0, 90) for the northern
+        hemisphere jet.  Default: all latitudes.
+        refine : bool, optional
+        Refine the latitude between grid points with a parabolic fit.  Default: True
+
+    Returns a DataArray of the jet latitude for each slice of the remaining
+    dimensions, e.g. for every time.
+    """
+    return extremum_coord(_in_lat_range(u, lat_range), 'lat', 'max', refine)
+
+def itcz_latitude(precip, lat_range=(-30, 30), refine=True):
+    """The latitude of the ITCZ, as the maximum of zonal-mean precipitation.
+
+    Parameters
+    ----------
+        precip : xarray.DataArray
+        Precipitation (or another field peaking at the ITCZ, such as
+        -omega).  The zonal mean is taken if it has a `lon` dimension.
+        lat_range : (float, float), optional
+        Only search between these latitudes.  Default: the tropics, (-30, 30)
+        refine : bool, optional
+        Refine the latitude between grid points with a parabolic fit.  Default: True
+    """
+    return extremum_coord(_in_lat_range(precip, lat_range), 'lat', 'max', refine)
@@ -0,0 +1,136 @@
+"""Derived variables of Isca datasets, resolved through a dependency graph.
+
+Each derived variable is registered with the dataset variables it reads
+(`inputs`) and the other derived variables it is built from (`deps`).
+`DerivedVariables` computes each one at most once per dataset, so asking
+for N^2, the Eady growth rate and θ together computes θ and dz only once.
+For dask-backed datasets everything stays lazy: the derived variables share
+their intermediates in a single task graph, and computing them together,
+e.g. `ds.isca.derive('N2', 'egr').compute()`, evaluates each only once.
+
+Usually accessed through the `ds.isca` accessor, see `iscaxr.xarray_extensions`.
+"""
+import numpy as np
+import xarray as xr
+
+import iscaxr.domain
+from iscaxr.grid import get_grid
+from .thermodynamics import pot_temp
+from .atmosphere import brunt_vaisala, eady_growth_rate, coriolis
+from .mass_streamfunction import mass_streamfunction
+
+# name -> (function, inputs, deps)
+DERIVED = {}
+
+
+def derived(name, inputs=(), deps=()):
+    """Register a derived variable.
+
+    The decorated function is called as `fn(data, **deps)` with the values of
+    the derived variables named in `deps`.  `inputs` names the variables and
+    coordinates of the dataset that it reads directly.
+    """
+    def register(fn):
+        DERIVED[name] = (fn, tuple(inputs), tuple(deps))
+        return fn
+    return register
+
+@derived('theta', inputs=('temp', 'pfull', 'phalf'))
+def _theta(data):
+    return pot_temp(data)
+
+@derived('dz', inputs=('temp', 'ps', 'pfull', 'phalf'))
+def _dz(data):
+    return iscaxr.domain.calculate_dz(data)
+
+@derived('dp', inputs=('pfull', 'phalf'))
+def _dp(data):
+    return iscaxr.domain.calculate_dp(data)
+
+@derived('f', inputs=('lat',))
+def _f(data):
+    return coriolis(data.lat)
+
+@derived('N2', inputs=('pfull', 'phalf'), deps=('theta', 'dz'))
+def _n2(data, theta, dz):
+    return brunt_vaisala(data, theta=theta, dz=dz)
+
+@derived('egr', inputs=('ucomp', 'lat', 'pfull', 'phalf'), deps=('N2', 'dz'))
+def _egr(data, N2, dz):
+    return eady_growth_rate(data, N2=N2, dz=dz)
+
+@derived('streamfunction', inputs=('vcomp', 'ps', 'lat', 'latb', 'lon', 'lonb', 'pfull', 'phalf'))
+def _streamfunction(data):
+    return mass_streamfunction(data, grid=get_grid(data))
+
+
+class DerivedVariables(object):
+    """Memoized derived variables of a single Isca dataset.
+
+    Results are cached along with the data of the dataset variables they
+    were computed from, and recomputed if any of those variables has since
+    been replaced, e.g. by `ds['temp'] = new_temp`, or a coordinate changed.
+    """
+    def __init__(self, data, registry=DERIVED):
+        self.data = data
+        self.registry = registry
+        self._cache = {}
+
+    def __contains__(self, name):
+        return name in self.registry
+
+    def __iter__(self):
+        return iter(self.registry)
+
+    def _fingerprint(self, name):
+        # identifies the dataset variables that `name` was derived from
+        fn, inputs, deps = self.registry[name]
+        variables = self.data.variables
+        return (tuple(_input_key(variables.get(v)) for v in inputs)
+                + tuple(self._fingerprint(d) for d in deps))
+
+    def get(self, name):
+        """Return derived variable `name`, computing it if necessary."""
+        if name not in self.registry:
+            raise KeyError('unknown derived variable {!r}. Available: {}'.format(
+                name, ', '.join(sorted(self.registry))))
+        fn, inputs, deps = self.registry[name]
+        fingerprint = self._fingerprint(name)
+        cached = self._cache.get(name)
+        if cached is not None and _same(cached[0], fingerprint):
+            return cached[1]
+        value = fn(self.data, **{d: self.get(d) for d in deps})
+        value.name = name
+        self._cache[name] = (fingerprint, value)
+        return value
+
+    def clear(self):
+        """Discard all cached values."""
+        self._cache.clear()
+
+
+class _CoordKey(object):
+    # coordinates are rebuilt whenever a dataset is updated, so are compared
+    # by value rather than identity.  They are small.
+    def __init__(self, values):
+        self.values = values
+
+    def __eq__(self, other):
+        return isinstance(other, _CoordKey) and np.array_equal(self.values, other.values)
+
+def _input_key(variable):
+    # data variables keep the same backing array until they are replaced.
+    # Use the array itself (numpy, dask or a lazily indexed file) rather
+    # than `.data`, which reads a file-backed variable into a new ndarray.
+    if variable is None:
+        return None
+    if isinstance(variable, xr.IndexVariable):
+        return _CoordKey(variable.values)
+    return variable._data
+
+def _same(a, b):
+    if isinstance(a, tuple):
+        return isinstance(b, tuple) and len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, _CoordKey):
+        return a == b
+    return a is b
@@ -5,6 +5,8 @@ import xarray as xr
 
 import iscaxr.domain
 from iscaxr.util import grid_var
+from iscaxr.grid import get_grid, match_grid
+from iscaxr.cache import cached
 from iscaxr.constants import Rad_earth
 
 def sublon(time, omega, alpha, a=Rad_earth):
@@ -22,6 +24,8 @@ def g_sublon(dataset, omega, alpha, a=Rad_earth):
     lon = dataset.lon.copy()
     def msublon(t):
         return grid_var(sublon(t, omega, alpha, a), lon)
+    # identifies the function to `iscaxr.cache`, so results depending on it can be cached
+    msublon.cache_key = ('g_sublon', lon.values, float(omega), float(alpha), float(a))
     return msublon
 
 
@@ -50,46 +54,88 @@ def norm(field):
     else:
         return iscaxr.util.normalize(field, dims='lon0')
 
+@cached
 def lon_to_xi(field, lon0, wrap=True):
-    """Move a DataArray from a fixed (lat, lon) frame of reference
-    to (lat, substellar lon) that moves with the forcing."""
-    if field.time.shape:  # is an array, iterate over recursively(!)
-        return xr.concat([lon_to_xi(field.sel(time=t), lon0, wrap=wrap) for t in field.time], dim=field.time)
-    else:                 # single snapshot in time
-        lon0 = lon0(field.time) if callable(lon0) else lon0
-        return  field.pipe(iscaxr.domain.center_lon, lon=lon0, wrap=wrap)#.rename({'lon': 'xi'})
+    """Move a DataArray or Dataset from a fixed (lat, lon) frame of reference
+    to (lat, substellar lon) that moves with the forcing.
+
+    Parameters
+    ----------
+    field : xarray.DataArray or xarray.Dataset
+        The field(s) to transform.  All variables with a `lon` dimension are
+        moved into the substellar frame.
+    lon0 : float, xarray.DataArray or function
+        The substellar longitude.  Either fixed, given for each time, or a
+        function of time such as one generated by `g_sublon`.
+    wrap : boolean, optional
+        If `True` (default) the substellar longitude ranges [-180, 180].
+
+    The substellar longitude at each time is moved to the nearest grid point
+    and all timesteps are shifted in a single gather, which stays lazy
+    for dask-backed fields.
+    """
+    lon0 = lon0(field.time) if callable(lon0) else lon0
+    return field.pipe(iscaxr.domain.center_lon, lon=lon0, wrap=wrap)#.rename({'lon': 'xi'})
+
+def _illumination_weights(grid):
+    # (lon0, lon): max(cos(lon - lon0), 0) for a substellar point at each lon0
+    radlon = np.deg2rad(grid.lon.values)
+    plon = np.cos(radlon[np.newaxis, :] - radlon[:, np.newaxis])
+    return np.maximum(plon, 0.0)
+
+def _apply_phase_weights(values, area, plon):
+    # values: (..., lat, lon) -> (..., lon0).  Reduce latitude with the area
+    # weights first, then apply the (lon0, lon) illumination matrix, so no
+    # temporary is ever larger than the input.
+    zonal = np.einsum('...ij,ij->...j', values, area)
+    return zonal @ plon.T
+
+def _phase_curve(field, area, plon, lat, lon):
+    # the weights are applied by position
+    field = match_grid(field, lat, lon)
+    if field.chunks is not None:
+        field = field.chunk({'lat': -1, 'lon': -1})
+    dtype = np.result_type(field.dtype, area.dtype)
+    pc = xr.apply_ufunc(_apply_phase_weights, field,
+                        input_core_dims=[['lat', 'lon']],
+                        output_core_dims=[['lon0']],
+                        kwargs={'area': area.astype(dtype), 'plon': plon.astype(dtype)},
+                        dask='parallelized',
+                        output_dtypes=[dtype],
+                        dask_gufunc_kwargs={'output_sizes': {'lon0': len(lon)}})
+    return pc.assign_coords(lon0=lon)
 
 def make_phase_curve_calculator(domain, radius=Rad_earth):
-    rad  = np.pi / 180
-    radlon = domain.lon * rad
-    lon0 = radlon.copy(deep=True)
-    lon0.name = 'lon0'
-    lon0 = lon0.rename({'lon': 'lon0'})
-
-    plon = np.cos(radlon - lon0)
-    plon.values[plon.values < 0] = 0     # adjust for max(cos(lon - lon0), 0.0)
-
-    coslat = np.cos(domain.lat * rad)
-    dA = iscaxr.domain.calculate_dA(domain)
+    """Generate a phase curve calculator for a domain.
+
+    `domain` may be an Isca dataset or an IscaGrid.
+
+    The weights of every grid cell for every substellar longitude `lon0`,
+    dA*coslat*max(cos(lon - lon0), 0), are computed once.  They factorise
+    into an area weight on (lat, lon) and a (lon0, lon) illumination
+    matrix, which are applied to each (dask) chunk of the field in turn,
+    so memory use stays proportional to the size of the field.  The field
+    must be on the same grid, though its points may be in a different
+    order, e.g. after `center_lon`.
+    """
+    grid = get_grid(domain)
+    area = (grid.dA*grid.coslat).transpose('lat', 'lon').values
+    plon = _illumination_weights(grid)
+    lat, lon = grid.lat.values, grid.lon.values
     def phase_curve(field):
-        pc = (field*dA*coslat*plon).sum(('lat', 'lon'))
-        return pc
+        return _phase_curve(field, area, plon, lat, lon)
     return phase_curve
 
 def make_phase_curve_calculator_mean(domain, radius=Rad_earth):
-    rad  = np.pi / 180
-    radlon = domain.lon * rad
-    lon0 = radlon.copy(deep=True)
-    lon0.name = 'lon0'
-    lon0 = lon0.rename({'lon': 'lon0'})
-
-    plon = np.cos(radlon - lon0)
-    plon.values[plon.values < 0] = 0     # adjust for max(cos(lon - lon0), 0.0)
-
-    coslat = np.cos(domain.lat * rad)
+    """Generate an area-mean phase curve calculator for a domain.
+
+    `domain` may be an Isca dataset or an IscaGrid.  As for
+    `make_phase_curve_calculator`, the weights are computed once."""
+    grid = get_grid(domain)
+    dA = grid.dA.transpose('lat', 'lon').values
+    area = dA / dA.sum()
+    plon = _illumination_weights(grid)
+    lat, lon = grid.lat.values, grid.lon.values
     def phase_curve(field):
-        surf_int = iscaxr.domain.make_surf_integrator(d, radius=radius)
-        surf_mean = lambda d: surf_int(d) / surf_int(1)
-        pc = surf_mean(field*plon)
-        return pc.rename({'lon0': 'lon'})
-    return phase_curve
\ No newline at end of file
+        return _phase_curve(field, area, plon, lat, lon).rename({'lon0': 'lon'})
+    return phase_curve
@@ -1,9 +1,23 @@
 import numpy as np
 import xarray as xr
 
-from iscaxr.constants import grav, Rad_earth
+from iscaxr.constants import grav, Rad_earth, omega, Cp_dry
+from iscaxr.grid import get_grid
+from iscaxr.domain import calculate_dp
 
-def mass_streamfunction(data, v_field='vcomp', a=Rad_earth, g=grav):
+def _layer_mass(data, grid, ps_field):
+    # pressure thickness of each layer: per column on sigma levels if the
+    # surface pressure is available, otherwise the fixed reference levels
+    if ps_field is not None and ps_field in data:
+        return calculate_dp(grid, data[ps_field])
+    return grid.dp
+
+def _zonal_mean(field):
+    if 'lon' in field.dims:
+        return field.mean('lon')
+    return field
+
+def mass_streamfunction(data, v_field='vcomp', a=Rad_earth, g=grav, grid=None, ps_field='ps'):
     """Calculate the mass streamfunction for the atmosphere.
 
     Based on a vertical integral of the meridional wind.
@@ -19,15 +33,77 @@ def mass_streamfunction(data, v_field='vcomp', a=Rad_earth, g=grav):
         The radius of the planet. Default: Earth 6317km
     g : float, optional
         Surface gravity. Default: Earth 9.8m/s^2
+    grid : IscaGrid, optional
+        Precomputed grid geometry for `data`.  If None, the (cached) grid
+        of `data` is used.
+    ps_field : str, optional
+        The name of the surface pressure field, in Pa.  If present in `data`,
+        layer thicknesses are calculated for each column from the surface
+        pressure on sigma levels, otherwise the fixed `phalf` levels are used.
+        Default: 'ps'
 
     Returns
     -------
     streamfunction : xarray.DataArray
         The meridional mass streamfunction.
     """
-    if 'lon' in data[v_field].dims:
-        vbar = data[v_field].mean('lon')
-    c = 2*np.pi*a*np.cos(vbar.lat*np.pi/180) / g
-    # take a diff of half levels, and assign to pfull coordinates
-    dp = xr.DataArray(data.phalf.diff('phalf').values*100, coords=[('pfull', data.pfull)])
-    return c*(vbar*dp).cumsum(dim='pfull')
+    grid = get_grid(data if grid is None else grid)
+    dp = _layer_mass(data, grid, ps_field)
+    c = 2*np.pi*a*grid.coslat / g
+    vdp = _zonal_mean(data[v_field]*dp)
+    return c*vdp.cumsum(dim='pfull')
+
+def meridional_transports(data, v_field='vcomp', u_field='ucomp', t_field='temp', q_field='sphum',
+                          a=Rad_earth, g=grav, omega=omega, cp=Cp_dry, grid=None, ps_field='ps'):
+    """Calculate the mass streamfunction and the vertically integrated
+    meridional transports of the atmosphere.
+
+    All quantities share the same mass-weighted vertical integration,
+    and for dask-backed data are calculated lazily, chunk by chunk in time.
+    Ref: Physics of Climate, Peixoto & Oort, 1992.
+
+    Parameters
+    ----------
+    data :  xarray.DataSet
+        Isca output data
+    v_field, u_field, t_field, q_field : str, optional
+        The names of the meridional wind, zonal wind, temperature and
+        specific humidity fields in `data`.  Transports of fields that are
+        not present in `data` are omitted.
+    a : float, optional
+        The radius of the planet. Default: Earth 6317km
+    g : float, optional
+        Surface gravity. Default: Earth 9.8m/s^2
+    omega : float, optional
+        Planetary rotation rate. Default: Earth 7.292e-5 s^-1
+    cp : float, optional
+        Specific heat capacity of air. Default: dry air 1003 J.kg^-1.K^-1
+    grid : IscaGrid, optional
+        Precomputed grid geometry for `data`.
+    ps_field : str, optional
+        The name of the surface pressure field, see `mass_streamfunction`.
+
+    Returns
+    -------
+    transports : xarray.Dataset
+        - `streamfunction`: the meridional mass streamfunction, kg.s^-1
+        - `heat`: northward transport of sensible heat cp*T, W
+        - `moisture`: northward transport of water vapour, kg.s^-1
+        - `angular_momentum`: northward transport of absolute angular
+           momentum (Ωa cos(lat) + u) a cos(lat), kg.m^2.s^-2
+    """
+    grid = get_grid(data if grid is None else grid)
+    dp = _layer_mass(data, grid, ps_field)
+    c = 2*np.pi*a*grid.coslat / g
+    vdp = data[v_field]*dp
+
+    transports = xr.Dataset()
+    transports['streamfunction'] = _zonal_mean(vdp).cumsum(dim='pfull')*c
+    if t_field in data:
+        transports['heat'] = _zonal_mean(cp*data[t_field]*vdp).sum('pfull')*c
+    if q_field in data:
+        transports['moisture'] = _zonal_mean(data[q_field]*vdp).sum('pfull')*c
+    if u_field in data:
+        m = (omega*a*grid.coslat + data[u_field])*a*grid.coslat
+        transports['angular_momentum'] = _zonal_mean(m*vdp).sum('pfull')*c
+    return transports
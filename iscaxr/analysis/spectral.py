@@ -1,8 +1,10 @@
 # -*- coding:utf-8 -*-
+from functools import lru_cache
 
 import numpy as np
 import xarray as xr
-import spharm
+
+from iscaxr.cache import cached
 
 def window_taper(field, n=30, dim='time'):
     """Taper the ends of a field.  Useful for making non-periodic signals
@@ -16,12 +18,18 @@ def window_taper(field, n=30, dim='time'):
 
     Returns the field, tapered to zero at each end of the given dimension.
     """
-    taper = field[dim]*0 + 1
-    taper[:n] = (np.cos(np.linspace(-np.pi/2, 0, n))**2)
-    taper[-n:] = (np.cos(np.linspace(0, np.pi/2, n))**2)
+    taper = xr.DataArray(_taper_weights(len(field[dim]), n), coords=[field[dim]])
     return field*taper
 
-def fft(field, dim=None, axis=None, scaledim=None):
+def _taper_weights(length, n):
+    # cos^2 ramps from zero up to one over the first and last n samples
+    taper = np.ones(length)
+    if n > 0:
+        taper[:n] = (np.cos(np.linspace(-np.pi/2, 0, n))**2)
+        taper[-n:] = (np.cos(np.linspace(0, np.pi/2, n))**2)
+    return taper
+
+def fft(field, dim=None, axis=None, scaledim=None, real=False, power=False):
     """Calculate the FFT of a field along given dimensions.
 
     Parameters
@@ -37,6 +45,13 @@ def fft(field, dim=None, axis=None, scaledim=None):
         Dimensions for which the transformed coordinates should be scaled
         according to the input coordinates.  If not specified, transformed
         coordinates are given by whole wavenumbers over the given coordinate span.
+    real : bool, optional
+        If `True`, use a real-input transform.  The last transformed dimension
+        then only holds the non-negative frequencies, the other half of the
+        spectrum being redundant for real input.  Default: False.
+    power : bool, optional
+        If `True`, return the power |F|^2 rather than the complex transform.
+        Default: False.
 
     Returns
     -------
@@ -44,38 +59,72 @@ def fft(field, dim=None, axis=None, scaledim=None):
     transformed : xarray.DataArray
         The (complex) Fourier Transformed data.  Coordinate dimensions that have been transormed
         are named 'F_`dim`', other dimensions retain their original names.
-        The transformed data array has the same shape as the original DataArray.
+        The transformed data array has the same shape as the original DataArray,
+        except for the last transformed dimension when `real=True`.
+        Single precision input gives a single precision result.
+
+    Dask-backed fields are transformed lazily, provided that the transformed
+    dimensions are each held in a single chunk.
     """
     if dim is not None and axis is not None:
         raise ValueError("cannot supply both 'axis' and 'dim' arguments")
 
-    if dim is not None:
-        axis = np.atleast_1d(field.get_axis_num(dim))
+    if dim is None:
+        axis = range(field.ndim) if axis is None else np.atleast_1d(axis) % field.ndim
+        dims = [field.dims[ax] for ax in axis]
+    else:
+        dims = [str(d) for d in np.atleast_1d(dim)]
 
     if scaledim is None:
-        scaleaxis = []
+        scaledims = []
     else:
-        scaleaxis = np.atleast_1d(field.get_axis_num(scaledim))
+        scaledims = [str(d) for d in np.atleast_1d(scaledim)]
 
-    data = np.fft.fftn(field.values, axes=axis)
-    data = np.fft.fftshift(data, axes=axis)
-    transformed_axes = (range(field.ndim) if axis is None else axis % field.ndim)
-    coords = []
-    for ax, dim in enumerate(field.dims):
-        if ax in transformed_axes:
-            # assume a regular sample spacing, regardless of scaling
-            if ax in scaleaxis:
-                dx = field[dim].diff(dim).values[0]
-            else:
-                dx = 1./len(field[dim])
-            tcoord = np.fft.fftshift(np.fft.fftfreq(len(field[dim]), dx))
-            coords.append(('F_{}'.format(dim), tcoord))
+    coords = {}
+    for i, d in enumerate(dims):
+        # assume a regular sample spacing, regardless of scaling
+        if d in scaledims:
+            dx = field[d].diff(d).values[0]
+        else:
+            dx = 1./len(field[d])
+        if real and i == len(dims) - 1:
+            tcoord = np.fft.rfftfreq(len(field[d]), dx)
         else:
-            coords.append((dim, field[dim].values))
-    return xr.DataArray(data=data, coords=coords)
+            tcoord = np.fft.fftshift(np.fft.fftfreq(len(field[d]), dx))
+        coords['F_{}'.format(d)] = tcoord
+
+    dtype = np.result_type(field.dtype, np.complex64)
+    if power:
+        dtype = np.finfo(dtype).dtype
+    transformed = xr.apply_ufunc(_fftn, field,
+                                 input_core_dims=[dims],
+                                 output_core_dims=[list(coords)],
+                                 exclude_dims=set(dims),
+                                 kwargs={'naxes': len(dims), 'real': real, 'power': power},
+                                 dask='parallelized',
+                                 output_dtypes=[dtype],
+                                 dask_gufunc_kwargs={'output_sizes': {d: len(c) for d, c in coords.items()}})
+    transformed = transformed.assign_coords(coords)
+    return transformed.transpose(*['F_{}'.format(d) if d in dims else d for d in field.dims])
+
+def _fftn(values, naxes, real=False, power=False):
+    # transform over the last `naxes` axes of `values`
+    axes = tuple(range(-naxes, 0))
+    dtype = np.result_type(values.dtype, np.complex64)
+    if real:
+        data = np.fft.rfftn(values, axes=axes)
+        shift_axes = axes[:-1]
+    else:
+        data = np.fft.fftn(values, axes=axes)
+        shift_axes = axes
+    data = np.fft.fftshift(data, axes=shift_axes).astype(dtype, copy=False)
+    if power:
+        data = data.real**2 + data.imag**2
+    return data
 
 
-def zonal_dispersion(field, dt=1):
+@cached
+def zonal_dispersion(field, dt=1, nperseg=None, noverlap=None, ntaper=None, power=False):
     """Calculate the power spectra in time and longitude for an Isca dataset.
 
     Parameters
@@ -83,12 +132,29 @@ def zonal_dispersion(field, dt=1):
 
         field : an Isca DataArray to transform.  At a minimum, must have 'time' and 'lon' dimensions.
         dt : Time interval, in days, between samples.
+        nperseg : Length of each time segment, in samples.  If given, the
+            spectrum is estimated Welch-style: the time series is split into
+            overlapping segments, each has its mean removed and is tapered
+            with `window_taper`, and the power spectra of the segments
+            are averaged.  Memory use is then set by the segment length,
+            not the length of the run.  If None (default) a single transform
+            is taken over the whole time series.
+        noverlap : Number of samples shared by consecutive segments.
+            Default: nperseg//2.
+        ntaper : Length of the taper at each end of a segment.  Default: nperseg//10.
+        power : If True, return the power (squared amplitude) rather than the
+            amplitude of the spectrum.  When segmented, the power of the
+            segments is averaged, and the amplitude is its square root.
 
     Returns a xarray DataArray with dimensions:
         - 'time' replaced by 'freq', in cycles per day,
         - 'lon' replaced by 'k', in global wavenumber.
         - All other dimensions of `field` are preserved.
     """
+    if nperseg is not None:
+        spectrum = _segmented_dispersion(field, dt, nperseg, noverlap, ntaper)
+        return spectrum if power else np.sqrt(spectrum)
+
     time_dim = field.dims.index('time')
     lon_dim = field.dims.index('lon')
     ft = np.fft.fft2(field, axes=(time_dim, lon_dim))
@@ -97,8 +163,7 @@ def zonal_dispersion(field, dt=1):
     ft = ft[::-1]
     ft = np.fft.fftshift(ft)
 
-    # convert to a power spectra
-    ft = np.abs(ft)
+    ft = ft.real**2 + ft.imag**2 if power else np.abs(ft)
 
     om = np.fft.fftshift(np.fft.fftfreq(len(field.time), d=dt))
     k = np.fft.fftshift(np.fft.fftfreq(len(field.lon), d=1./len(field.lon)))
@@ -119,22 +184,265 @@ def zonal_dispersion(field, dt=1):
     ftr = ftr.sel(freq=slice(0, None))
     return ftr
 
+def _segment_starts(length, nperseg, noverlap):
+    if noverlap is None:
+        noverlap = nperseg//2
+    if not 0 <= noverlap < nperseg <= length:
+        raise ValueError('need 0 <= noverlap < nperseg <= length of time series')
+    return range(0, length - nperseg + 1, nperseg - noverlap)
+
+def _segment_power(values, ntaper):
+    # values: (..., time, lon) segment of a real field.
+    values = values - values.mean(axis=-2, keepdims=True)
+    values = values * _taper_weights(values.shape[-2], ntaper)[:, np.newaxis].astype(values.dtype)
+    # real input: the rfft in time keeps only the freq >= 0 half of the spectrum
+    ft = np.fft.fft(np.fft.rfft(values, axis=-2), axis=-1)
+    # fourier transform in numpy is defined by exp(-2π i (kx + wt))
+    # but we want exp(kx - wt) so need to negate the x-domain
+    ft = np.roll(ft[..., ::-1], 1, axis=-1)
+    ft = np.fft.fftshift(ft, axes=-1)
+    power = ft.real**2 + ft.imag**2
+    return power.astype(np.result_type(values.dtype, np.float32), copy=False)
+
+def _segments_power(field, starts, nperseg, ntaper):
+    # summed power spectra of the segments of `field` starting at `starts`.
+    # For numpy data only one segment is in memory at once, for dask data
+    # the segments are independent tasks in a lazy sum.
+    power = None
+    for i0 in starts:
+        segment = field.isel(time=slice(i0, i0+nperseg))
+        p = xr.apply_ufunc(_segment_power, segment,
+                           input_core_dims=[['time', 'lon']],
+                           output_core_dims=[['freq', 'k']],
+                           exclude_dims={'time', 'lon'},
+                           kwargs={'ntaper': ntaper},
+                           dask='parallelized',
+                           output_dtypes=[np.result_type(field.dtype, np.float32)],
+                           dask_gufunc_kwargs={'output_sizes': {'freq': nperseg//2+1, 'k': len(field.lon)},
+                                               'allow_rechunk': True})
+        power = p if power is None else power + p
+    return power
+
+def _dispersion_coords(nperseg, nlon, dt):
+    return {'freq': np.fft.rfftfreq(nperseg, d=dt),
+            'k': np.fft.fftshift(np.fft.fftfreq(nlon, d=1./nlon))}
+
+def _segmented_dispersion(field, dt, nperseg, noverlap, ntaper):
+    if ntaper is None:
+        ntaper = nperseg//10
+    starts = _segment_starts(len(field.time), nperseg, noverlap)
+    power = _segments_power(field, starts, nperseg, ntaper) / len(starts)
+
+    dims = [{'time': 'freq', 'lon': 'k'}.get(d, d) for d in field.dims]
+    power = power.transpose(*dims)
+    power = power.assign_coords(_dispersion_coords(nperseg, len(field.lon), dt))
+    power.attrs['nsegments'] = len(starts)
+    return power
+
+def _mirror_indices(lat, lat_cutoff=None):
+    # indices of the latitudes in [0, lat_cutoff], and of their reflections
+    # in the equator.  Latitudes without a reflection are left out.
+    lat = np.asarray(lat)
+    north = np.flatnonzero((lat >= 0) & (lat <= (np.inf if lat_cutoff is None else lat_cutoff)))
+    mirror = np.abs(lat[np.newaxis, :] + lat[north, np.newaxis]).argmin(axis=1)
+    keep = np.isclose(lat[mirror], -lat[north])
+    return north[keep], mirror[keep]
+
+def symmetric_components(field, lat_cutoff=None):
+    """Split a field into its parts symmetric and antisymmetric about the equator.
+
+    Parameters
+    ----------
+        field : xarray.DataArray with a 'lat' dimension, in any order.
+        lat_cutoff : Only return latitudes up to `lat_cutoff`.  Default: all.
+
+    Returns (symmetric, antisymmetric), 0.5*(f(lat) ± f(-lat)), on the
+    latitudes >= 0.  Both are gathered with index arrays, so lazy fields
+    stay lazy and the field itself is never modified.
+    """
+    north, mirror = _mirror_indices(field.lat.values, lat_cutoff)
+    nh = field.isel(lat=north)
+    sh = field.isel(lat=mirror).assign_coords(lat=nh.lat.values)
+    return 0.5*(nh + sh), 0.5*(nh - sh)
+
 def equatorial_waves(field, lat_cutoff=8, symmetric=True):
     """Calculate zonal equatorial wavenumbers.
 
-    Either symmetric or antisymmetric waves.
+    Either symmetric or antisymmetric waves.  See `wheeler_kiladis` for the
+    full wavenumber-frequency spectra.
 
     Returns the wave spectra in the zonal direction."""
-    nh = field.sel(lat=slice(0, lat_cutoff))
-    sh = field.sel(lat=slice(-lat_cutoff, 0))
-    sh.lat.values = -sh.lat.values
-
-    if symmetric:
-        sym_field = 0.5*(nh + sh)
-    else:
-        sym_field = 0.5*(nh - sh)
+    sym_field, antisym_field = symmetric_components(field, lat_cutoff)
+    if not symmetric:
+        sym_field = antisym_field
 
     return sym_field.pipe(fft, dim='lon').pipe(np.abs).mean('lat')
+
+
+# passes of the 1-2-1 filter in frequency used to estimate the background
+# spectrum, for frequencies (cycles per day) below each limit.  As in
+# Wheeler & Kiladis (1999).
+BACKGROUND_FREQ_PASSES = ((0.1, 1), (0.2, 2), (0.3, 3), (np.inf, 5))
+
+def _smooth_121(values, axis, passes):
+    # repeated 1-2-1 filter along `axis`, leaving the end points unchanged
+    values = np.moveaxis(values, axis, -1).copy()
+    for _ in range(passes):
+        values[..., 1:-1] = 0.25*values[..., :-2] + 0.5*values[..., 1:-1] + 0.25*values[..., 2:]
+    return np.moveaxis(values, -1, axis)
+
+def _background(power, freq, k_passes):
+    # power: (..., freq, k)
+    power = _smooth_121(power, -1, k_passes)
+    smoothed = np.empty_like(power)
+    lower = -np.inf
+    for upper, passes in BACKGROUND_FREQ_PASSES:
+        band = (freq >= lower) & (freq < upper)
+        smoothed[..., band, :] = _smooth_121(power, -2, passes)[..., band, :]
+        lower = upper
+    return smoothed
+
+
+class WheelerKiladis(object):
+    """Wheeler-Kiladis wavenumber-frequency spectra, accumulated in a stream.
+
+    The equatorial field is split into its symmetric and antisymmetric parts
+    and cut into overlapping time segments.  Each segment has its mean
+    removed and is tapered, and the power of its 2-D (time, lon) transform
+    is summed over latitude.  Pieces of the time series are added in turn
+    with `update`, e.g. a year of output at a time, and segments spanning
+    two pieces are handled by keeping the end of the previous piece, so
+    memory use is bounded by the size of a piece.  The segments of a piece
+    are transformed in parallel when it is dask-backed.
+
+        >>> wk = WheelerKiladis(dt=0.25, nperseg=96*4)
+        >>> for path in files:
+        ...     wk.update(xr.open_dataset(path).precip)
+        >>> spectra = wk.result()
+
+    Parameters
+    ----------
+        dt : Time interval, in days, between samples.
+        nperseg : Length of each time segment, in samples.  Default: 96
+        noverlap : Number of samples shared by consecutive segments.
+            Default: nperseg//2.
+        ntaper : Length of the taper at each end of a segment.  Default: nperseg//10.
+        lat_cutoff : Latitudes from the equator to include.  Default: 15
+        k_passes : Passes of the 1-2-1 filter in wavenumber for the background.
+            Default: 10
+
+    Seasonal cycles and trends should be removed from the field beforehand.
+    """
+    def __init__(self, dt=1, nperseg=96, noverlap=None, ntaper=None, lat_cutoff=15, k_passes=10):
+        self.dt = dt
+        self.nperseg = nperseg
+        self.noverlap = nperseg//2 if noverlap is None else noverlap
+        self.ntaper = nperseg//10 if ntaper is None else ntaper
+        self.lat_cutoff = lat_cutoff
+        self.k_passes = k_passes
+        self.nsegments = 0
+        self._power = None
+        self._remainder = None
+
+    def update(self, field):
+        """Add the next piece of the time series.  Returns self."""
+        if self._remainder is not None:
+            field = xr.concat([self._remainder, field], dim='time')
+        length = len(field.time)
+        next_start = 0
+        if length >= self.nperseg:
+            starts = _segment_starts(length, self.nperseg, self.noverlap)
+            symmetric, antisymmetric = symmetric_components(field, self.lat_cutoff)
+            power = xr.Dataset({
+                'symmetric': _segments_power(symmetric, starts, self.nperseg, self.ntaper).sum('lat'),
+                'antisymmetric': _segments_power(antisymmetric, starts, self.nperseg, self.ntaper).sum('lat'),
+            }).compute()
+            self._power = power if self._power is None else self._power + power
+            self.nsegments += len(starts)
+            next_start = starts[-1] + self.nperseg - self.noverlap
+        # the samples still needed by later segments
+        self._remainder = field.isel(time=slice(next_start, None)).compute()
+        return self
+
+    def result(self):
+        """The spectra averaged over all segments so far, as a Dataset of
+
+            - symmetric, antisymmetric : the raw power spectra,
+            - background : the smoothed mean of the two,
+            - symmetric_norm, antisymmetric_norm : the spectra divided by the background,
+
+        with dimensions 'freq' (cycles per day, >= 0) and 'k' (global
+        wavenumber, positive eastward), along with any other dimensions
+        of the field."""
+        if self._power is None:
+            raise ValueError('need at least one complete segment of {:d} samples'.format(self.nperseg))
+        spectra = self._power / self.nsegments
+        spectra = spectra.assign_coords(_dispersion_coords(self.nperseg, spectra.sizes['k'], self.dt))
+        background = xr.apply_ufunc(_background, 0.5*(spectra.symmetric + spectra.antisymmetric),
+                                    input_core_dims=[['freq', 'k']],
+                                    output_core_dims=[['freq', 'k']],
+                                    kwargs={'freq': spectra.freq.values, 'k_passes': self.k_passes})
+        spectra['background'] = background.transpose(*spectra.symmetric.dims)
+        spectra['symmetric_norm'] = spectra.symmetric / spectra.background
+        spectra['antisymmetric_norm'] = spectra.antisymmetric / spectra.background
+        spectra.attrs['nsegments'] = self.nsegments
+        return spectra
+
+def wheeler_kiladis(field, dt=1, nperseg=96, noverlap=None, ntaper=None, lat_cutoff=15, k_passes=10):
+    """Wheeler-Kiladis wavenumber-frequency spectra of an equatorial field.
+
+    `field` must have 'time', 'lat' and 'lon' dimensions.  See
+    `WheelerKiladis` for the parameters, and to accumulate the spectra of
+    a long time series piece by piece.
+    """
+    return WheelerKiladis(dt, nperseg, noverlap, ntaper, lat_cutoff, k_passes).update(field).result()
+
+@lru_cache(maxsize=32)
+def _spharm_transform(nlon, nlat, gridtype, ntrunc):
+    """Return a (cached) spherical harmonic transform object for a grid, and
+    the (m, n) indices of its spectral coefficients at truncation `ntrunc`."""
+    # spharm is only needed for spherical harmonics, and slow to import
+    import spharm
+    grid = spharm.Spharmt(nlon, nlat, gridtype=gridtype)
+    m, n = spharm.getspecindx(ntrunc)
+    return grid, m, n
+
+def _spharm_ready(field):
+    # need the field in N-S, E-W form, (..., lat, lon).  Reorder with index
+    # arrays, which stays lazy, and hold each horizontal slice in one chunk.
+    ilat = np.argsort(field.lat.values)[::-1]
+    ilon = np.argsort(field.lon.values)
+    vfield = field.isel(lat=ilat, lon=ilon)
+    if vfield.chunks is not None:
+        vfield = vfield.chunk({'lat': -1, 'lon': -1})
+    return vfield
+
+def _stack_columns(values):
+    # (..., nlat, nlon) -> (nlat, nlon, nt) as spharm expects
+    nlat, nlon = values.shape[-2:]
+    return np.moveaxis(values.reshape((-1, nlat, nlon)), 0, -1)
+
+def _grdtospec(values, gridtype, ntrunc):
+    nlat, nlon = values.shape[-2:]
+    grid, m, n = _spharm_transform(nlon, nlat, gridtype, ntrunc)
+    coeffs = grid.grdtospec(_stack_columns(values), ntrunc)
+    # put the coefficients into a grid, half of which will be empty
+    # due to the triangular trunctation
+    cc = np.zeros((ntrunc+1, ntrunc+1, coeffs.shape[-1]), dtype=np.complex128)
+    cc[m, n] = coeffs
+    return np.moveaxis(cc, -1, 0).reshape(values.shape[:-2] + (ntrunc+1, ntrunc+1))
+
+def _filter_grid(values, gridtype, l_cut):
+    nlat, nlon = values.shape[-2:]
+    ntrunc = nlat-1
+    grid, m, n = _spharm_transform(nlon, nlat, gridtype, ntrunc)
+    # transform to spherical modes, eliminate high wavenumbers and transform back
+    coeffs = grid.grdtospec(_stack_columns(values), ntrunc)
+    coeffs[(m + n) > l_cut] = 0
+    filtered = grid.spectogrd(coeffs).reshape((nlat, nlon, -1))
+    return np.moveaxis(filtered, -1, 0).reshape(values.shape).astype(values.dtype, copy=False)
+
+@cached
 def spht(field, ntrunc=None, gridtype='gaussian'):
     """Transform a field on lat-lon grid to spherical harmonics.
 
@@ -142,59 +450,40 @@ def spht(field, ntrunc=None, gridtype='gaussian'):
         - fields defined on the lat-lon points, not latb-lonb.
         - triangular truncation.
 
+    Transform objects are cached per grid and truncation.  Dask-backed
+    fields are transformed lazily, one chunk of the non-horizontal
+    dimensions at a time.
+
     Returns an xarray.DataArray
     """
-    nlat, nlon = len(field.lat), len(field.lon)
-    grid = spharm.Spharmt(nlon, nlat, gridtype=gridtype)
+    nlat = len(field.lat)
     if ntrunc is None:
         ntrunc = nlat-1
 
     other_dims = [d for d in field.dims if d not in ('lat', 'lon')]
 
-    # need the field in N-S, E-W form, (lat, lon, other coords)
-    vfield = (field
-              .sel(lat=sorted(cbbt.lat, reverse=True), lon=sorted(cbbt.lon))
-              .transpose('lat', 'lon', *other_dims)
-             )
-
     # calculate the spectral coefficients, given the truncation level
-    coeffs = grid.grdtospec(vfield.values, ntrunc)
-
-    m, n = spharm.getspecindx(ntrunc)
-
-    # put the coefficients into a grid, half of which will be empty
-    # due to the triangular trunctation
-    cc = np.zeros((ntrunc+1, ntrunc+1)+tuple(coeffs.shape[1:]), dtype=np.complex128)
-    cc[m, n] = coeffs
-    coords = [('m', np.arange(0,ntrunc+1)), ('n', np.arange(0, ntrunc+1))]
-    for d in other_dims:
-        coords.append((d, field.coords[d]))
-    return xr.DataArray(data=cc, coords=coords, name=field.name)
-
+    cc = xr.apply_ufunc(_grdtospec, _spharm_ready(field),
+                        input_core_dims=[['lat', 'lon']],
+                        output_core_dims=[['m', 'n']],
+                        kwargs={'gridtype': gridtype, 'ntrunc': ntrunc},
+                        dask='parallelized',
+                        output_dtypes=[np.complex128],
+                        dask_gufunc_kwargs={'output_sizes': {'m': ntrunc+1, 'n': ntrunc+1}})
+    cc = cc.assign_coords(m=np.arange(0, ntrunc+1), n=np.arange(0, ntrunc+1))
+    cc.name = field.name
+    return cc.transpose('m', 'n', *other_dims)
+
+@cached
 def sph_filter(field, l_cut, gridtype='gaussian'):
     """Remove all waves above a specific spherical wavenumber l_cut"""
-    nlat, nlon = len(field.lat), len(field.lon)
-    grid = spharm.Spharmt(nlon, nlat, gridtype=gridtype)
-    other_dims = [d for d in field.dims if d not in ('lat', 'lon')]
-
-    # need the field in N-S, E-W form, (lat, lon, other coords)
-    vfield = (field
-              .sel(lat=sorted(cbbt.lat, reverse=True), lon=sorted(cbbt.lon))
-              .transpose('lat', 'lon', *other_dims)
-             )
-
-    ntrunc = nlat-1
-    m, n = spharm.getspecindx(ntrunc)
-    l = m + n
-
-    # transform to spherical modes, eliminate high wavenumbers and transform back
-    coeffs = grid.grdtospec(vfield.values, ntrunc)
-    mask = l > l_cut
-    coeffs[mask] = 0
-
-    values = grid.spectogrd(coeffs)
-
-    # copy the original field and comply to the same coordinate ordering
-    nfield = vfield.copy()
-    nfield.values = values
+    # the filtered field keeps the N-S, E-W ordering used by the transform,
+    # and the same dimension ordering as the original
+    nfield = xr.apply_ufunc(_filter_grid, _spharm_ready(field),
+                            input_core_dims=[['lat', 'lon']],
+                            output_core_dims=[['lat', 'lon']],
+                            kwargs={'gridtype': gridtype, 'l_cut': l_cut},
+                            dask='parallelized',
+                            output_dtypes=[field.dtype],
+                            keep_attrs=True)
     return nfield.transpose(*field.dims)
@@ -0,0 +1,352 @@
+"""A persistent, size-bounded cache of expensive diagnostics.
+
+Functions decorated with `cached` store their results as zarr in a cache
+directory, keyed by a fingerprint of their arguments, and return the stored
+result when called again with the same inputs, e.g. after a kernel restart:
+
+    >>> iscaxr.cache.set_cache_dir('/scratch/me/iscaxr_cache', max_size=50e9)
+    >>> spec = zonal_dispersion(data.ucomp, nperseg=128)    # computed and stored
+    >>> spec = zonal_dispersion(data.ucomp, nperseg=128)    # read from the cache
+
+Caching is off, and the decorated functions behave exactly as before, unless
+a directory is set with `set_cache_dir` or the `ISCAXR_CACHE_DIR`
+environment variable (and optionally `ISCAXR_CACHE_SIZE`, in bytes).
+
+DataArrays and Datasets are fingerprinted by their coordinates, shape,
+dtype, name and attributes, and by a hash of their data: all of it for
+small arrays, an evenly spaced sample of it for large ones, and the dask
+graph name for dask arrays.  A sampled hash can miss a change to a few
+values of a large array, so call `clear` after editing data in place.
+Functions passed as arguments must have a `cache_key` attribute, otherwise
+the call is not cached.
+
+Once the cache is larger than its size limit, the least recently used
+entries are deleted.  Several processes may share a cache directory:
+entries are written to a temporary directory and renamed into place, and
+a lock file keeps readers and the evictor apart.  An entry opened lazily is
+pinned until the process that opened it exits, and is not evicted before.
+"""
+import atexit
+import functools
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import xarray as xr
+
+CACHE_DIR_ENV = 'ISCAXR_CACHE_DIR'
+CACHE_SIZE_ENV = 'ISCAXR_CACHE_SIZE'
+DEFAULT_MAX_SIZE = 10*1024**3
+
+# arrays with more elements than this are hashed from a sample of values
+FULL_HASH_SIZE = 2**20
+SAMPLE_SIZE = 2**16
+
+LOCK_FILENAME = '.lock'
+# pins from other hosts, whose processes can't be checked, expire after this many seconds
+PIN_TIMEOUT = 24*3600
+_NAME_ATTR = 'iscaxr_cache_name'
+_DATA_NAME = '__iscaxr_cached__'
+
+_config = {'dir': None, 'max_size': None}
+
+
+def set_cache_dir(path, max_size=None):
+    """Enable the cache in directory `path`, with a size limit of `max_size`
+    bytes (default: $ISCAXR_CACHE_SIZE or 10 GiB).  `path=None` disables it."""
+    _config['dir'] = path
+    _config['max_size'] = max_size
+
+def cache_dir():
+    """The cache directory, or None if caching is disabled."""
+    return _config['dir'] or os.environ.get(CACHE_DIR_ENV) or None
+
+def max_size():
+    """The size limit of the cache, in bytes."""
+    if _config['max_size'] is not None:
+        return int(_config['max_size'])
+    return int(float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_SIZE)))
+
+
+class Uncacheable(Exception):
+    """Raised by `fingerprint` for arguments that can't be fingerprinted."""
+
+def _hash_array(h, data):
+    h.update('{}|{}|'.format(data.shape, data.dtype).encode())
+    if hasattr(data, 'dask'):
+        # the dask graph name is a token of the graph that produces the data
+        h.update(data.name.encode())
+        return
+    data = np.asarray(data)
+    if data.dtype.hasobject:
+        h.update(repr(data.tolist()).encode())
+    elif data.size <= FULL_HASH_SIZE:
+        h.update(np.ascontiguousarray(data).tobytes())
+    else:
+        index = np.linspace(0, data.size - 1, SAMPLE_SIZE).astype(np.intp)
+        h.update(np.ascontiguousarray(data.flat[index]).tobytes())
+
+def _update(h, obj):
+    if isinstance(obj, xr.DataArray):
+        h.update(b'DataArray|')
+        _update(h, obj.name)
+        _update(h, obj.to_dataset(name=_DATA_NAME))
+    elif isinstance(obj, xr.Dataset):
+        h.update(b'Dataset|')
+        _update(h, json.dumps(obj.attrs, sort_keys=True, default=repr))
+        for name in sorted(obj.variables, key=str):
+            var = obj.variables[name]
+            _update(h, (str(name), var.dims, json.dumps(var.attrs, sort_keys=True, default=repr)))
+            _hash_array(h, var.data)
+    elif isinstance(obj, np.ndarray):
+        _hash_array(h, obj)
+    elif isinstance(obj, (list, tuple)):
+        h.update('{}{:d}|'.format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, dict):
+        h.update('dict{:d}|'.format(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _update(h, key)
+            _update(h, obj[key])
+    elif callable(obj):
+        key = getattr(obj, 'cache_key', None)
+        if key is None:
+            raise Uncacheable('{!r} has no cache_key'.format(obj))
+        h.update(b'callable|')
+        _update(h, key)
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update('{}:{!r}|'.format(type(obj).__name__, obj).encode())
+    else:
+        raise Uncacheable('cannot fingerprint {!r}'.format(type(obj)))
+
+def fingerprint(*objs):
+    """A hex digest identifying the contents of `objs`.
+
+    Raises `Uncacheable` for objects that can't be fingerprinted."""
+    h = hashlib.sha1()
+    for obj in objs:
+        _update(h, obj)
+    return h.hexdigest()
+
+
+@contextmanager
+def _locked(directory, exclusive):
+    try:
+        import fcntl
+    except ImportError:
+        # no advisory locks on Windows: entries are still renamed into place
+        # atomically, but a reader may race the evictor
+        yield
+        return
+    with open(os.path.join(directory, LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _entry_path(directory, key):
+    return os.path.join(directory, key + '.zarr')
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def _size_path(path):
+    # the size of each entry is kept alongside it, to save walking the cache
+    return path[:-len('.zarr')] + '.size'
+
+def _pin_path(path):
+    # marks an entry as in use by this process
+    return '{}.{}.{:d}.pin'.format(path[:-len('.zarr')], socket.gethostname(), os.getpid())
+
+_pins = []
+
+@atexit.register
+def _unpin_all():
+    while _pins:
+        try:
+            os.remove(_pins.pop())
+        except OSError:
+            pass
+
+def _pin_is_live(pin, host, pid):
+    # os.kill can't test for a process on Windows (it terminates it)
+    if host != socket.gethostname() or os.name == 'nt':
+        try:
+            return time.time() - os.stat(pin).st_mtime < PIN_TIMEOUT
+        except OSError:
+            return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, ValueError):
+        pass
+    return True
+
+def _is_pinned(path):
+    # whether a live process has the entry open lazily.  Stale pins are removed.
+    prefix = os.path.basename(path[:-len('.zarr')]) + '.'
+    directory = os.path.dirname(path)
+    pinned = False
+    for name in os.listdir(directory):
+        if not (name.startswith(prefix) and name.endswith('.pin')):
+            continue
+        pin = os.path.join(directory, name)
+        host, pid = name[len(prefix):-len('.pin')].rsplit('.', 1)
+        if _pin_is_live(pin, host, pid):
+            pinned = True
+        else:
+            try:
+                os.remove(pin)
+            except OSError:
+                pass
+    return pinned
+
+def _entries(directory):
+    # (last use, size, path) of each entry
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.endswith('.zarr') or '.tmp' in name:
+            continue
+        try:
+            with open(_size_path(path)) as f:
+                size = int(f.read())
+        except (IOError, ValueError):
+            size = _dir_size(path)
+        entries.append((os.stat(path).st_mtime, size, path))
+    return entries
+
+def _evict(directory, limit):
+    # delete least recently used entries until the cache fits, except those
+    # still open lazily.  Called with the exclusive lock held.
+    entries = sorted(_entries(directory))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        if _is_pinned(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(_size_path(path)):
+            os.remove(_size_path(path))
+        total -= size
+
+def _load(directory, key, lazy):
+    path = _entry_path(directory, key)
+    with _locked(directory, exclusive=False):
+        if not os.path.isdir(path):
+            return None
+        try:
+            ds = xr.open_zarr(path, chunks={} if lazy else None, consolidated=False)
+            if not lazy:
+                ds = ds.load()
+        except Exception:
+            # an unreadable entry is treated as missing
+            return None
+        os.utime(path)
+        if lazy:
+            # the data is read after the lock is released: keep the entry
+            # from being evicted while this process may still read it
+            pin = _pin_path(path)
+            if pin not in _pins:
+                open(pin, 'w').close()
+                _pins.append(pin)
+    if _NAME_ATTR in ds.attrs:
+        da = ds[_DATA_NAME]
+        da.name = json.loads(ds.attrs[_NAME_ATTR])
+        return da
+    return ds
+
+def _store(directory, key, result):
+    if isinstance(result, xr.DataArray):
+        ds = result.to_dataset(name=_DATA_NAME)
+        ds.attrs = {_NAME_ATTR: json.dumps(result.name)}
+    else:
+        ds = result
+    path = _entry_path(directory, key)
+    tmp_path = '{}.{:d}.{:d}.tmp.zarr'.format(path[:-5], os.getpid(), int(time.time()*1e6))
+    ds.to_zarr(tmp_path, mode='w', consolidated=False)
+    size = _dir_size(tmp_path)
+    with _locked(directory, exclusive=True):
+        try:
+            os.rename(tmp_path, path)
+            with open(_size_path(path), 'w') as f:
+                f.write(str(size))
+        except OSError:
+            # another process has stored the same result
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        _evict(directory, max_size())
+
+def _is_dask(a):
+    # Dataset.chunks raises for variables with inconsistent chunks
+    if isinstance(a, xr.Dataset):
+        return any(v.chunks for v in a.variables.values())
+    return isinstance(a, xr.DataArray) and a.chunks is not None
+
+def _is_lazy(args):
+    return any(_is_dask(a) for a in args)
+
+def cached(fn=None, version=0):
+    """Decorator caching the DataArray or Dataset results of `fn` on disk.
+
+    Use as `@cached`, or `@cached(version=1)`, incrementing the version when
+    a change to the function changes its results.
+
+    Results are loaded into memory when read from the cache, unless an
+    argument is dask-backed, in which case the cached result is opened lazily.
+
+    A dask-backed result is computed when it is stored, i.e. when `fn` is
+    called rather than when the result is used, and is then read back
+    lazily from the cache.  Dask-backed results larger than `max_size()`
+    would be evicted at once, so are returned lazily without caching.
+    """
+    if fn is None:
+        return functools.partial(cached, version=version)
+
+    name = '{}.{}:{}'.format(fn.__module__, fn.__qualname__, version)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        directory = cache_dir()
+        if directory is None:
+            return fn(*args, **kwargs)
+        try:
+            key = fingerprint(name, args, kwargs)
+        except Uncacheable:
+            return fn(*args, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        lazy = _is_lazy(list(args) + list(kwargs.values()))
+        result = _load(directory, key, lazy)
+        if result is not None:
+            return result
+        result = fn(*args, **kwargs)
+        if isinstance(result, (xr.DataArray, xr.Dataset)):
+            if _is_dask(result) and result.nbytes > max_size():
+                return result
+            _store(directory, key, result)
+            if lazy:
+                # storing computed the result: read it back rather than
+                # computing it again (unless it has already been evicted)
+                stored = _load(directory, key, lazy)
+                if stored is not None:
+                    return stored
+        return result
+
+    wrapper.uncached = fn
+    return wrapper
+
+def clear(directory=None):
+    """Delete every entry in the cache, except those open lazily."""
+    directory = directory or cache_dir()
+    if directory is None or not os.path.isdir(directory):
+        return
+    with _locked(directory, exclusive=True):
+        _evict(directory, 0)
@@ -1,27 +1,105 @@
+import os
+
+import numpy as np
 import xarray as xr
 import h5py
+from xarray.backends import BackendArray, BackendEntrypoint, CachingFileManager
+from xarray.backends.locks import HDF5_LOCK
+from xarray.core import indexing
+
 
+TIME_SCALES = ['sim_time', 'wall_time', 'timestep', 'iteration', 'write_number']
 
 
 def task_to_dataarray(task):
-    return xr.DataArray(data=task.value, coords=[(d.label, d.values()[0].value) for d in task.dims])
+    """Read a Dedalus task into memory as a DataArray."""
+    return xr.DataArray(data=task[()], coords=[(d.label, d[0][()]) for d in task.dims])
 
-def dedalus_to_xarray(filename):
-    """Convert dedalus output into a xarray format.
 
-    Dedalus outputs HDF5 files with two sections '"""
-    with h5py.File(filename, mode='r') as f:
-        tasks = {}
-        for task_name in f['tasks']:
-            xarr = task_to_dataarray(f['tasks'][task_name])
-            tasks[task_name] =  xarr
-        dset = xr.Dataset(tasks).rename({'t': 'time'})
+class DedalusBackendArray(BackendArray):
+    """A lazily indexed Dedalus task, read from file only when sliced."""
+    def __init__(self, manager, task_name, shape, dtype, lock=HDF5_LOCK):
+        self.manager = manager
+        self.task_name = task_name
+        self.shape = shape
+        self.dtype = dtype
+        self.lock = lock
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER_1VECTOR, self._getitem)
+
+    def _getitem(self, key):
+        with self.lock:
+            f = self.manager.acquire()
+            return np.asarray(f['tasks'][self.task_name][key])
+
+
+class DedalusBackendEntrypoint(BackendEntrypoint):
+    """An xarray backend for Dedalus HDF5 output.
+
+    Each Dedalus task becomes a lazily indexed variable, chunked as stored
+    on disk when opened with `chunks={}`.  The time dimension `t` is named
+    `time`, and all the time scales written by Dedalus are added as
+    coordinates along it.
 
-        # write all the different time coordinates provided
-        for tscale in ['sim_time', 'wall_time', 'timestep', 'iteration', 'write_number']:
-            dset.coords[tscale] = ('time', f['scales'][tscale].value)
+        >>> ds = xr.open_dataset('snapshots_s1.h5', engine='dedalus', chunks={})
+    """
+    open_dataset_parameters = ['filename_or_obj', 'drop_variables']
+    description = 'Open Dedalus HDF5 output in xarray'
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None):
+        manager = CachingFileManager(h5py.File, filename_or_obj, mode='r')
+        with HDF5_LOCK:
+            f = manager.acquire()
+            variables = {}
+            coords = {}
+            for task_name, task in f['tasks'].items():
+                if drop_variables is not None and task_name in drop_variables:
+                    continue
+                dims = []
+                for i, d in enumerate(task.dims):
+                    label = d.label or 'dim_{:d}'.format(i)
+                    if label == 't':
+                        label = 'time'
+                    dims.append(label)
+                    if label not in coords and len(d) > 0:
+                        coords[label] = d[0][()]
+                data = indexing.LazilyIndexedArray(
+                    DedalusBackendArray(manager, task_name, task.shape, task.dtype))
+                encoding = {}
+                if task.chunks is not None:
+                    encoding['preferred_chunks'] = dict(zip(dims, task.chunks))
+                variables[task_name] = xr.Variable(dims, data, encoding=encoding)
+
+            dset = xr.Dataset(variables, coords=coords)
+
+            # write all the different time coordinates provided
+            for tscale in TIME_SCALES:
+                if tscale in f['scales']:
+                    dset.coords[tscale] = ('time', f['scales'][tscale][()])
+
+        dset.set_close(manager.close)
+        return dset
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            if os.path.splitext(filename_or_obj)[1] not in ('.h5', '.hdf5'):
+                return False
+            with h5py.File(filename_or_obj, mode='r') as f:
+                return 'tasks' in f and 'scales' in f
+        except (TypeError, OSError):
+            return False
+
+
+def dedalus_to_xarray(filename, chunks=None):
+    """Convert dedalus output into a xarray format.
 
-    return dset
+    Dedalus outputs HDF5 files with two sections, 'tasks' and 'scales'.
+    Tasks are read lazily: pass `chunks` (e.g. `{}` for the on-disk chunks)
+    to get dask-backed variables.
+    """
+    return xr.open_dataset(filename, engine=DedalusBackendEntrypoint, chunks=chunks)
 
 if __name__ == '__main__':
     import sys
@@ -29,6 +107,11 @@ if __name__ == '__main__':
         input = sys.argv[1]
         output= sys.argv[2]
     except:
-        print("Usage:  data_util.py input_file.h5 output_file.nc")
-    dset = dedalus_to_xarray(input)
-    dset.to_netcdf(output)
+        print("Usage:  dedalus_util.py input_file.h5 output_file.{nc,zarr}")
+        sys.exit(1)
+    # stream chunk by chunk from the HDF5 file to the output
+    dset = dedalus_to_xarray(input, chunks={})
+    if output.endswith('.zarr'):
+        dset.to_zarr(output, mode='w')
+    else:
+        dset.to_netcdf(output)
@@ -0,0 +1,443 @@
+"""Batch diagnostics of Isca runs from the command line.
+
+    $ iscaxr-diag exp1 exp2 -d mass_streamfunction -d zonal_dispersion:nperseg=64,level=250
+
+computes each named diagnostic for each experiment directory (the output
+of all runs, opened with `iscaxr.open_runs`) on a pool of worker processes,
+and writes the results to netCDF (or zarr with `--format zarr`) in
+`<experiment>/diagnostics/`.
+
+Diagnostics that can be computed a run at a time, such as time means, are
+split into a task per run file, and the parts combined by the parent
+process, so a single long experiment still uses the whole pool.  Those that
+need the whole time series at once, such as spectra, are one task per
+experiment.
+
+A manifest alongside the results records, for each output, the mtimes and
+sizes of the input files and a hash of the diagnostic's name and parameters.
+Outputs that are already up to date are skipped, so rerunning over an
+archive only recomputes diagnostics of runs that have changed.
+
+Run `iscaxr-diag --list` for the available diagnostics.  More can be added
+with the `diagnostic` decorator.
+"""
+import argparse
+import ast
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+
+import numpy as np
+import xarray as xr
+
+from iscaxr.loader import find_run_files, load_index, scan_file, update_index, open_runs
+
+MANIFEST_FILENAME = '.iscaxr_diag.json'
+MANIFEST_VERSION = 1
+FORMATS = {'netcdf': '.nc', 'zarr': '.zarr'}
+
+# name -> (function, default parameters)
+DIAGNOSTICS = {}
+# name -> function combining the results of each run, for diagnostics split by run
+COMBINE = {}
+
+# the number of timesteps each part of a split diagnostic was computed from
+_NTIME_ATTR = 'iscaxr_ntime'
+
+
+def diagnostic(name, combine=None, **defaults):
+    """Register a diagnostic.
+
+    The decorated function is called as `fn(data, **params)` with an Isca
+    dataset and returns a DataArray or Dataset.  `defaults` are the
+    parameters that may be overridden on the command line.
+
+    If given, `combine(parts, **params)` combines the results of the
+    diagnostic for each run, in time order, into the result for the
+    whole experiment, so that the runs can be processed in parallel.
+    The result of `fn` is then always passed through `combine`, even for
+    a single run, so it may be an intermediate state, e.g. sums rather
+    than statistics that can't be computed from a single run.
+    `combine_time_mean` and `combine_time_concat` cover the usual cases.
+    """
+    def register(fn):
+        DIAGNOSTICS[name] = (fn, defaults)
+        if combine is not None:
+            COMBINE[name] = combine
+        return fn
+    return register
+
+def combine_time_mean(parts, **params):
+    """Combine time means of each run, weighted by their number of timesteps."""
+    weights = [p.attrs[_NTIME_ATTR] for p in parts]
+    total = sum(w*p for w, p in zip(weights, parts)) / sum(weights)
+    total.attrs = dict(parts[0].attrs)
+    return total
+
+def combine_time_concat(parts, **params):
+    """Combine time series of each run."""
+    return xr.concat(parts, 'time', combine_attrs='override')
+
+def _level(field, level):
+    # select the pfull level nearest to `level` hPa, if given
+    if level is not None and 'pfull' in field.dims:
+        field = field.sel(pfull=level, method='nearest')
+    return field
+
+def _lat_band(field, lat_cutoff):
+    lat = field.lat.values
+    return field.isel(lat=np.flatnonzero(np.abs(lat) <= lat_cutoff))
+
+@diagnostic('mass_streamfunction', combine=combine_time_mean)
+def _mass_streamfunction(data):
+    from iscaxr.analysis import mass_streamfunction
+    return mass_streamfunction(data).mean('time')
+
+@diagnostic('meridional_transports', combine=combine_time_mean)
+def _meridional_transports(data):
+    from iscaxr.analysis import meridional_transports
+    return meridional_transports(data).mean('time')
+
+@diagnostic('pot_temp', combine=combine_time_mean)
+def _pot_temp(data):
+    from iscaxr.analysis import pot_temp
+    return pot_temp(data).mean(('time', 'lon'))
+
+@diagnostic('brunt_vaisala', combine=combine_time_mean)
+def _brunt_vaisala(data):
+    from iscaxr.analysis import brunt_vaisala
+    return brunt_vaisala(data).mean(('time', 'lon'))
+
+@diagnostic('eady_growth_rate', combine=combine_time_mean)
+def _eady_growth_rate(data):
+    from iscaxr.analysis import eady_growth_rate
+    return eady_growth_rate(data).mean(('time', 'lon'))
+
+def _flux_pairs(fields):
+    fields = list(fields)
+    return [(a, b) for i, a in enumerate(fields) for b in fields[i+1:]]
+
+def _combine_eddy_fluxes(parts, fields):
+    from iscaxr.analysis import Accumulator
+    accs = [Accumulator.from_dataset(p, fields, _flux_pairs(fields)) for p in parts]
+    return Accumulator.combine(accs).to_dataset(ddof=1)
+
+@diagnostic('eddy_fluxes', combine=_combine_eddy_fluxes, fields=('ucomp', 'vcomp', 'temp'))
+def _eddy_fluxes(data, fields):
+    from iscaxr.analysis import Accumulator
+    acc = Accumulator(fields, _flux_pairs(fields))
+    # one time chunk at a time, so memory is bounded by a chunk
+    step = data.chunks['time'][0] if data.chunks else data.sizes['time']
+    for i0 in range(0, data.sizes['time'], step):
+        acc.update(data.isel(time=slice(i0, i0+step)))
+    # the unbiased (co)variances are taken once all runs are combined: a
+    # single run may have just one timestep
+    return acc.to_dataset(ddof=0)
+
+@diagnostic('jet_latitude', combine=combine_time_concat, field='ucomp', level=250.0)
+def _jet_latitude(data, field, level):
+    from iscaxr.analysis.atmosphere import jet_latitude
+    u = _level(data[field], level)
+    return xr.Dataset({'north': jet_latitude(u, lat_range=(0, 90)),
+                       'south': jet_latitude(u, lat_range=(-90, 0))})
+
+@diagnostic('zonal_dispersion', field='ucomp', level=250.0, lat_cutoff=15.0, dt=1.0, nperseg=None, power=False)
+def _zonal_dispersion(data, field, level, lat_cutoff, dt, nperseg, power):
+    from iscaxr.analysis.spectral import zonal_dispersion
+    f = _lat_band(_level(data[field], level), lat_cutoff)
+    return zonal_dispersion(f, dt=dt, nperseg=nperseg, power=power).mean('lat')
+
+@diagnostic('wheeler_kiladis', field='ucomp', level=250.0, lat_cutoff=15.0, dt=1.0, nperseg=96)
+def _wheeler_kiladis(data, field, level, lat_cutoff, dt, nperseg):
+    from iscaxr.analysis.spectral import wheeler_kiladis
+    return wheeler_kiladis(_level(data[field], level), dt=dt, nperseg=nperseg, lat_cutoff=lat_cutoff)
+
+@diagnostic('phase_curve', combine=combine_time_concat, field='temp', level=None)
+def _phase_curve(data, field, level):
+    from iscaxr.analysis.exoplanet import make_phase_curve_calculator
+    f = data[field].isel(pfull=-1) if level is None and 'pfull' in data[field].dims else _level(data[field], level)
+    return make_phase_curve_calculator(data)(f)
+
+@diagnostic('phase_curve_mean', combine=combine_time_concat, field='temp', level=None)
+def _phase_curve_mean(data, field, level):
+    from iscaxr.analysis.exoplanet import make_phase_curve_calculator_mean
+    f = data[field].isel(pfull=-1) if level is None and 'pfull' in data[field].dims else _level(data[field], level)
+    return make_phase_curve_calculator_mean(data)(f)
+
+
+def parse_diagnostic(spec):
+    """Parse 'name' or 'name:key=value,key=value' to (name, params).
+
+    Values are read as python literals where possible, otherwise as strings.
+    """
+    name, _, args = spec.partition(':')
+    if name not in DIAGNOSTICS:
+        raise ValueError('unknown diagnostic {!r}. Available: {}'.format(name, ', '.join(sorted(DIAGNOSTICS))))
+    fn, defaults = DIAGNOSTICS[name]
+    params = dict(defaults)
+    # split on the commas that start a new key, not those within a value
+    for arg in filter(None, re.split(r',(?=\s*\w+=)', args)):
+        key, sep, value = arg.partition('=')
+        key = key.strip()
+        if not sep or key not in defaults:
+            raise ValueError('diagnostic {!r} has no parameter {!r}. Parameters: {}'.format(
+                name, key, ', '.join(sorted(defaults)) or 'none'))
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value
+    return name, params
+
+def params_hash(name, params, filename):
+    """A hash identifying a diagnostic, its parameters and its input files' name."""
+    key = json.dumps({'diagnostic': name, 'params': params, 'filename': filename}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def input_files(directory, filename, runs):
+    """The input files of an experiment: `filename` in each run directory,
+    or `filename` in `directory` itself if it has no run directories.
+
+    Returns (basedir, runs, files), such that `open_runs(basedir, filename, runs)`
+    opens `files`."""
+    files = find_run_files(directory, filename, runs)
+    if files:
+        return directory, runs, files
+    directory = os.path.normpath(directory)
+    basedir, runs = os.path.dirname(directory), os.path.basename(directory)
+    return basedir, runs, find_run_files(basedir, filename, runs)
+
+def input_stamps(files):
+    """(mtime, size) of each file, keyed by path."""
+    stamps = {}
+    for path in files:
+        st = os.stat(path)
+        stamps[os.path.abspath(path)] = [st.st_mtime, st.st_size]
+    return stamps
+
+def load_manifest(path):
+    """Load a results manifest.  Returns an empty manifest if there is none."""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('outputs', {})
+
+def save_manifest(manifest, path):
+    """Atomically write a results manifest."""
+    tmp_path = '{}.{:d}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'outputs': manifest}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def is_up_to_date(entry, output_path, phash, stamps):
+    return (entry is not None and os.path.exists(output_path)
+            and entry.get('params_hash') == phash and entry.get('inputs') == stamps)
+
+
+def _write(result, output_path, fmt):
+    # write alongside and rename, so that an interrupted run never leaves
+    # a partial result that looks complete
+    tmp_path = '{}.{:d}.tmp'.format(output_path, os.getpid())
+    if fmt == 'zarr':
+        result.to_zarr(tmp_path, mode='w')
+        if os.path.isdir(output_path):
+            shutil.rmtree(output_path)
+    else:
+        result.to_netcdf(tmp_path)
+    os.replace(tmp_path, output_path)
+
+def _part_time_range(task):
+    # the times of the run file of a part, from the index brought up to
+    # date by `run`
+    root = os.path.dirname(os.path.abspath(task['index_path']))
+    entry = load_index(task['index_path']).get(os.path.relpath(os.path.abspath(task['part_file']), root))
+    time_range = (entry or scan_file(task['part_file']))['time_range']
+    if time_range is None:
+        raise ValueError('{!r} has no times, so cannot be processed by run'.format(task['part_file']))
+    return time_range
+
+def _finish(result, task):
+    if isinstance(result, xr.DataArray):
+        result = result.to_dataset(name=task['diagnostic'])
+    result.attrs['iscaxr_diagnostic'] = task['diagnostic']
+    result.attrs['iscaxr_params'] = json.dumps(task['params'], sort_keys=True)
+    return result
+
+def _manifest_entry(task):
+    return {'diagnostic': task['diagnostic'], 'params': task['params'],
+            'params_hash': task['params_hash'], 'inputs': task['inputs']}
+
+def run_task(task):
+    """Compute one diagnostic of one experiment and write it to disk.
+
+    `task` is a dict as built by `plan`.  Returns the manifest entry of the
+    result, or for a task that is one part of a diagnostic split by run,
+    the computed result of that part.  Run in a worker process by `run`.
+    """
+    fn, _ = DIAGNOSTICS[task['diagnostic']]
+    time_range = _part_time_range(task) if 'part' in task else None
+    with open_runs(task['directory'], task['filename'], task['runs'], index_path=task['index_path'],
+                   chunks=task['chunks'], time_range=time_range, decode_times=False) as data:
+        result = fn(data, **task['params'])
+        if task['diagnostic'] not in COMBINE:
+            _write(_finish(result, task).compute(), task['output'], task['format'])
+            return _manifest_entry(task)
+        result = result.compute()
+        result.attrs[_NTIME_ATTR] = data.sizes['time']
+    if 'part' in task:
+        return result
+    # a single part: combined all the same, as it may only be a partial result
+    return combine_parts([result], task)
+
+def combine_parts(parts, task):
+    """Combine the results of each part of a diagnostic split by run, and
+    write the result to disk.  Returns its manifest entry."""
+    result = COMBINE[task['diagnostic']](parts, **task['params'])
+    result.attrs.pop(_NTIME_ATTR, None)
+    _write(_finish(result, task), task['output'], task['format'])
+    return _manifest_entry(task)
+
+def _run_task_safely(task):
+    try:
+        return task, run_task(task), None
+    except Exception as err:
+        return task, None, '{}: {}'.format(type(err).__name__, err)
+
+def _run_task_in_worker(task):
+    # each worker process is one unit of parallelism: keep dask single-threaded
+    import dask
+    with dask.config.set(scheduler='synchronous'):
+        return _run_task_safely(task)
+
+def plan(directories, diagnostics, filename='atmos_monthly.nc', runs='run*', output_dir=None,
+         fmt='netcdf', chunks=None, force=False):
+    """Work out which diagnostics need (re)computing.
+
+    Returns (tasks, skipped): dicts describing each diagnostic to compute,
+    and the paths of the outputs that are already up to date.  Diagnostics
+    with a `combine` function have a task for each run file, with its
+    index as 'part' and their number as 'parts'.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown format {!r}, use one of {}'.format(fmt, tuple(FORMATS)))
+    tasks, skipped = [], []
+    for directory in directories:
+        basedir, run_pattern, files = input_files(directory, filename, runs)
+        if not files:
+            raise IOError('no files matching {!r} in {!r}'.format(os.path.join(runs, filename), directory))
+        outdir = (os.path.join(directory, 'diagnostics') if output_dir is None
+                  else os.path.join(output_dir, os.path.basename(os.path.normpath(directory))))
+        manifest = load_manifest(os.path.join(outdir, MANIFEST_FILENAME))
+        stamps = input_stamps(files)
+        for name, params in diagnostics:
+            output_name = name + FORMATS[fmt]
+            output = os.path.join(outdir, output_name)
+            phash = params_hash(name, params, filename)
+            if not force and is_up_to_date(manifest.get(output_name), output, phash, stamps):
+                skipped.append(output)
+                continue
+            task = {'directory': basedir, 'runs': run_pattern, 'filename': filename, 'index_path': os.path.join(outdir, '.iscaxr_index.json'),
+                    'chunks': chunks, 'diagnostic': name, 'params': params, 'params_hash': phash,
+                    'inputs': stamps, 'outdir': outdir, 'output': output, 'output_name': output_name,
+                    'format': fmt}
+            if name in COMBINE and len(files) > 1:
+                tasks.extend(dict(task, part=i, parts=len(files), part_file=path) for i, path in enumerate(files))
+            else:
+                tasks.append(task)
+    return tasks, skipped
+
+def run(tasks, processes=None, log=print):
+    """Run `tasks` from `plan` on a pool of `processes` workers, updating
+    the manifests as each completes.  Returns the list of failed tasks."""
+    for task in tasks:
+        os.makedirs(task['outdir'], exist_ok=True)
+    # bring the file indexes up to date here, so workers never scan the same files
+    for index_path, files in dict((t['index_path'], tuple(sorted(t['inputs']))) for t in tasks).items():
+        update_index(files, index_path)
+    if processes == 1 or len(tasks) <= 1:
+        results = map(_run_task_safely, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_run_task_in_worker, tasks)
+    failed = []
+    # output -> {part: result} of the diagnostics split by run, or None once a part has failed
+    parts = {}
+    try:
+        for task, entry, error in results:
+            if 'part' in task:
+                done = parts.setdefault(task['output'], {})
+                if done is None:
+                    continue
+                if error is None:
+                    done[task['part']] = entry
+                    if len(done) < task['parts']:
+                        continue
+                    try:
+                        entry = combine_parts([done[i] for i in range(task['parts'])], task)
+                    except Exception as err:
+                        error = '{}: {}'.format(type(err).__name__, err)
+                    parts[task['output']] = None
+                else:
+                    parts[task['output']] = None
+            if error is not None:
+                log('FAILED {}: {}'.format(task['output'], error))
+                failed.append(task)
+                continue
+            # only the parent process writes the manifests
+            path = os.path.join(task['outdir'], MANIFEST_FILENAME)
+            manifest = load_manifest(path)
+            manifest[task['output_name']] = entry
+            save_manifest(manifest, path)
+            log('wrote {}'.format(task['output']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='iscaxr-diag', description='Compute diagnostics of Isca experiments in parallel.')
+    parser.add_argument('directories', nargs='*', help='experiment directories, containing run directories')
+    parser.add_argument('-d', '--diagnostic', action='append', default=[], metavar='NAME[:KEY=VALUE,...]',
+                        help='a diagnostic to compute, with optional parameters.  May be repeated.')
+    parser.add_argument('-f', '--filename', default='atmos_monthly.nc', help='output file of each run')
+    parser.add_argument('-r', '--runs', default='run*', help='glob pattern of the run directories')
+    parser.add_argument('-o', '--output-dir', help='where to write results.  Default: <experiment>/diagnostics')
+    parser.add_argument('--format', default='netcdf', choices=sorted(FORMATS))
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes.  Default: one per core')
+    parser.add_argument('--chunks', type=int, default=None, help='time chunk size when reading the runs')
+    parser.add_argument('--force', action='store_true', help='recompute results even if up to date')
+    parser.add_argument('--list', action='store_true', help='list the available diagnostics and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in sorted(DIAGNOSTICS):
+            defaults = DIAGNOSTICS[name][1]
+            print(name + (':' + ','.join('{}={!r}'.format(k, v) for k, v in sorted(defaults.items())) if defaults else ''))
+        return 0
+    if not args.directories or not args.diagnostic:
+        parser.error('need at least one experiment directory and one diagnostic')
+    try:
+        diagnostics = [parse_diagnostic(spec) for spec in args.diagnostic]
+        chunks = None if args.chunks is None else {'time': args.chunks}
+        tasks, skipped = plan(args.directories, diagnostics, args.filename, args.runs, args.output_dir,
+                              args.format, chunks, args.force)
+    except (ValueError, IOError) as err:
+        parser.error(str(err))
+    for path in skipped:
+        print('up to date: {}'.format(path))
+    failed = run(tasks, args.processes)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,10 @@
+import warnings
+
 import numpy as np
-import scipy.signal
-import scipy.interpolate
 import xarray as xr
-import xarray.ufuncs as xruf
 
 from iscaxr.util import rng
+from iscaxr.grid import get_grid
 from iscaxr.constants import R_dry, grav
 
 def calculate_dlatlon(domain):
@@ -12,35 +12,21 @@ def calculate_dlatlon(domain):
 
     Parameters
     ----------
-    domain : IscaDataSet (xarray.DataSet)
+    domain : IscaDataSet (xarray.DataSet) or IscaGrid
 
     Returns
     -------
     dlat, dlon : xarray.DataArray, xarray.DataArray
         dlat, dlon in radians for the grid.  Indexed by `lat` and `lon`.
     """
-    rad = np.pi / 180
-    coslat = np.cos(domain.lat * rad)
-
-    dlon = (domain.lonb*rad).diff('lonb')
-    dlon.name = 'dlon'
-    dlon = dlon.rename({'lonb': 'lon'})
-    dlon['lon'] = domain.lon.values
-
-    dlat = (domain.latb*rad).diff('latb')
-    dlat.name = 'dlat'
-    dlat = dlat.rename({'latb': 'lat'})
-    dlat['lat'] = domain.lat.values
-
-    return dlat, dlon
+    grid = get_grid(domain)
+    return grid.dlat, grid.dlon
 
 def calculate_dA(domain):
-    rad = np.pi / 180
-    coslat = np.cos(domain.lat * rad)
-    dlat, dlon = calculate_dlatlon(domain)
+    """Calculate the area of each grid cell on the unit sphere.
 
-    dA = dlat*dlon*coslat
-    return dA
+    `domain` may be an IscaDataSet or an IscaGrid."""
+    return get_grid(domain).dA
 
 def calculate_dz(domain):
     """Use the hydrostatic relation to get dz from dp."""
@@ -49,10 +35,26 @@ def calculate_dz(domain):
     # => dz = -RT/g d[lnp]
     T = pfull_to_phalf(domain.temp, domain)
     pfull = (domain.pfull/domain.phalf.max())*domain.ps
-    dlnp = diff_pfull(xruf.log(pfull), domain)
+    dlnp = diff_pfull(np.log(pfull), domain)
     dz = -R_dry*T/grav*dlnp
     return dz
 
+def calculate_z(domain):
+    """Calculate the height, in m, of each pfull level above the surface.
+
+    Integrates the hydrostatic `calculate_dz` upwards from the surface,
+    with the lowest level at height RT/g ln(ps/p) above the ground."""
+    pfull = (domain.pfull/domain.phalf.max())*domain.ps
+    z_bottom = R_dry*domain.temp.isel(pfull=-1)/grav*np.log(domain.ps/pfull.isel(pfull=-1))
+    # height of each level above the lowest: accumulate -dz from the bottom up
+    rise = -calculate_dz(domain)
+    rise = rise.isel(phalf=slice(None, None, -1)).cumsum('phalf').isel(phalf=slice(None, None, -1))
+    rise = rise.rename({'phalf': 'pfull'}).drop_vars('pfull')
+    rise = xr.concat([rise, xr.zeros_like(rise.isel(pfull=-1))], dim='pfull')
+    z = (z_bottom.drop_vars('pfull') + rise).assign_coords(pfull=domain.pfull.values)
+    z.name = 'z'
+    return z.transpose(*domain.temp.dims)
+
 def make_surf_integrator(domain, radius=1.0):
     """Generate a surface integrator.
 
@@ -62,7 +64,7 @@ def make_surf_integrator(domain, radius=1.0):
 
     Parameters
     ----------
-    domain : IscaDataSet : xarray.DataSet
+    domain : IscaDataSet : xarray.DataSet or IscaGrid
         The domain on which fields are discretised.  Should have coordinates
             `lat`, `latb`, `lon`, `lonb`.
     radius : float, optional (default=1.0)
@@ -79,20 +81,33 @@ def make_surf_integrator(domain, radius=1.0):
         return radius**2*(field*dA).sum(('lat', 'lon'))
     return integrator
 
-def calculate_dp(domain):
-    return xr.DataArray(domain.phalf.diff('phalf').values*100, coords=[('pfull', domain.pfull)])
+def calculate_dp(domain, ps=None):
+    """Calculate the pressure thickness, in Pa, of each pfull layer.
+
+    If surface pressure `ps` (in Pa) is given, the thickness of the sigma
+    layers of each column is returned, dp = ps*dsigma, otherwise the fixed
+    thickness of the reference levels."""
+    grid = get_grid(domain)
+    if ps is None:
+        return grid.dp
+    dsigma = grid.dp / (grid.phalf.max().values*100)
+    dp = ps*dsigma
+    dp.name = 'dp'
+    return dp
 
 def pfull_to_phalf(field, domain):
     """Move a field from pfull levels to
     phalf levels (except top and bottom) using the arithmetic mean."""
     # calculate the arithmetic mean between pairs of values along the pfull dim
-    avg = field.rolling(pfull=2).mean().dropna('pfull')
+    upper, lower = _pfull_pairs(field)
+    avg = 0.5*(upper + lower)
     avg = _map_pfull_inside_phalf(avg, domain)
     return avg
 
 def diff_pfull(field, domain):
     """Calculate the vertical derivative of a pfull field and map onto phalf levels"""
-    dfield = field.diff('pfull')
+    upper, lower = _pfull_pairs(field)
+    dfield = lower - upper
     dfield.name = 'd{}'.format(field.name)
     dfield = _map_pfull_inside_phalf(dfield, domain)
     return dfield
@@ -106,16 +121,42 @@ def dfdp(field, domain):
     return df/dp
 
 
+def _pfull_pairs(field):
+    # the (upper, lower) neighbours of each interior phalf level.  pfull labels
+    # are dropped so that the two halves combine positionally, without
+    # alignment, and dask chunks are carried through untouched.
+    upper = field.isel(pfull=slice(None, -1)).drop_vars('pfull', errors='ignore')
+    lower = field.isel(pfull=slice(1, None)).drop_vars('pfull', errors='ignore')
+    return upper, lower
 
 def _map_pfull_inside_phalf(field, domain):
     # xarray thinks field is on the pfull coords, but values are at phalf now.
-    # rename pfull -> phalf and replace the coord values with the domain phalf values.
+    # rename pfull -> phalf and label with the interior domain phalf values.
+    # A new coordinate is assigned rather than overwriting the values in place,
+    # so lazy (dask) fields are never evaluated.
     field = field.rename({'pfull': 'phalf'})
-    field.phalf.values = domain.phalf[1:-1]
-    return field
+    return field.assign_coords(phalf=domain.phalf.values[1:-1])
+
 
+def resample_latlon(field, nlat=None, nlon=None, lats=None, lons=None, method='interpolate', cache_dir=None,
+                    source=None):
+    """Resample a field onto a new lat-lon grid.
 
-def resample_latlon(field, nlat=None, nlon=None, lats=None, lons=None, method='interpolate'):
+    `method` is one of
+        - 'interpolate': Fourier resampling in longitude, linear in latitude.
+        - 'nearest': select the nearest grid points.
+        - 'bilinear', 'conservative' or 'spectral': apply the precomputed
+          weights of an `iscaxr.regrid.Regridder`.  Weights are reused by
+          every call between the same pair of grids, stored in `cache_dir`
+          if given, and the field may be dask-backed.
+
+    If not given, the new grid has half the resolution of the original.
+
+    `source`, the dataset or IscaGrid that `field` is on, gives the cell
+    bounds (latb, lonb) for 'conservative' regridding.  A DataArray has
+    none, so without it the bounds are taken halfway between the cell
+    centres, which is not exact for Isca's Gaussian grids.
+    """
     if nlat is None:
         nlat = len(field.coords['lat'])//2
     if nlon is None:
@@ -135,7 +176,12 @@ def resample_latlon(field, nlat=None, nlon=None, lats=None, lons=None, method='i
         newlon = np.linspace(minlon, maxlon, nlon)
     else:
         newlon = np.asarray(lons)
+    # scipy and the regridding weights are only imported when needed,
+    # to keep `import iscaxr` fast.
+    from iscaxr import regrid
     if method == 'interpolate':
+        import scipy.signal
+        import scipy.interpolate
         # resample lon form in fourier space
         lon_scale, newlon = scipy.signal.resample(field.values, nlon, t=lon, axis=ilon)
         # resample lat using interpolator
@@ -148,6 +194,14 @@ def resample_latlon(field, nlat=None, nlon=None, lats=None, lons=None, method='i
     elif method == 'nearest':
         rescaled = field.sel(lat=newlat, lon=newlon, method='nearest')
         return rescaled
+    elif method in regrid.METHODS:
+        source = field if source is None else source
+        grid = get_grid(source)
+        if method == 'conservative' and (grid.latb is None or grid.lonb is None):
+            warnings.warn('no cell bounds for conservative regridding: using midpoints between cell '
+                          'centres.  Pass the dataset as `source` to use its latb and lonb.')
+        regridder = regrid.Regridder(source, regrid.latlon_grid(newlat, newlon), method=method, cache_dir=cache_dir)
+        return regridder(field)
     else:
         raise AttributeError('unknown resampling method %r' % method)
 
@@ -156,7 +210,7 @@ def center_lon(field, wrap=False, nearest=False, **kwargs):
 
     Parameters
     ----------
-    field : The xarray field to be rebased
+    field : The xarray field (DataArray or Dataset) to be rebased
     wrap : boolean, optional
         If `True`, centre the new longitude axis so that it ranges from [-180, 180].
         If `False` (default), recentred axis ranges [0, 360].
@@ -165,6 +219,10 @@ def center_lon(field, wrap=False, nearest=False, **kwargs):
         that lon coordinate labels are the same as input data.
     **kwargs : dict
         The longitude axes and new origins for the field.  e.g. lon=180.
+        An origin may also be a DataArray, e.g. indexed by `time`, in which case
+        each slice of `field` is recentred on its own origin in a single
+        vectorised gather.  Origins are then always moved to the nearest grid
+        point, and the longitude grid is assumed to be regular.
 
     Returns
     -------
@@ -173,6 +231,9 @@ def center_lon(field, wrap=False, nearest=False, **kwargs):
     """
     q  = field.copy(deep=False)
     for dim in kwargs:
+        if isinstance(kwargs[dim], xr.DataArray) and kwargs[dim].ndim > 0:
+            q = _center_lon_along(q, dim, kwargs[dim], wrap=wrap)
+            continue
         if nearest:
             lon0 = q[dim].sel(method='nearest', **{dim:kwargs[dim]}).values
         else:
@@ -184,4 +245,40 @@ def center_lon(field, wrap=False, nearest=False, **kwargs):
         q[dim] = newlon
         #q = q.reindex(**{dim: sorted(q[dim])})
         q = q.isel(**{dim: q[dim].argsort().values})
-    return q
\ No newline at end of file
+    return q
+
+def _center_lon_along(field, dim, lon0, wrap=False):
+    # recentre every slice of `field` on its own origin in `lon0`.
+    # On a regular grid, moving the origin to grid point s is a cyclic shift
+    # by s of the axis recentred on the first grid point, so the per-slice
+    # gather indices can all be computed at once.
+    lon = field[dim].values
+    dist = np.abs(np.mod(lon - lon0.values[..., np.newaxis] + 180.0, 360.0) - 180.0)
+    shift = dist.argmin(axis=-1)
+
+    newlon = np.mod(lon - lon[0] + 360.0, 360.0)
+    if wrap:
+        newlon[newlon > 180] -= 360
+    order = np.argsort(newlon)
+    index = xr.DataArray(np.mod(order + shift[..., np.newaxis], len(lon)),
+                         dims=lon0.dims + (dim,),
+                         coords={d: lon0[d] for d in lon0.dims if d in lon0.coords})
+
+    def recentre(arr):
+        if dim not in arr.dims:
+            return arr
+        gathered = xr.apply_ufunc(_take_last_axis, arr, index,
+                                  input_core_dims=[[dim], [dim]],
+                                  output_core_dims=[[dim]],
+                                  dask='parallelized',
+                                  output_dtypes=[arr.dtype])
+        return gathered.transpose(*(arr.dims + tuple(d for d in gathered.dims if d not in arr.dims)))
+
+    if isinstance(field, xr.Dataset):
+        q = field.map(recentre, keep_attrs=True)
+    else:
+        q = recentre(field)
+    return q.assign_coords({dim: newlon[order]})
+
+def _take_last_axis(values, index):
+    return np.take_along_axis(values, index, axis=-1)
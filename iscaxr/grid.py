@@ -0,0 +1,166 @@
+"""Grid geometry for Isca datasets.
+
+Area weights, cos(lat) and layer thicknesses only depend on the grid
+coordinates of a run, not on the fields defined on it.  `IscaGrid` computes
+them once and is cached by a hash of those coordinates, so repeated
+diagnostics over the same run share a single copy of the geometry.
+"""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+GRID_COORDS = ('lat', 'latb', 'lon', 'lonb', 'pfull', 'phalf')
+
+# the number of distinct grids kept in memory before the least
+# recently used one is discarded.
+MAX_CACHED_GRIDS = 16
+_grid_cache = OrderedDict()
+
+
+def grid_hash(domain, coords=GRID_COORDS):
+    """Calculate a hash of the grid coordinates of an Isca dataset.
+
+    Two datasets with the same hash are defined on the same grid.
+
+    Parameters
+    ----------
+    domain : IscaDataSet (xarray.DataSet) or IscaGrid
+    coords : sequence of str, optional
+        The coordinates that define the grid.  Any that are not present in
+        `domain` are ignored.
+
+    Returns
+    -------
+    hash : str
+        A hex digest of the coordinate names, dtypes and values.
+    """
+    h = hashlib.sha1()
+    for c in coords:
+        coord = getattr(domain, c, None)
+        if coord is None:
+            continue
+        values = np.ascontiguousarray(np.asarray(coord))
+        h.update(c.encode())
+        h.update(str(values.dtype).encode())
+        h.update(values.tobytes())
+    return h.hexdigest()
+
+
+class IscaGrid(object):
+    """The geometry of an Isca grid.
+
+    Holds the grid coordinates and precomputed weights that are shared by
+    all area- and mass-weighted diagnostics.  All held arrays are read-only.
+
+    Use `IscaGrid.from_dataset` (or `get_grid`) rather than the constructor
+    to share the geometry between calls.
+
+    Attributes
+    ----------
+    lat, latb, lon, lonb, pfull, phalf : xarray.DataArray
+        The grid coordinates, where present in the source dataset.
+    coslat : xarray.DataArray
+        cos(lat), indexed by `lat`.
+    dlat, dlon : xarray.DataArray
+        Grid size in radians, indexed by `lat` and `lon`.
+    dA : xarray.DataArray
+        Area of each grid cell on the unit sphere, indexed by `lat` and `lon`.
+    dp : xarray.DataArray
+        Pressure thickness of each layer in Pa, indexed by `pfull`.
+    hash : str
+        The grid hash, see `grid_hash`.
+    """
+    def __init__(self, domain):
+        self.hash = grid_hash(domain)
+        for c in GRID_COORDS:
+            coord = getattr(domain, c, None)
+            if coord is not None:
+                coord = _readonly(xr.DataArray(np.array(coord), coords=[(c, np.array(coord))], name=c))
+            setattr(self, c, coord)
+
+        rad = np.pi / 180
+        self.coslat = self.dlat = self.dlon = self.dA = self.dp = None
+        if self.lat is not None:
+            self.coslat = _readonly(np.cos(self.lat * rad))
+        if self.lat is not None and self.latb is not None:
+            dlat = (self.latb*rad).diff('latb')
+            dlat.name = 'dlat'
+            dlat = dlat.rename({'latb': 'lat'})
+            self.dlat = _readonly(dlat.assign_coords(lat=self.lat.values))
+        if self.lon is not None and self.lonb is not None:
+            dlon = (self.lonb*rad).diff('lonb')
+            dlon.name = 'dlon'
+            dlon = dlon.rename({'lonb': 'lon'})
+            self.dlon = _readonly(dlon.assign_coords(lon=self.lon.values))
+        if self.dlat is not None and self.dlon is not None:
+            self.dA = _readonly(self.dlat*self.dlon*self.coslat)
+        if self.pfull is not None and self.phalf is not None:
+            self.dp = _readonly(xr.DataArray(np.diff(self.phalf.values)*100,
+                                             coords=[('pfull', self.pfull.values)], name='dp'))
+
+    @classmethod
+    def from_dataset(cls, domain):
+        """Get the (cached) grid of an Isca dataset."""
+        key = grid_hash(domain)
+        try:
+            grid = _grid_cache.pop(key)
+        except KeyError:
+            grid = cls(domain)
+        _grid_cache[key] = grid
+        while len(_grid_cache) > MAX_CACHED_GRIDS:
+            _grid_cache.popitem(last=False)
+        return grid
+
+    def __repr__(self):
+        dims = ', '.join('{}: {}'.format(c, len(getattr(self, c)))
+                         for c in GRID_COORDS if getattr(self, c) is not None)
+        return '<IscaGrid ({}) {}>'.format(dims, self.hash[:8])
+
+
+def get_grid(domain):
+    """Return the IscaGrid for `domain`.
+
+    `domain` may be an IscaGrid, returned as is, or a dataset whose grid is
+    looked up in (or added to) the grid cache.
+    """
+    if isinstance(domain, IscaGrid):
+        return domain
+    return IscaGrid.from_dataset(domain)
+
+def _point_index(values, grid_values, period=None):
+    # index of the point of `values` at each of `grid_values`, or None if
+    # they aren't the same points (in any order)
+    values, grid_values = np.asarray(values, dtype=float), np.asarray(grid_values, dtype=float)
+    if len(values) != len(grid_values):
+        return None
+    diff = values[np.newaxis, :] - grid_values[:, np.newaxis]
+    if period is not None:
+        diff = (diff + period/2) % period - period/2
+    index = np.abs(diff).argmin(axis=1)
+    if not np.allclose(diff[np.arange(len(index)), index], 0, atol=1e-6):
+        return None
+    return index
+
+def match_grid(field, lat, lon):
+    """Put the (lat, lon) points of `field` in the order of `lat` and `lon`.
+
+    For weights precomputed on a grid and applied by position.  Points are
+    matched by value, longitudes modulo 360, so a field whose longitudes
+    were shifted or reordered, e.g. by `center_lon`, is put back in the
+    order of the grid.  Raises ValueError if `field` is on another grid,
+    or a subset of it.
+    """
+    ilat = _point_index(field.lat.values, lat)
+    ilon = _point_index(field.lon.values, lon, period=360.0)
+    if ilat is None or ilon is None:
+        raise ValueError('the field is not on the expected grid of {:d} lats and {:d} lons'.format(len(lat), len(lon)))
+    if np.array_equal(ilat, np.arange(len(lat))) and np.array_equal(ilon, np.arange(len(lon))):
+        return field
+    return field.isel(lat=ilat, lon=ilon).assign_coords(lat=lat, lon=lon)
+
+
+def _readonly(arr):
+    arr.values.flags.writeable = False
+    return arr
@@ -0,0 +1,246 @@
+"""Open the output of many Isca runs as a single dataset.
+
+Isca writes each run of an experiment to its own directory, e.g.
+
+    experiment/run0001/atmos_monthly.nc
+    experiment/run0002/atmos_monthly.nc
+    ...
+
+Opening hundreds of these with `open_mfdataset` is slow: every file is
+opened, its metadata decoded, and its coordinates compared.  `open_runs`
+instead keeps a small JSON index of each file's dimensions, times,
+variables and grid hash alongside the data, or in the user's cache
+directory if the experiment directory is read-only.  Only files whose
+mtime or size has changed since the last open are scanned again.  The
+dataset is then built from the first file and the index alone: the other
+files are only opened when their data is computed.
+"""
+import glob
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from iscaxr.grid import grid_hash
+
+INDEX_FILENAME = '.iscaxr_index.json'
+INDEX_VERSION = 2
+USER_INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                              'iscaxr', 'indexes')
+
+
+def find_run_files(basedir, filename='atmos_monthly.nc', runs='run*'):
+    """Return the sorted paths of `filename` in each run directory of `basedir`."""
+    return sorted(glob.glob(os.path.join(basedir, runs, filename)))
+
+def scan_file(path):
+    """Read the metadata of a single Isca output file.
+
+    Returns a dict of the file's dimension sizes, data variables,
+    raw (undecoded) times, time range and units, and grid hash.
+    """
+    with xr.open_dataset(path, decode_times=False) as ds:
+        meta = {
+            'dims': dict(ds.sizes),
+            'variables': sorted(ds.data_vars),
+            'time': None,
+            'time_range': None,
+            'time_units': None,
+            'calendar': None,
+            'grid_hash': grid_hash(ds),
+        }
+        if 'time' in ds.coords and ds.time.dims == ('time',):
+            meta['time'] = ds.time.values.tolist()
+        if 'time' in ds.coords and ds.time.size > 0:
+            meta['time_range'] = [float(ds.time[0]), float(ds.time[-1])]
+            meta['time_units'] = ds.time.attrs.get('units')
+            meta['calendar'] = ds.time.attrs.get('calendar')
+    return meta
+
+def load_index(index_path):
+    """Load a run index from disk.  Returns an empty index if there is none."""
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('files', {})
+
+def save_index(index, index_path):
+    """Atomically write a run index to disk.  Raises OSError if it can't be written."""
+    tmp_path = '{}.{:d}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'files': index}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+def update_index(files, index_path):
+    """Bring the index at `index_path` up to date with `files`.
+
+    Files are only scanned if they are new, or their mtime or size has
+    changed since they were last indexed.  Entries of other files, e.g.
+    another output file of the same runs, are kept as long as the file
+    exists, so that one index serves all the output of an experiment.
+
+    Returns
+    -------
+    index : dict
+        File metadata (see `scan_file`), keyed by path relative to the
+        directory of the index, for `files` and the other indexed files.
+    """
+    root = os.path.dirname(os.path.abspath(index_path))
+    old_index = load_index(index_path)
+    index = {}
+    changed = False
+    for path in files:
+        key = os.path.relpath(os.path.abspath(path), root)
+        st = os.stat(path)
+        entry = old_index.get(key)
+        if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            entry = scan_file(path)
+            entry['mtime'] = st.st_mtime
+            entry['size'] = st.st_size
+            changed = True
+        index[key] = entry
+    for key, entry in old_index.items():
+        if key not in index and os.path.exists(os.path.join(root, key)):
+            index[key] = entry
+    if changed or set(index) != set(old_index):
+        try:
+            save_index(index, index_path)
+        except OSError as e:
+            # the index only saves time: carry on without it
+            warnings.warn('could not save the run index {!r}: {}'.format(index_path, e))
+    return index
+
+def _default_index_path(basedir):
+    # the index is kept in the experiment directory, or if that can't be
+    # written, e.g. a read-only archive, in the user's cache directory
+    path = os.path.join(basedir, INDEX_FILENAME)
+    if os.path.exists(path) or _is_writable(basedir):
+        return path
+    name = hashlib.sha1(os.path.abspath(basedir).encode()).hexdigest() + '.json'
+    return os.path.join(USER_INDEX_DIR, name)
+
+def _is_writable(directory):
+    tmp_path = os.path.join(directory, '{}.{:d}.tmp'.format(INDEX_FILENAME, os.getpid()))
+    try:
+        open(tmp_path, 'w').close()
+        os.remove(tmp_path)
+    except OSError:
+        return False
+    return True
+
+def _read_variable(path, name, mtime):
+    # `mtime` is part of the dask key, so that a rewritten file isn't
+    # mistaken for the old one
+    with xr.open_dataset(path, decode_times=False) as ds:
+        return ds.variables[name].values
+
+def _can_open_indexed(entries, kwargs):
+    first = entries[0]
+    return (set(kwargs) <= {'decode_times'} and isinstance(kwargs.get('decode_times', True), bool)
+            and all(e['time'] is not None and e['variables'] == first['variables']
+                    and e['time_units'] == first['time_units'] and e['calendar'] == first['calendar']
+                    for e in entries))
+
+def _open_indexed(files, entries, chunks, decode_times=True):
+    # the first file gives the variables, coordinates and attributes, and
+    # the index the times of the others, whose data is read by a dask task
+    # per file and variable
+    import dask
+    import dask.array as da
+    template = xr.open_dataset(files[0], decode_times=False)
+    times = np.concatenate([np.asarray(e['time'], dtype=template.time.dtype) for e in entries])
+    variables = {'time': xr.Variable('time', times, template.time.attrs, template.time.encoding)}
+    for name, var in template.variables.items():
+        if 'time' not in var.dims or name == 'time':
+            continue
+        axis = var.dims.index('time')
+        blocks = []
+        for path, entry in zip(files, entries):
+            shape = var.shape[:axis] + (len(entry['time']),) + var.shape[axis+1:]
+            read = dask.delayed(_read_variable, pure=True)(os.path.abspath(path), name, entry['mtime'])
+            blocks.append(da.from_delayed(read, shape, var.dtype))
+        variables[name] = xr.Variable(var.dims, da.concatenate(blocks, axis=axis), var.attrs, var.encoding)
+    data = xr.Dataset({n: variables.get(n, template.variables[n]) for n in template.data_vars},
+                      coords={n: variables.get(n, template.variables[n]) for n in template.coords},
+                      attrs=template.attrs)
+    if decode_times:
+        data = xr.decode_cf(data, mask_and_scale=False, concat_characters=False, decode_coords=False)
+    if chunks:
+        data = data.chunk(chunks)
+    data.set_close(template.close)
+    return data
+
+def open_runs(basedir, filename='atmos_monthly.nc', runs='run*', index_path=None, chunks=None,
+              time_range=None, **kwargs):
+    """Open the output of all runs of an Isca experiment as one dataset.
+
+    Parameters
+    ----------
+    basedir : str
+        The experiment directory, containing a directory for each run.
+    filename : str, optional
+        The output file within each run directory.  Default: 'atmos_monthly.nc'
+    runs : str, optional
+        Glob pattern of the run directories.  Default: 'run*'
+    index_path : str, optional
+        Where to keep the metadata index.  Default: `.iscaxr_index.json`
+        in `basedir`, or in the user's cache directory if `basedir` is
+        read-only.
+    chunks : int or dict, optional
+        Dask chunks.  Default: one chunk per file.
+    time_range : (float, float), optional
+        Only open the files with times in this range, in the units of
+        the files' (undecoded) time coordinate, e.g. days.
+    **kwargs
+        Passed on to `xarray.open_dataset`.  Only `decode_times` is
+        supported when building the dataset from the index: other
+        arguments, or files without a time dimension or with differing
+        variables, fall back to `xarray.open_mfdataset`.
+
+    Returns
+    -------
+    dataset : xarray.Dataset
+        The lazily concatenated output of all runs, in time order.
+    """
+    files = find_run_files(basedir, filename, runs)
+    if not files:
+        raise IOError('no files matching {!r} in {!r}'.format(os.path.join(runs, filename), basedir))
+    if index_path is None:
+        index_path = _default_index_path(basedir)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    index = update_index(files, index_path)
+    root = os.path.dirname(os.path.abspath(index_path))
+    entries = [index[os.path.relpath(os.path.abspath(f), root)] for f in files]
+
+    hashes = set(e['grid_hash'] for e in entries)
+    if len(hashes) > 1:
+        raise ValueError('runs in {!r} are not all on the same grid'.format(basedir))
+
+    # order by the start of each file's time range, files without time last
+    order = sorted(range(len(files)),
+                   key=lambda i: (entries[i]['time_range'] is None, entries[i]['time_range'] or [0]))
+    if time_range is not None:
+        start, end = time_range
+        order = [i for i in order if entries[i]['time_range'] is not None
+                 and entries[i]['time_range'][1] >= start and entries[i]['time_range'][0] <= end]
+        if not order:
+            raise IOError('no runs in {!r} with times in {}'.format(basedir, time_range))
+    files = [files[i] for i in order]
+    entries = [entries[i] for i in order]
+
+    if _can_open_indexed(entries, kwargs):
+        return _open_indexed(files, entries, chunks, **kwargs)
+    # the grid hashes already guarantee matching coordinates, so xarray
+    # doesn't need to compare them again
+    kwargs.setdefault('data_vars', 'minimal')
+    kwargs.setdefault('coords', 'minimal')
+    kwargs.setdefault('compat', 'override')
+    kwargs.setdefault('join', 'override')
+    return xr.open_mfdataset(files, combine='nested', concat_dim='time', chunks=chunks, **kwargs)
@@ -1,19 +1,22 @@
+import collections
+import importlib
+import multiprocessing
 import os
 import shutil
-import warnings
 import subprocess
-from collections import namedtuple
+import sys
+import warnings
 
 import numpy as np
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-from cartopy.mpl.geoaxes import GeoAxes
 
 from iscaxr.util import nearest_val, absmax
-from iscaxr import cmap
-
-
 
+# matplotlib and cartopy are slow to import, so are only imported by the
+# functions that draw.  `plotting.cmap` is loaded on first access.
+def __getattr__(name):
+    if name == 'cmap':
+        return importlib.import_module('iscaxr.cmap')
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def make_video(filepattern, output, framerate=5):
@@ -21,9 +24,102 @@ def make_video(filepattern, output, framerate=5):
     command = command.format(filepattern=filepattern, framerate=framerate, output=output)
     subprocess.call([command], shell=True)
 
-def make_timeseries_video(field, frame_fn, outname, framerate=5, tempdir='_frames', cleanup=True, tqdm=None):
+def stream_video(frames, output, framerate=5):
+    """Encode a sequence of frames to video by piping them to ffmpeg.
+
+    Parameters
+    ----------
+    frames : iterable of numpy.ndarray
+        RGB images, (height, width, 3) arrays of uint8, in frame order.
+        All frames must be the same size as the first: ValueError is
+        raised, and the video abandoned, at the first that isn't.
+    output : str
+        The output video filename.
+    framerate : int, optional
+        Frames per second.  Default: 5.
+    """
+    proc = None
+    try:
+        for i, frame in enumerate(frames):
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+            if proc is None:
+                shape = frame.shape
+                if frame.ndim != 3 or shape[2] != 3:
+                    raise ValueError('frames must be (height, width, 3) RGB arrays, not {}'.format(shape))
+                height, width, _ = shape
+                command = ['ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                           '-s', '{:d}x{:d}'.format(width, height), '-framerate', '{:d}'.format(framerate),
+                           '-i', '-', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'scale=3200:-2', output]
+                proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+            elif frame.shape != shape:
+                # ffmpeg reads raw frames of the first size: a different
+                # size would silently corrupt the rest of the video
+                raise ValueError('frame {:d} is {}, but the first frame is {}'.format(i, frame.shape, shape))
+            proc.stdin.write(frame.tobytes())
+    except BaseException:
+        if proc is not None:
+            proc.kill()
+        raise
+    finally:
+        if proc is not None:
+            proc.stdin.close()
+            proc.wait()
+    if proc is not None and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+
+def figure_to_rgb(fig):
+    """Render a matplotlib figure to a (height, width, 3) uint8 RGB array."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+def _render_frame(args):
+    # runs in a worker process: draw one snapshot and return its pixels
+    import matplotlib.pyplot as plt
+    frame_fn, snapshot = args
+    fig = frame_fn(snapshot)
+    try:
+        return figure_to_rgb(fig)
+    finally:
+        plt.close(fig)
+
+def _rendered_frames(pool, frame_fn, field, in_flight):
+    # render the frames on `pool` in order, with at most `in_flight` waiting,
+    # so that workers faster than ffmpeg do not pile up frames in memory
+    pending = collections.deque()
+    for i in range(len(field.time)):
+        if len(pending) >= in_flight:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(_render_frame, ((frame_fn, field.isel(time=i)),)))
+    while pending:
+        yield pending.popleft().get()
+
+def make_timeseries_video(field, frame_fn, outname, framerate=5, tempdir='_frames', cleanup=True, tqdm=None,
+                          stream=False, processes=None):
+    """Make a video of `field` with one frame per timestep.
+
+    `frame_fn` takes the field at a single time and returns a matplotlib figure.
+
+    By default, frames are rendered in turn and saved as PNG files to
+    `tempdir` before being encoded by ffmpeg.  If `stream=True`, frames are
+    instead rendered in parallel on a pool of `processes` workers (default:
+    one per core) and piped directly to ffmpeg in frame order, without
+    writing any intermediate files.  At most two frames per worker are
+    held waiting for ffmpeg at any time.  In this mode `frame_fn` must be
+    picklable, e.g. a module-level function.
+    """
     if tqdm is None:
         tqdm = lambda x: x
+
+    if stream:
+        processes = processes or os.cpu_count() or 1
+        with multiprocessing.Pool(processes) as pool:
+            frames = _rendered_frames(pool, frame_fn, field, 2*processes)
+            stream_video(tqdm(frames), outname, framerate)
+        return
+
+    import matplotlib.pyplot as plt
     try:
         os.mkdir(tempdir)
     except:
@@ -69,6 +165,7 @@ def save_figure(fig, filename, overwrite=False):
 
 def plot_lat_press(field, domain, cmap='RdBu_r', ax=None, center0=True):
     """Plot a 2D meshgrid of data defined on pfull-lat levels."""
+    import matplotlib.pyplot as plt
     if ax is None:
         fig, ax = plt.subplots()
     pp = ax.pcolormesh(domain.latb, domain.phalf, field.transpose('pfull', 'lat'), cmap=cmap)
@@ -84,9 +181,11 @@ def plot_lat_press(field, domain, cmap='RdBu_r', ax=None, center0=True):
     return pp, cbar
 
 def plot_lat_lon(field, domain, ax=None, center0=True, overscale=1., **kwargs):
+    import matplotlib.pyplot as plt
     if ax is None:
         fig, ax = plt.subplots()
-    if isinstance(ax, GeoAxes):
+    if _is_geoaxes(ax):
+        import cartopy.crs as ccrs
         transform = ccrs.PlateCarree()
     else:
         transform = ax.transData
@@ -97,6 +196,11 @@ def plot_lat_lon(field, domain, ax=None, center0=True, overscale=1., **kwargs):
 
     return pp
 
+def _is_geoaxes(ax):
+    # only a cartopy axis if cartopy has been imported, by whoever made the axis
+    geoaxes = sys.modules.get('cartopy.mpl.geoaxes')
+    return geoaxes is not None and isinstance(ax, geoaxes.GeoAxes)
+
 def render_lat_lon_labels(ax, domain):
     ax.set_ylim(domain.latb.max(), domain.latb.min())
     ax.set_ylim(-90, 90)
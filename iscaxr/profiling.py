@@ -0,0 +1,308 @@
+"""Opt-in profiling of iscaxr calls.
+
+Find out which diagnostic dominates a batch job, and how much memory it
+used:
+
+    >>> with iscaxr.profiling.profile() as prof:
+    ...     psi = mass_streamfunction(data)
+    ...     egr = data.isca['egr']
+    >>> prof.report()                    # per-function summary, as a dict
+    >>> prof.to_dataframe()              # one row per call
+    >>> prof.to_json('profile.json')
+
+While profiling is enabled the public functions of `iscaxr.domain`,
+`iscaxr.util` and the `iscaxr.analysis` modules, and the public methods of
+their classes and of the xarray accessors, are replaced by instrumented
+versions.  Each call records:
+
+    - the wall time, including the time of the iscaxr calls it makes,
+    - the peak memory allocated during the call (tracemalloc), above what
+      was allocated when it started,
+    - the bytes of the xarray and numpy arguments and results,
+    - whether the result is lazy (dask-backed), and if so the number of
+      tasks in its graph.
+
+Only the time spent in the call is measured: for lazy results, the cost of
+computing them is paid later, at `.compute()`.  Calls made inside another
+instrumented call are recorded too, with their `depth` and `parent`.
+
+With profiling disabled (the default) nothing is patched, so there is no
+overhead at all.  tracemalloc itself slows allocation-heavy code down
+considerably: use `profile(memory=False)` when only timings are wanted.
+
+Functions are replaced in the iscaxr modules only, so a function imported
+by name into your own code, e.g. `from iscaxr.util import detrend`, before
+profiling was enabled is not recorded.  Call it through its module, e.g.
+`iscaxr.util.detrend`, to profile it.
+"""
+import functools
+import importlib
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import xarray as xr
+
+# the modules whose public functions and classes are instrumented
+MODULES = ('iscaxr.domain', 'iscaxr.util',
+           'iscaxr.analysis.accumulate', 'iscaxr.analysis.atmosphere', 'iscaxr.analysis.derived',
+           'iscaxr.analysis.exoplanet', 'iscaxr.analysis.mass_streamfunction',
+           'iscaxr.analysis.spectral', 'iscaxr.analysis.thermodynamics',
+           'iscaxr.xarray_extensions')
+
+_FIELDS = ('name', 'depth', 'parent', 'wall_time', 'peak_memory', 'input_bytes', 'output_bytes',
+           'lazy', 'graph_tasks')
+
+_active = {'profiler': None}
+
+
+def _nbytes(obj):
+    # bytes of the arrays in obj, without computing dask arrays
+    if isinstance(obj, (xr.DataArray, xr.Dataset, np.ndarray)):
+        return int(obj.nbytes)
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(o) for o in obj.values())
+    return 0
+
+def _graph_keys(obj):
+    # keys of the dask task graphs in obj
+    if isinstance(obj, (list, tuple)):
+        return set().union(*[_graph_keys(o) for o in obj])
+    if isinstance(obj, dict):
+        return _graph_keys(list(obj.values()))
+    if isinstance(obj, (xr.DataArray, xr.Dataset)) or hasattr(obj, 'dask'):
+        graph = obj.__dask_graph__()
+        if graph is not None:
+            return set(graph.keys())
+    return set()
+
+
+class _Frame(object):
+    # a call in progress
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.peak = 0
+
+
+class Profiler(object):
+    """Records of the instrumented calls made while it is enabled.
+
+    Parameters
+    ----------
+    memory : bool, optional
+        Trace memory allocations to record the peak memory of each call.
+        Default: True
+    callback : callable, optional
+        Called with the record of each call as it completes, e.g. to log
+        the progress of a long job.
+    """
+    def __init__(self, memory=True, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self._stack = []
+        self._started_tracing = False
+
+    def _enter(self, name):
+        frame = _Frame(name, self._stack[-1] if self._stack else None)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if frame.parent is not None:
+                # the peak is shared: keep the caller's so far before resetting it
+                frame.parent.peak = max(frame.parent.peak, peak)
+            tracemalloc.reset_peak()
+            frame.start_memory = current
+        self._stack.append(frame)
+        frame.start = time.perf_counter()
+        return frame
+
+    def _exit(self, frame, args, kwargs, result):
+        wall_time = time.perf_counter() - frame.start
+        self._stack.pop()
+        peak_memory = None
+        if self.memory:
+            peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+            peak_memory = max(peak - frame.start_memory, 0)
+            if frame.parent is not None:
+                frame.parent.peak = max(frame.parent.peak, peak)
+        graph_tasks = len(_graph_keys(result))
+        record = {
+            'name': frame.name,
+            'depth': frame.depth,
+            'parent': None if frame.parent is None else frame.parent.name,
+            'wall_time': wall_time,
+            'peak_memory': peak_memory,
+            'input_bytes': _nbytes(args) + _nbytes(kwargs),
+            'output_bytes': _nbytes(result),
+            'lazy': graph_tasks > 0,
+            'graph_tasks': graph_tasks,
+        }
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def clear(self):
+        """Forget all records."""
+        del self.records[:]
+
+    def report(self):
+        """A summary of the calls of each function, as a dict of name ->
+        dict of calls, total and maximum wall time, maximum peak memory,
+        total input and output bytes, lazy calls and maximum graph tasks.
+
+        The total time of a function includes that of the iscaxr calls it
+        made, so the totals of nested calls overlap."""
+        summary = {}
+        for r in self.records:
+            s = summary.setdefault(r['name'], {
+                'calls': 0, 'total_time': 0.0, 'max_time': 0.0, 'peak_memory': None,
+                'input_bytes': 0, 'output_bytes': 0, 'lazy_calls': 0, 'graph_tasks': 0})
+            s['calls'] += 1
+            s['total_time'] += r['wall_time']
+            s['max_time'] = max(s['max_time'], r['wall_time'])
+            if r['peak_memory'] is not None:
+                s['peak_memory'] = max(s['peak_memory'] or 0, r['peak_memory'])
+            s['input_bytes'] += r['input_bytes']
+            s['output_bytes'] += r['output_bytes']
+            s['lazy_calls'] += int(r['lazy'])
+            s['graph_tasks'] = max(s['graph_tasks'], r['graph_tasks'])
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['total_time']))
+
+    def to_dataframe(self):
+        """The records as a pandas DataFrame, one row per call."""
+        import pandas as pd
+        return pd.DataFrame(self.records, columns=list(_FIELDS))
+
+    def to_json(self, path=None):
+        """The records and summary as JSON.  Written to `path` if given,
+        otherwise returned as a string."""
+        text = json.dumps({'records': self.records, 'summary': self.report()}, indent=1)
+        if path is None:
+            return text
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+def _instrument(fn, name):
+    @functools.wraps(fn)
+    def instrumented(*args, **kwargs):
+        profiler = _active['profiler']
+        if profiler is None:
+            return fn(*args, **kwargs)
+        frame = profiler._enter(name)
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        finally:
+            profiler._exit(frame, args, kwargs, result)
+    instrumented.__profiled__ = fn
+    return instrumented
+
+def _public(name):
+    # accessors are used through __call__ and __getitem__
+    return not name.startswith('_') or name in ('__call__', '__getitem__')
+
+def _targets(modules):
+    # (owner, attribute, original, qualified name) of everything to instrument
+    targets = []
+    for modname in modules:
+        module = importlib.import_module(modname)
+        for attr, obj in list(vars(module).items()):
+            if getattr(obj, '__module__', None) != modname or not _public(attr):
+                continue
+            if inspect.isfunction(obj):
+                targets.append((module, attr, obj, '{}.{}'.format(modname, attr)))
+            elif inspect.isclass(obj) and not issubclass(obj, BaseException):
+                for method, value in list(vars(obj).items()):
+                    fn = value.__func__ if isinstance(value, (classmethod, staticmethod)) else value
+                    if _public(method) and inspect.isfunction(fn):
+                        targets.append((obj, method, value, '{}.{}.{}'.format(modname, attr, method)))
+    return targets
+
+def _wrap(value, name):
+    if isinstance(value, (classmethod, staticmethod)):
+        return type(value)(_instrument(value.__func__, name))
+    return _instrument(value, name)
+
+_patched = []
+
+def _patch(modules):
+    functions = {}
+    for owner, attr, orig, name in _targets(modules):
+        if inspect.isclass(owner):
+            _patched.append((owner, attr, orig))
+            setattr(owner, attr, _wrap(orig, name))
+        else:
+            functions[id(orig)] = _wrap(orig, name)
+    # functions are also replaced wherever iscaxr has imported them by name,
+    # e.g. `from .atmosphere import eady_growth_rate`
+    for modname, module in list(sys.modules.items()):
+        if module is None or not (modname == 'iscaxr' or modname.startswith('iscaxr.')):
+            continue
+        for attr, obj in list(vars(module).items()):
+            if id(obj) in functions and inspect.isfunction(obj):
+                _patched.append((module, attr, obj))
+                setattr(module, attr, functions[id(obj)])
+
+def _unpatch():
+    while _patched:
+        owner, attr, orig = _patched.pop()
+        setattr(owner, attr, orig)
+
+
+def enable(profiler=None, modules=MODULES):
+    """Start profiling iscaxr calls, recording them in `profiler`.
+
+    Returns the Profiler (a new one, with memory tracing, if not given)."""
+    if _active['profiler'] is not None:
+        raise RuntimeError('profiling is already enabled')
+    profiler = profiler or Profiler()
+    _patch(modules)
+    profiler.start()
+    _active['profiler'] = profiler
+    return profiler
+
+def disable():
+    """Stop profiling, restoring the original functions.  Returns the Profiler."""
+    profiler = _active['profiler']
+    _active['profiler'] = None
+    _unpatch()
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def is_enabled():
+    return _active['profiler'] is not None
+
+@contextmanager
+def profile(memory=True, callback=None, modules=MODULES):
+    """Profile the iscaxr calls made in a with block.
+
+        >>> with profile() as prof:
+        ...     zonal_dispersion(data.ucomp)
+        >>> prof.report()
+    """
+    profiler = enable(Profiler(memory=memory, callback=callback), modules)
+    try:
+        yield profiler
+    finally:
+        disable()
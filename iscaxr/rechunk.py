@@ -0,0 +1,227 @@
+"""Convert Isca netCDF output to zarr, rechunked for analysis.
+
+Isca writes one file per month (or so) with one timestep per chunk, while
+time-series diagnostics such as `zonal_dispersion`, `detrend` and
+`lon_to_xi` need the whole time axis at each point.  `rechunk_to_zarr`
+copies a run archive to a zarr store with chunks laid out for either
+
+    - 'timeseries': the full time axis and longitude circle in each chunk,
+      split by level and latitude, or
+    - 'map': whole (pfull, lat, lon) fields in each chunk, split in time,
+
+within a memory budget.  Going from one-timestep chunks straight to
+full-time-axis chunks would need every source chunk in memory at once, so
+when that doesn't fit in the budget the copy is made in two stages through
+an intermediate store with chunks in between the two, as in the Pangeo
+rechunker.  Neither stage ever holds more than a chunk per worker.
+
+The grid coordinates (lat, latb, lon, lonb, pfull, phalf) are stored
+in full, along with the grid hash used by `iscaxr.grid`.
+
+    $ iscaxr-rechunk experiment/ experiment.zarr --layout timeseries --max-mem 4GB
+"""
+import argparse
+import math
+import os
+import shutil
+import sys
+
+import numpy as np
+import xarray as xr
+
+from iscaxr.grid import GRID_COORDS, grid_hash
+from iscaxr.loader import open_runs
+
+LAYOUTS = ('timeseries', 'map')
+
+# the largest chunk written, even if the memory budget allows more
+MAX_CHUNK_BYTES = 128*1024**2
+
+# netCDF encodings that don't apply to zarr
+_NETCDF_ENCODING = ('chunksizes', 'zlib', 'complevel', 'shuffle', 'fletcher32', 'contiguous',
+                    'source', 'original_shape', 'preferred_chunks', 'chunks', 'compressor',
+                    'compressors', 'filters', 'szip', 'zstd', 'bzip2', 'blosc', 'endian', 'quantize_mode',
+                    'significant_digits')
+
+
+def parse_bytes(value):
+    """Parse a size such as 2e9, '500MB' or '4GB' to a number of bytes."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    units = {'kb': 1e3, 'mb': 1e6, 'gb': 1e9, 'tb': 1e12, 'kib': 2**10, 'mib': 2**20, 'gib': 2**30, 'b': 1}
+    text = value.strip().lower()
+    for suffix in sorted(units, key=len, reverse=True):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)])*units[suffix])
+    return int(float(text))
+
+def _nbytes(chunks, itemsize):
+    return int(np.prod(list(chunks.values())))*itemsize
+
+def target_chunks(sizes, itemsize, layout, max_bytes):
+    """Chunk sizes for each dimension of `sizes` for an access `layout`.
+
+    'timeseries' keeps the time and lon dimensions whole and adds
+    latitudes, then levels, to each chunk up to `max_bytes`.  'map' keeps
+    each (pfull, lat, lon) field whole and adds timesteps.  The dimensions
+    that must be whole always are, even if that exceeds `max_bytes`.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('unknown layout {!r}, use one of {}'.format(layout, LAYOUTS))
+    if layout == 'timeseries':
+        whole, grow = ('time', 'lon'), ('lat', 'pfull', 'phalf')
+    else:
+        whole, grow = ('pfull', 'phalf', 'lat', 'lon'), ('time',)
+    chunks = {d: (n if d in whole or d not in grow else 1) for d, n in sizes.items()}
+    for d in grow:
+        if d not in chunks:
+            continue
+        # as many as fit in the budget
+        others = _nbytes(dict(chunks, **{d: 1}), itemsize)
+        chunks[d] = int(min(sizes[d], max(1, max_bytes // others)))
+    return chunks
+
+def _lcm(a, b, size):
+    return min(a*b // math.gcd(a, b), size)
+
+def _copy_bytes(from_chunks, to_chunks, sizes, itemsize):
+    # memory needed to copy between two chunkings: the smallest region made
+    # of whole chunks of both
+    return _nbytes({d: _lcm(from_chunks[d], to_chunks[d], sizes[d]) for d in sizes}, itemsize)
+
+def plan_stages(source, target, sizes, itemsize, max_bytes):
+    """Plan a rechunk from `source` to `target` chunks in at most two stages.
+
+    Returns the list of chunkings to write in turn: [target] if the copy
+    fits within `max_bytes`, otherwise [intermediate, target].  The
+    intermediate chunks are grown from the smaller of the source and target
+    chunks in each dimension for as long as both copies still fit.
+    """
+    if _copy_bytes(source, target, sizes, itemsize) <= max_bytes:
+        return [target]
+    inter = {d: min(source[d], target[d]) for d in sizes}
+    grown = True
+    while grown:
+        grown = False
+        for d in sizes:
+            bigger = min(2*inter[d], max(source[d], target[d]), sizes[d])
+            if bigger == inter[d]:
+                continue
+            trial = dict(inter, **{d: bigger})
+            if (_copy_bytes(source, trial, sizes, itemsize) <= max_bytes
+                    and _copy_bytes(trial, target, sizes, itemsize) <= max_bytes):
+                inter = trial
+                grown = True
+    return [inter, target]
+
+
+def _source_chunks(data):
+    # the largest chunk along each dimension, or whole dimensions if not chunked
+    chunks = dict(data.sizes)
+    for d, c in (data.chunks or {}).items():
+        chunks[d] = max(c)
+    return chunks
+
+def _with_grid(data):
+    # keep the full grid coordinates, with cell bounds, in memory and
+    # as coordinates rather than data variables
+    data = data.set_coords([c for c in GRID_COORDS if c in data.data_vars])
+    if 'lat' in data.coords and 'latb' not in data.coords:
+        from iscaxr.regrid import _lat_bounds
+        data = data.assign_coords(latb=_lat_bounds(data.lat.values))
+    if 'lon' in data.coords and 'lonb' not in data.coords:
+        from iscaxr.regrid import _lon_bounds
+        data = data.assign_coords(lonb=_lon_bounds(data.lon.values))
+    data = data.assign_coords({c: data[c].load() for c in GRID_COORDS if c in data.coords})
+    data.attrs['iscaxr_grid_hash'] = grid_hash(data)
+    return data
+
+def _clear_encoding(data):
+    data = data.copy()
+    for var in data.variables.values():
+        for key in _NETCDF_ENCODING:
+            var.encoding.pop(key, None)
+    return data
+
+def _write(data, chunks, store, consolidated=True):
+    chunks = {d: c for d, c in chunks.items() if d in data.dims}
+    data.chunk(chunks).to_zarr(store, mode='w', consolidated=consolidated)
+
+def rechunk_to_zarr(data, store, layout='timeseries', max_mem='1GB', workers=None, temp_store=None):
+    """Copy an Isca dataset, or the runs of an experiment, to a rechunked zarr store.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or str
+        The dataset, opened lazily, or an experiment directory to open
+        with `iscaxr.open_runs` (times are left undecoded).
+    store : str
+        The zarr store to write.  Overwritten if it exists.
+    layout : str, optional
+        'timeseries' (default) or 'map', see the module docstring.
+    max_mem : int or str, optional
+        Memory budget for the whole copy, e.g. '4GB'.  Each of the
+        `workers` dask threads gets an equal share, of which a chunk may use half.
+    workers : int, optional
+        Number of dask threads.  Default: the number of cores.
+    temp_store : str, optional
+        Where to write the intermediate store, if one is needed.  Deleted
+        afterwards.  Default: `store` + '.tmp'
+
+    Returns
+    -------
+    stages : list of dict
+        The chunks written by each stage, ending with those of `store`.
+    """
+    import dask
+    if isinstance(data, str):
+        data = open_runs(data, decode_times=False)
+    workers = workers or os.cpu_count() or 1
+    chunk_budget = parse_bytes(max_mem) // (2*workers)
+
+    data = _clear_encoding(_with_grid(data))
+    fields = [v for v in data.data_vars.values() if v.ndim > 0]
+    # plan for the largest field: the others share its chunks along each dimension
+    ref = max(fields, key=lambda v: v.size)
+    sizes = {d: data.sizes[d] for d in ref.dims}
+    source = {d: c for d, c in _source_chunks(data).items() if d in sizes}
+    target = target_chunks(sizes, ref.dtype.itemsize, layout, min(chunk_budget, MAX_CHUNK_BYTES))
+    stages = plan_stages(source, target, sizes, ref.dtype.itemsize, chunk_budget)
+
+    data.attrs['iscaxr_layout'] = layout
+    temp_store = temp_store or store.rstrip(os.sep) + '.tmp'
+    with dask.config.set(scheduler='threads', num_workers=workers):
+        if len(stages) == 2:
+            _write(data, stages[0], temp_store, consolidated=False)
+            data = _clear_encoding(xr.open_zarr(temp_store, chunks={}, decode_times=False, consolidated=False))
+        _write(data, stages[-1], store)
+    if len(stages) == 2:
+        shutil.rmtree(temp_store, ignore_errors=True)
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='iscaxr-rechunk', description='Copy Isca netCDF output to zarr, rechunked for analysis.')
+    parser.add_argument('source', help='experiment directory containing run directories')
+    parser.add_argument('store', help='the zarr store to write')
+    parser.add_argument('-l', '--layout', default='timeseries', choices=LAYOUTS)
+    parser.add_argument('-m', '--max-mem', default='1GB', help="memory budget, e.g. '4GB'.  Default: 1GB")
+    parser.add_argument('-j', '--workers', type=int, default=None, help='dask threads.  Default: one per core')
+    parser.add_argument('-f', '--filename', default='atmos_monthly.nc', help='output file of each run')
+    parser.add_argument('-r', '--runs', default='run*', help='glob pattern of the run directories')
+    parser.add_argument('-v', '--variables', nargs='+', help='only copy these variables')
+    parser.add_argument('--temp-store', help='where to write the intermediate store')
+    args = parser.parse_args(argv)
+
+    data = open_runs(args.source, args.filename, args.runs, decode_times=False)
+    if args.variables:
+        # keep the grid coordinates, even those the variables don't use
+        data = data[args.variables].assign_coords({c: data[c] for c in GRID_COORDS if c in data.coords})
+    stages = rechunk_to_zarr(data, args.store, args.layout, args.max_mem, args.workers, args.temp_store)
+    for i, chunks in enumerate(stages):
+        print('stage {:d}: {}'.format(i+1, ', '.join('{}={}'.format(d, c) for d, c in chunks.items())))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
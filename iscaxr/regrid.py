@@ -0,0 +1,235 @@
+"""Regridding between lat-lon grids with precomputed weights.
+
+A `Regridder` computes the sparse matrix that maps fields on a source grid
+to a target grid once, and then applies it to any number of fields as a
+single sparse matrix product over the horizontal dimensions.  Weights are
+held in memory for each pair of grids and can also be stored on disk,
+keyed by the hashes of the two grids, so they survive between sessions.
+
+    >>> regrid = Regridder(data, latlon_grid(lats, lons), method='conservative')
+    >>> coarse = regrid(data.temp)
+"""
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+from iscaxr.grid import get_grid, match_grid
+
+METHODS = ('bilinear', 'conservative', 'spectral')
+
+# the number of weight matrices kept in memory before the least
+# recently used one is discarded.
+MAX_CACHED_WEIGHTS = 16
+_weights_cache = OrderedDict()
+
+
+def latlon_grid(lat, lon, latb=None, lonb=None):
+    """Create a target grid Dataset from cell centres, and optionally bounds.
+
+    Cell bounds are placed halfway between centres if not given."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    coords = {'lat': lat, 'lon': lon,
+              'latb': _lat_bounds(lat) if latb is None else np.asarray(latb),
+              'lonb': _lon_bounds(lon) if lonb is None else np.asarray(lonb)}
+    return xr.Dataset(coords=coords)
+
+def _lat_bounds(lat):
+    mid = 0.5*(lat[1:] + lat[:-1])
+    return np.concatenate([[-90.0], mid, [90.0]]) if lat[0] < lat[-1] else np.concatenate([[90.0], mid, [-90.0]])
+
+def _lon_bounds(lon):
+    mid = 0.5*(lon[1:] + lon[:-1])
+    return np.concatenate([[lon[0] - (mid[0] - lon[0])], mid, [lon[-1] + (lon[-1] - mid[-1])]])
+
+def _grid_coords(domain):
+    # lat, lon, latb, lonb of a dataset or IscaGrid, with bounds calculated
+    # if they are missing
+    grid = get_grid(domain)
+    lat = grid.lat.values
+    lon = grid.lon.values
+    latb = _lat_bounds(lat) if grid.latb is None else grid.latb.values
+    lonb = _lon_bounds(lon) if grid.lonb is None else grid.lonb.values
+    return lat, lon, latb, lonb
+
+
+def linear_weights(x_in, x_out):
+    """Linear interpolation matrix from points x_in to x_out (clamped at the ends)."""
+    order = np.argsort(x_in)
+    xs = x_in[order]
+    x = np.clip(x_out, xs[0], xs[-1])
+    i = np.clip(np.searchsorted(xs, x) - 1, 0, len(xs) - 2)
+    w = (x - xs[i]) / (xs[i+1] - xs[i])
+    rows = np.repeat(np.arange(len(x_out)), 2)
+    cols = order[np.stack([i, i+1], axis=-1).ravel()]
+    vals = np.stack([1 - w, w], axis=-1).ravel()
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(x_out), len(x_in)))
+
+def periodic_linear_weights(lon_in, lon_out, period=360.0):
+    """Linear interpolation matrix between longitudes, periodic in `period`."""
+    n = len(lon_in)
+    order = np.argsort(np.mod(lon_in, period))
+    xs = np.mod(lon_in, period)[order]
+    xs_ext = np.concatenate([[xs[-1] - period], xs, [xs[0] + period]])
+    cols_ext = np.concatenate([[order[-1]], order, [order[0]]])
+    x = np.mod(lon_out, period)
+    i = np.clip(np.searchsorted(xs_ext, x, side='right') - 1, 0, n)
+    w = (x - xs_ext[i]) / (xs_ext[i+1] - xs_ext[i])
+    rows = np.repeat(np.arange(len(lon_out)), 2)
+    cols = cols_ext[np.stack([i, i+1], axis=-1).ravel()]
+    vals = np.stack([1 - w, w], axis=-1).ravel()
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(lon_out), n))
+
+def _overlap_weights(b_in, b_out):
+    # fraction of each output cell covered by each input cell, for cells
+    # given by their (ascending) bounds
+    lo_in, hi_in = np.minimum(b_in[:-1], b_in[1:]), np.maximum(b_in[:-1], b_in[1:])
+    lo_out, hi_out = np.minimum(b_out[:-1], b_out[1:]), np.maximum(b_out[:-1], b_out[1:])
+    overlap = (np.minimum(hi_out[:, None], hi_in[None, :])
+               - np.maximum(lo_out[:, None], lo_in[None, :]))
+    return np.maximum(overlap, 0)
+
+def conservative_lat_weights(latb_in, latb_out):
+    """Area-conserving weights between latitude cells, by overlap in sin(lat)."""
+    overlap = _overlap_weights(np.sin(np.deg2rad(latb_in)), np.sin(np.deg2rad(latb_out)))
+    return scipy.sparse.csr_matrix(overlap / overlap.sum(axis=1, keepdims=True))
+
+def conservative_lon_weights(lonb_in, lonb_out, period=360.0):
+    """Conservative weights between longitude cells, periodic in `period`."""
+    overlap = sum(_overlap_weights(lonb_in + shift, lonb_out) for shift in (-period, 0, period))
+    return scipy.sparse.csr_matrix(overlap / overlap.sum(axis=1, keepdims=True))
+
+def spectral_lon_weights(lon_in, lon_out, period=360.0):
+    """Fourier (trigonometric) interpolation matrix between regularly spaced
+    longitudes, keeping the wavenumbers resolved on both grids."""
+    n_in, n_out = len(lon_in), len(lon_out)
+    k = np.fft.fftfreq(n_in, 1./n_in)
+    k = k[np.abs(k) < min(n_in, n_out)/2.0]
+    phase_in = np.exp(-2j*np.pi*np.outer(k, lon_in)/period) / n_in
+    phase_out = np.exp(2j*np.pi*np.outer(lon_out, k)/period)
+    return scipy.sparse.csr_matrix(np.real(phase_out @ phase_in))
+
+
+def _weights_key(method, source, target):
+    # the weights only depend on the horizontal coordinates the method
+    # uses: cell bounds for conservative regridding, otherwise centres
+    h = hashlib.sha1(method.encode())
+    for lat, lon, latb, lonb in (source, target):
+        for values in ((latb, lonb) if method == 'conservative' else (lat, lon)):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            h.update('{:d}|'.format(values.size).encode())
+            h.update(values.tobytes())
+    return h.hexdigest()
+
+class Regridder(object):
+    """Regrid fields from one lat-lon grid to another.
+
+    Parameters
+    ----------
+    source, target : IscaDataSet (xarray.DataSet) or IscaGrid
+        The source and target grids.  Must have `lat` and `lon` coordinates.
+        Cell bounds (`latb`, `lonb`) are used for conservative regridding,
+        and calculated from the cell centres if not present.
+    method : str, optional
+        - 'bilinear' (default): linear in latitude and periodic longitude.
+        - 'conservative': area-weighted overlap of grid cells.
+        - 'spectral': Fourier interpolation in longitude, linear in latitude.
+    cache_dir : str, optional
+        Directory in which to store the weights, keyed by the hashes of the
+        source and target grids.  If None, weights are only cached in memory.
+    """
+    def __init__(self, source, target, method='bilinear', cache_dir=None):
+        if method not in METHODS:
+            raise ValueError('unknown regridding method {!r}, use one of {}'.format(method, METHODS))
+        self.method = method
+        source, target = get_grid(source), get_grid(target)
+        self.lat_in, self.lon_in, latb_in, lonb_in = _grid_coords(source)
+        self.lat, self.lon, self.latb, self.lonb = _grid_coords(target)
+        self.key = _weights_key(method, (self.lat_in, self.lon_in, latb_in, lonb_in),
+                                (self.lat, self.lon, self.latb, self.lonb))
+        self.target = target
+        self.weights = self._load(cache_dir)
+        if self.weights is None:
+            self.weights = self._calculate(latb_in, lonb_in)
+            self._store(cache_dir)
+
+    def _calculate(self, latb_in, lonb_in):
+        if self.method == 'conservative':
+            wlat = conservative_lat_weights(latb_in, self.latb)
+            wlon = conservative_lon_weights(lonb_in, self.lonb)
+        elif self.method == 'spectral':
+            wlat = linear_weights(self.lat_in, self.lat)
+            wlon = spectral_lon_weights(self.lon_in, self.lon)
+        else:
+            wlat = linear_weights(self.lat_in, self.lat)
+            wlon = periodic_linear_weights(self.lon_in, self.lon)
+        # fields are flattened to (lat*lon) with lon varying fastest
+        weights = scipy.sparse.kron(wlat, wlon, format='csr')
+        weights.eliminate_zeros()
+        return weights
+
+    def _path(self, cache_dir):
+        return os.path.join(cache_dir, 'regrid_{}.npz'.format(self.key))
+
+    def _load(self, cache_dir):
+        weights = _weights_cache.pop(self.key, None)
+        if weights is None and cache_dir is not None and os.path.isfile(self._path(cache_dir)):
+            weights = scipy.sparse.load_npz(self._path(cache_dir)).tocsr()
+        if weights is not None:
+            _weights_cache[self.key] = weights
+        return weights
+
+    def _store(self, cache_dir):
+        _weights_cache[self.key] = self.weights
+        while len(_weights_cache) > MAX_CACHED_WEIGHTS:
+            _weights_cache.popitem(last=False)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write and rename, so that concurrent readers never see a partial file
+            tmp_path = '{}.{:d}.tmp.npz'.format(self._path(cache_dir)[:-4], os.getpid())
+            scipy.sparse.save_npz(tmp_path, self.weights)
+            os.replace(tmp_path, self._path(cache_dir))
+
+    def _apply(self, values):
+        # values: (..., nlat_in, nlon_in) -> (..., nlat, nlon)
+        shape = values.shape[:-2]
+        flat = values.reshape((-1, values.shape[-2]*values.shape[-1]))
+        out = (self.weights @ flat.T).T
+        if np.issubdtype(values.dtype, np.floating):
+            out = out.astype(values.dtype, copy=False)
+        return out.reshape(shape + (len(self.lat), len(self.lon)))
+
+    def _regrid_array(self, field):
+        if 'lat' not in field.dims or 'lon' not in field.dims:
+            return field
+        # the weights are applied by position, so must be on the source grid
+        field = match_grid(field, self.lat_in, self.lon_in)
+        if field.chunks is not None:
+            field = field.chunk({'lat': -1, 'lon': -1})
+        regridded = xr.apply_ufunc(self._apply, field,
+                                   input_core_dims=[['lat', 'lon']],
+                                   output_core_dims=[['lat', 'lon']],
+                                   exclude_dims={'lat', 'lon'},
+                                   dask='parallelized',
+                                   output_dtypes=[np.result_type(field.dtype, np.float32)],
+                                   dask_gufunc_kwargs={'output_sizes': {'lat': len(self.lat), 'lon': len(self.lon)}},
+                                   keep_attrs=True)
+        return regridded.transpose(*field.dims)
+
+    def __call__(self, field):
+        """Regrid a DataArray, or all variables of a Dataset, on (lat, lon).
+
+        Other dimensions are untouched, and dask-backed fields are regridded
+        lazily chunk by chunk.  Fields must be on the source grid, though
+        their points may be in another order: ValueError is raised otherwise."""
+        if isinstance(field, xr.Dataset):
+            field = field.drop_vars([c for c in ('latb', 'lonb') if c in field.coords])
+            regridded = field.map(self._regrid_array, keep_attrs=True)
+            regridded = regridded.assign_coords(latb=self.latb, lonb=self.lonb)
+        else:
+            regridded = self._regrid_array(field)
+        return regridded.assign_coords(lat=self.lat, lon=self.lon)
@@ -0,0 +1,109 @@
+"""Synthetic Isca datasets for testing and benchmarking.
+
+`make_dataset` builds a dataset with the same coordinates and variables as
+Isca's atmospheric output (lat/latb/lon/lonb/pfull/phalf and ps, temp,
+ucomp, vcomp, sphum) at a range of spectral resolutions.  The fields are
+smooth, broadly realistic climates with added travelling waves and noise,
+so that every diagnostic in iscaxr has something to work on.
+"""
+import numpy as np
+import xarray as xr
+
+# spectral truncation: (nlat, nlon) of the Gaussian grid
+RESOLUTIONS = {
+    'T21': (32, 64),
+    'T42': (64, 128),
+    'T85': (128, 256),
+    'T170': (256, 512),
+}
+
+
+def gaussian_latitudes(nlat):
+    """Return the Gaussian latitudes and cell boundaries, in degrees.
+
+    The boundaries are placed so that each cell's area is proportional to
+    its Gaussian quadrature weight, as in Isca.
+    """
+    x, w = np.polynomial.legendre.leggauss(nlat)
+    lat = np.rad2deg(np.arcsin(x))
+    sinb = np.concatenate([[-1.0], np.cumsum(w) - 1.0])
+    latb = np.rad2deg(np.arcsin(np.clip(sinb, -1, 1)))
+    latb[0], latb[-1] = -90.0, 90.0
+    return lat, latb
+
+def sigma_levels(nlev, p0=1000.0):
+    """Return (pfull, phalf) in hPa for `nlev` sigma levels, finer near the surface."""
+    s = np.linspace(0, 1, nlev+1)
+    phalf = p0*(1 - (1 - s)**1.5)
+    phalf[0] = 0.0
+    pfull = 0.5*(phalf[1:] + phalf[:-1])
+    return pfull, phalf
+
+def make_dataset(resolution='T42', ntime=12, nlev=25, dt=1.0, dtype=np.float32, chunks=None, seed=0):
+    """Create a synthetic Isca dataset.
+
+    Parameters
+    ----------
+    resolution : str or (nlat, nlon), optional
+        One of the keys of `RESOLUTIONS`, or a grid size.  Default: 'T42'
+    ntime : int, optional
+        Number of timesteps.  Default: 12
+    nlev : int, optional
+        Number of vertical levels.  Default: 25
+    dt : float, optional
+        Interval between timesteps, in days.  Default: 1.0
+    dtype : numpy dtype, optional
+        Precision of the 4D fields.  Default: float32, as written by Isca.
+    chunks : int or dict, optional
+        If given, the dataset is chunked with dask.
+    seed : int, optional
+        Seed for the random noise.
+
+    Returns
+    -------
+    dataset : xarray.Dataset
+    """
+    nlat, nlon = RESOLUTIONS.get(resolution, resolution)
+    rs = np.random.RandomState(seed)
+
+    lat, latb = gaussian_latitudes(nlat)
+    lonb = np.linspace(0, 360, nlon+1)
+    lon = 0.5*(lonb[1:] + lonb[:-1])
+    pfull, phalf = sigma_levels(nlev)
+    time = np.arange(1, ntime+1)*dt
+
+    t = time[:, None, None, None]
+    sigma = (pfull/1000.0)[None, :, None, None]
+    phi = np.deg2rad(lat)[None, None, :, None]
+    lam = np.deg2rad(lon)[None, None, None, :]
+    shape = (ntime, nlev, nlat, nlon)
+
+    # an eastward travelling wave, to give the spectral diagnostics a signal
+    wave = np.cos(6*lam - 2*np.pi*t/5.0)*np.cos(phi)**2
+
+    t_surf = 300.0 - 45.0*np.sin(phi)**2
+    temp = np.maximum(t_surf*sigma**0.19, 200.0) + 2.0*wave*sigma + 0.5*rs.randn(*shape)
+    ucomp = 30.0*np.sin(2*phi)**2*(1 - sigma) - 5.0*np.cos(phi)**4*sigma + 5.0*wave + rs.randn(*shape)
+    vcomp = 3.0*np.sin(2*phi)*np.cos(np.pi*sigma) + 2.0*wave + rs.randn(*shape)
+    sphum = 0.018*np.cos(phi)**2*sigma**3 * (1 + 0.1*wave) + 1e-6
+    ps = 1e5 + 1e3*np.cos(2*phi[:, 0])*np.cos(lam[:, 0]) + 100.0*rs.randn(ntime, nlat, nlon)
+
+    dims = ('time', 'pfull', 'lat', 'lon')
+    ds = xr.Dataset(
+        {'temp': (dims, temp.astype(dtype), {'units': 'K', 'long_name': 'temperature'}),
+         'ucomp': (dims, ucomp.astype(dtype), {'units': 'm/sec', 'long_name': 'zonal wind component'}),
+         'vcomp': (dims, vcomp.astype(dtype), {'units': 'm/sec', 'long_name': 'meridional wind component'}),
+         'sphum': (dims, sphum.astype(dtype), {'units': 'none', 'long_name': 'specific humidity'}),
+         'ps': (('time', 'lat', 'lon'), ps.astype(dtype), {'units': 'Pa', 'long_name': 'surface pressure'})},
+        coords={
+            'time': ('time', time, {'units': 'days since 0001-01-01 00:00:00', 'calendar': 'NOLEAP'}),
+            'pfull': ('pfull', pfull, {'units': 'hPa'}),
+            'phalf': ('phalf', phalf, {'units': 'hPa'}),
+            'lat': ('lat', lat, {'units': 'degrees_N'}),
+            'latb': ('latb', latb, {'units': 'degrees_N'}),
+            'lon': ('lon', lon, {'units': 'degrees_E'}),
+            'lonb': ('lonb', lonb, {'units': 'degrees_E'}),
+        })
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    return ds
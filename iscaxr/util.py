@@ -7,12 +7,144 @@ def best_fit(xs, ys):
     A = np.array([xs, np.ones(len(xs))])
     return np.linalg.lstsq(A.T,ys)[0]
 
-def detrend(field, dim='time'):
-    """Remove a linear trend from an xarray DataArray along given dimension."""
-    mean_dims = [d for d in field.dims if d != dim]
-    mf = field.mean(mean_dims)
-    m, c = best_fit(field[dim], mf)
-    return field - (field.time*m + c)
+def _numeric_coord(x):
+    # datetimes (numpy or cftime) and timedeltas as float days since the first
+    x = np.asarray(x)
+    if x.dtype.kind in 'mMO':
+        x = x - x[0]
+        return np.asarray(x / np.timedelta64(1, 'D') if x.dtype.kind == 'm'
+                          else [t.total_seconds()/86400.0 for t in x], dtype=float)
+    return x.astype(float)
+
+def detrend(field, dim='time', deg=1):
+    """Remove a polynomial trend along `dim` from an xarray DataArray.
+
+    An independent trend is fitted at every point of the other dimensions,
+    by least squares in closed form: the regression sums for all points are
+    a single reduction over `dim`, so dask-backed fields stay lazy and are
+    read once to fit the trends.  Missing values are not skipped.
+
+    Parameters
+    ----------
+    field : xarray.DataArray
+    dim : str, optional
+        The dimension to detrend along.  Its coordinate may be numeric or
+        datetime.  Default: 'time'
+    deg : int, optional
+        Degree of the fitted polynomial.  Default: 1, a linear trend.
+    """
+    x = _numeric_coord(field[dim].values)
+    # centre and scale the coordinate, to keep the normal equations well conditioned
+    scale = np.ptp(x) or 1.0
+    x = (x - x.mean()) / scale
+    vander = xr.DataArray(np.vander(x, deg+1), dims=(dim, 'degree'))
+    # normal equations (V^T V) c = V^T y, with the small (deg+1)^2 system inverted once
+    inverse = xr.DataArray(np.linalg.inv(vander.values.T @ vander.values), dims=('degree_', 'degree'))
+    coeffs = xr.dot(inverse, xr.dot(vander, field, dim=dim), dim='degree').rename(degree_='degree')
+    trend = xr.dot(vander, coeffs, dim='degree')
+    if np.issubdtype(field.dtype, np.floating):
+        trend = trend.astype(field.dtype)
+    detrended = field - trend
+    detrended.name = field.name
+    detrended.attrs = dict(field.attrs)
+    return detrended.transpose(*field.dims)
+
+def _peak_location(values, x, refine):
+    # values: (..., n) -> coordinate x of the maximum along the last axis.
+    # Missing values are ignored, and all-missing slices give NaN.
+    n = values.shape[-1]
+    missing = np.isnan(values)
+    i = np.argmax(np.where(missing, -np.inf, values), axis=-1)[..., np.newaxis]
+    loc = x[i]
+    if refine and n >= 3:
+        # vertex of the parabola through the peak and its two neighbours,
+        # for interior peaks on any (not necessarily regular) grid
+        j = np.clip(i, 1, n-2)
+        x1, x2, x3 = x[j-1], x[j], x[j+1]
+        y1, y2, y3 = (np.take_along_axis(values, j + k, axis=-1) for k in (-1, 0, 1))
+        num = (x2 - x1)**2*(y2 - y3) - (x2 - x3)**2*(y2 - y1)
+        den = (x2 - x1)*(y2 - y3) - (x2 - x3)*(y2 - y1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vertex = x2 - 0.5*num/den
+        ok = (i == j) & (den != 0) & np.isfinite(vertex)
+        loc = np.where(ok, vertex, loc)
+    loc = np.where(missing.all(axis=-1, keepdims=True), np.nan, loc)
+    return loc[..., 0]
+
+def _extremum_along(field, dim, extremum, refine):
+    if field.chunks is not None:
+        field = field.chunk({dim: -1})
+    if extremum == 'min':
+        field = -field
+    x = np.asarray(field[dim].values, dtype=float)
+    loc = xr.apply_ufunc(_peak_location, field,
+                         input_core_dims=[[dim]],
+                         kwargs={'x': x, 'refine': refine},
+                         dask='parallelized',
+                         output_dtypes=[float])
+    return loc.rename(dim)
+
+def _peak_locations(values, xs, refine):
+    # values: (..., n1, ..., nk) -> (..., k) coordinates of the maximum over
+    # the last k axes, refined along each through the maximum
+    k = len(xs)
+    core = values.shape[-k:]
+    lead = values.shape[:-k]
+    flat = values.reshape((-1,) + core)
+    stacked = flat.reshape(len(flat), -1)
+    missing = np.isnan(stacked).all(axis=-1)
+    peak = np.argmax(np.where(np.isnan(stacked), -np.inf, stacked), axis=-1)
+    index = np.unravel_index(peak, core)
+    points = np.arange(len(flat))
+    locs = []
+    for j, x in enumerate(xs):
+        # the line through the maximum along axis j
+        line = flat[(points,) + tuple(slice(None) if i == j else index[i] for i in range(k))]
+        locs.append(_peak_location(line, x, refine))
+    locs = np.where(missing[:, np.newaxis], np.nan, np.stack(locs, axis=-1))
+    return locs.reshape(lead + (k,))
+
+def extremum_coord(field, dim=None, extremum='max', refine=False):
+    """Find the coordinates of the maximum (or minimum) of a field.
+
+    The extremum is found by argmax along `dim` for every slice of the other
+    dimensions at once, e.g. the latitude of the jet at every time, and
+    lazily for dask-backed fields.
+
+    Parameters
+    ----------
+    field : xarray.DataArray
+    dim : str or sequence of str, optional
+        The dimension(s) to search along.  Default: all dimensions.
+    extremum : {'max', 'min'}, optional
+    refine : bool, optional
+        If True, refine the location between grid points using the vertex of
+        a parabola through the extremum and its neighbours along each `dim`.
+
+    Returns
+    -------
+    coord : xarray.DataArray or xarray.Dataset
+        For a single `dim`, the coordinate of the extremum.  For several,
+        a Dataset with the coordinate along each of them.
+    """
+    if extremum not in ('max', 'min'):
+        raise ValueError("extremum must be 'max' or 'min', not {!r}".format(extremum))
+    dims = list(field.dims) if dim is None else [dim] if isinstance(dim, str) else list(dim)
+    if len(dims) == 1:
+        return _extremum_along(field, dims[0], extremum, refine)
+    if field.chunks is not None:
+        field = field.chunk({d: -1 for d in dims})
+    if extremum == 'min':
+        field = -field
+    xs = [np.asarray(field[d].values, dtype=float) for d in dims]
+    loc = xr.apply_ufunc(_peak_locations, field,
+                         input_core_dims=[dims],
+                         output_core_dims=[['extremum_dim']],
+                         kwargs={'xs': xs, 'refine': refine},
+                         dask='parallelized',
+                         output_dtypes=[float],
+                         dask_gufunc_kwargs={'output_sizes': {'extremum_dim': len(dims)}})
+    return xr.Dataset({d: loc.isel(extremum_dim=i, drop=True) for i, d in enumerate(dims)})
 
 def absmax(x):
     """Returns the absolute maximum of x."""
@@ -0,0 +1,126 @@
+"""Interpolation from Isca's sigma levels to fixed pressure or height levels.
+
+The pressure (or height) of the pfull levels varies from column to column
+with the surface pressure.  `VerticalInterpolator` finds the pair of levels
+bracketing each target level, and the interpolation weight between them,
+for every column at once.  These are calculated once and can then be applied
+to any number of fields on the same dataset.
+
+    >>> interp = VerticalInterpolator(data, [850, 500, 250])
+    >>> u = interp(data.ucomp)
+    >>> t = interp(data.temp)
+
+Everything is expressed with `apply_ufunc`, so dask-backed datasets are
+interpolated lazily, chunk by chunk.
+"""
+import numpy as np
+import xarray as xr
+
+import iscaxr.domain
+
+COORDS = ('pressure', 'height')
+
+
+def _bracket(x, targets):
+    # x: (..., nlev) source coordinate of each column, increasing along the
+    # last axis.  Vectorised searchsorted: count the levels below each target.
+    n = x.shape[-1]
+    below = (x[..., np.newaxis, :] <= targets[:, np.newaxis]).sum(axis=-1)
+    index = np.clip(below - 1, 0, n - 2)
+    x0 = np.take_along_axis(x, index, axis=-1)
+    x1 = np.take_along_axis(x, index + 1, axis=-1)
+    weight = (targets - x0) / (x1 - x0)
+    # targets outside the column are missing
+    weight = np.where((weight < 0) | (weight > 1), np.nan, weight)
+    return index, weight
+
+def _interpolate(values, index, weight):
+    v0 = np.take_along_axis(values, index, axis=-1)
+    v1 = np.take_along_axis(values, index + 1, axis=-1)
+    return (v0 + weight*(v1 - v0)).astype(np.result_type(values.dtype, np.float32), copy=False)
+
+
+class VerticalInterpolator(object):
+    """Interpolate fields on pfull levels to fixed pressure or height levels.
+
+    Parameters
+    ----------
+    data : IscaDataSet (xarray.DataSet)
+        Requires 'ps', 'pfull' and 'phalf', and also 'temp' for height levels.
+    levels : sequence of float
+        The target levels, in hPa for pressure or m for height.
+    coord : str, optional
+        'pressure' (default), interpolating linearly in log-pressure,
+        or 'height', linearly in height above the surface.
+    dim : str, optional
+        The name of the new vertical dimension.  Default: 'plev' for
+        pressure, 'height' for height.
+
+    Target levels outside the range of the pfull levels of a column, e.g.
+    below the surface, are set to NaN.
+
+    Attributes
+    ----------
+    index, weight : xarray.DataArray
+        For each column and target level, the index of the pfull level
+        above (in the sense of increasing coordinate) the target and
+        the weight given to the next level.
+    """
+    def __init__(self, data, levels, coord='pressure', dim=None):
+        if coord not in COORDS:
+            raise ValueError('unknown vertical coordinate {!r}, use one of {}'.format(coord, COORDS))
+        self.levels = np.atleast_1d(np.asarray(levels, dtype=float))
+        self.coord = coord
+        self.dim = dim or {'pressure': 'plev', 'height': 'height'}[coord]
+
+        if coord == 'pressure':
+            # pressure increases along pfull
+            x = np.log((data.pfull/data.phalf.max())*data.ps/100.0)
+            targets = np.log(self.levels)
+        else:
+            # height decreases along pfull
+            x = -iscaxr.domain.calculate_z(data)
+            targets = -self.levels
+        if x.chunks is not None:
+            x = x.chunk({'pfull': -1})
+
+        self.index, self.weight = xr.apply_ufunc(
+            _bracket, x,
+            input_core_dims=[['pfull']],
+            output_core_dims=[[self.dim], [self.dim]],
+            kwargs={'targets': targets},
+            dask='parallelized',
+            output_dtypes=[np.intp, x.dtype],
+            dask_gufunc_kwargs={'output_sizes': {self.dim: len(self.levels)}})
+        self.index = self.index.assign_coords({self.dim: self.levels})
+        self.weight = self.weight.assign_coords({self.dim: self.levels})
+
+    def __call__(self, field):
+        """Interpolate a DataArray, or the variables of a Dataset, on pfull."""
+        if isinstance(field, xr.Dataset):
+            return field.map(self._interpolate_array, keep_attrs=True)
+        return self._interpolate_array(field)
+
+    def _interpolate_array(self, field):
+        if 'pfull' not in field.dims:
+            return field
+        if field.chunks is not None:
+            field = field.chunk({'pfull': -1})
+        result = xr.apply_ufunc(
+            _interpolate, field, self.index, self.weight,
+            input_core_dims=[['pfull'], [self.dim], [self.dim]],
+            output_core_dims=[[self.dim]],
+            dask='parallelized',
+            output_dtypes=[np.result_type(field.dtype, np.float32)],
+            keep_attrs=True)
+        dims = [self.dim if d == 'pfull' else d for d in field.dims]
+        return result.transpose(*dims)
+
+
+def interpolate_to_pressure(field, data, levels):
+    """Interpolate `field` on pfull levels of `data` to pressure `levels` (hPa)."""
+    return VerticalInterpolator(data, levels, coord='pressure')(field)
+
+def interpolate_to_height(field, data, levels):
+    """Interpolate `field` on pfull levels of `data` to heights `levels` (m)."""
+    return VerticalInterpolator(data, levels, coord='height')(field)
@@ -1,59 +1,104 @@
 """A set of xarray extensions for use with Isca datasets."""
 
+from functools import lru_cache
+
 import xarray as xr
-import astropy.units
 
-from iscaxr.util import normalize
+from iscaxr.util import normalize, extremum_coord
+from iscaxr.grid import get_grid
 from iscaxr.analysis.spectral import fft
+from iscaxr.analysis.derived import DerivedVariables
+
+CUSTOM_UNITS = {
+        'hours since': 'hour',
+        'days since': 'day',
+        'minutes since': 'min',
+        'seconds since': 's',
+        'degrees_E': 'deg'}
+
+@lru_cache(maxsize=None)
+def parse_units(unit_string):
+    """Parse a units attribute string to an astropy unit.
+
+    Understands the time and longitude units used by Isca, see CUSTOM_UNITS.
+    Returns None if the units are not recognised.  Results are memoized.
+    """
+    # astropy is slow to import, and only needed once units are converted
+    import astropy.units
+    u_obj = None
+    try:
+        u_obj = astropy.units.Unit(unit_string)
+    except ValueError:
+        for s in CUSTOM_UNITS:
+            if unit_string.startswith(s):
+                u_obj = astropy.units.Unit(CUSTOM_UNITS[s])
+                break
+    return u_obj
+
+@lru_cache(maxsize=None)
+def conversion_factor(from_units, to_units):
+    """Return (factor, name) to convert values in units `from_units` to
+    `to_units`, both unit strings.  Results are memoized."""
+    import astropy.units
+    u = parse_units(from_units)
+    if u is None:
+        raise ValueError("No valid units for field")
+    new_unit = astropy.units.Unit(to_units)
+    return u.to(new_unit), new_unit.name
+
+def _convert(obj, new_unit):
+    units = obj.attrs.get('units')
+    if units is None:
+        raise ValueError("No valid units for field")
+    factor, name = conversion_factor(units, new_unit)
+    if factor == 1:
+        # nothing to convert: share the data, only the units change
+        newval = obj.copy(deep=False)
+    else:
+        newval = obj*factor
+    newval.attrs = obj.attrs.copy()
+    newval.attrs['units'] = name
+    return newval
+
 
 @xr.register_dataarray_accessor('in_units')
 class UnitConverter(object):
-    custom_units = {
-            'hours since': 'hour',
-            'days since': 'day',
-            'minutes since': 'min',
-            'seconds since': 's',
-            'degrees_E': 'deg'}
+    custom_units = CUSTOM_UNITS
 
     def __init__(self, xarray_obj):
         self._obj = xarray_obj
-        u = xarray_obj.attrs.get('units')
+
+    @property
+    def _unit(self):
+        u = self._obj.attrs.get('units')
         if u is not None:
-            u = self.parse_units(u)
-        self._unit = u
+            u = parse_units(u)
+        return u
 
     def parse_units(self, unit_string):
-        u_obj = None
-        try:
-            u_obj = astropy.units.Unit(unit_string)
-        except ValueError:
-            for s in self.custom_units:
-                if unit_string.startswith(s):
-                    u_obj = astropy.units.Unit(self.custom_units[s])
-                    break
-        return u_obj
+        return parse_units(unit_string)
 
     def __call__(self, new_unit):
-        if self._unit is None:
-            raise ValueError("No valid units for field")
-        new_unit = astropy.units.Unit(new_unit)
-        factor = self._unit.to(new_unit)
-        newval = self._obj*factor
-        newval.attrs = self._obj.attrs.copy()
-        newval.attrs['units'] = new_unit.name
-        return newval
+        return _convert(self._obj, new_unit)
 
 
+@xr.register_dataset_accessor('in_units')
+class DatasetUnitConverter(object):
+    """Convert variables and coordinates of a Dataset to new units in one call.
 
+        >>> ds.in_units(time='day', lon='rad', ps='hPa')
 
-# @xr.register_dataset_accessor('convert_units')
-# class CoordUnitConverter(object):
-#     def __init__(self, xarray_obj):
-#         self._obj = xarray_obj
-
-#     def __call__(self, **unit_mapping):
-#         for field, new_unit in unit_mapping:
+    Variables already in the requested units are not copied."""
+    def __init__(self, xarray_obj):
+        self._obj = xarray_obj
 
+    def __call__(self, units=None, **unit_mapping):
+        mapping = dict(units or {}, **unit_mapping)
+        converted = {name: _convert(self._obj[name], new_unit).variable
+                     for name, new_unit in mapping.items()}
+        coords = {name: v for name, v in converted.items() if name in self._obj.coords}
+        data_vars = {name: v for name, v in converted.items() if name not in coords}
+        return self._obj.assign_coords(coords).assign(data_vars)
 
 
 @xr.register_dataarray_accessor('fft')
@@ -61,8 +106,8 @@ class FourierTransformArray(object):
     def __init__(self, xarray_obj):
         self._obj = xarray_obj
 
-    def __call__(self, dim=None, axis=None, scaledim=None):
-        return fft(self._obj, dim, axis, scaledim)
+    def __call__(self, dim=None, axis=None, scaledim=None, real=False, power=False):
+        return fft(self._obj, dim, axis, scaledim, real=real, power=power)
 
 
 @xr.register_dataarray_accessor('normalize')
@@ -77,8 +122,57 @@ class NormalizeDataArray(object):
 
 @xr.register_dataarray_accessor('coordmax')
 class CoordinateMaximumArray(object):
+    """The coordinate(s) of the maximum along `dims`, for every slice of the
+    other dimensions.  See `iscaxr.util.extremum_coord`.
+
+        >>> ubar.coordmax('lat', refine=True)   # jet latitude at each time
+    """
+    extremum = 'max'
+
     def __init__(self, xarray_obj):
         self._obj = xarray_obj
 
-    def __call__(self, dims=None):
-        return self._obj.where(self._obj == self._obj.max(dims), drop=True).squeeze()
\ No newline at end of file
+    def __call__(self, dims=None, refine=False):
+        return extremum_coord(self._obj, dims, extremum=self.extremum, refine=refine)
+
+@xr.register_dataarray_accessor('coordmin')
+class CoordinateMinimumArray(CoordinateMaximumArray):
+    """The coordinate(s) of the minimum along `dims`.  See `coordmax`."""
+    extremum = 'min'
+
+
+@xr.register_dataset_accessor('isca')
+class IscaDataset(object):
+    """Derived variables of an Isca dataset.
+
+    Each derived variable, and each intermediate it depends on, is computed
+    once per dataset and reused.
+
+        >>> ds.isca['N2']
+        >>> ds.isca.derive('theta', 'N2', 'egr').compute()
+
+    See `iscaxr.analysis.derived` for the available variables.
+    """
+    def __init__(self, xarray_obj):
+        self._obj = xarray_obj
+        self._derived = DerivedVariables(xarray_obj)
+
+    def __getitem__(self, name):
+        return self._derived.get(name)
+
+    def derive(self, *names):
+        """Return a Dataset of the given derived variables.
+
+        For dask-backed data the result is lazy, with all the variables in
+        one task graph sharing their intermediates."""
+        return xr.Dataset({name: self._derived.get(name) for name in names})
+
+    @property
+    def available(self):
+        """The names of the derived variables."""
+        return sorted(self._derived)
+
+    @property
+    def grid(self):
+        """The IscaGrid of the dataset."""
+        return get_grid(self._obj)
@@ -10,7 +10,7 @@
 #		  >>> d = iscaxr.resample_latlon(...)
 #
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='iscaxr',
       version='0.1',
@@ -23,5 +23,10 @@ setup(name='iscaxr',
         'xarray',
         'scipy',
         'astropy'
-      ]
+      ],
+      entry_points={
+        'xarray.backends': ['dedalus = iscaxr.dedalus_util:DedalusBackendEntrypoint'],
+        'console_scripts': ['iscaxr-diag = iscaxr.diag:main',
+                            'iscaxr-rechunk = iscaxr.rechunk:main'],
+      }
      )
\ No newline at end of file
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from iscaxr.analysis import Accumulator, accumulate
+
+from domain_test import make_dataset
+
+
+FIELDS = ['ucomp', 'vcomp', 'temp']
+COV = [('ucomp', 'vcomp'), ('vcomp', 'temp')]
+
+def pieces(data, size):
+    return [data.isel(time=slice(i, i+size)) for i in range(0, data.sizes['time'], size)]
+
+def test_streaming_matches_two_pass():
+    data = make_dataset(ntime=10)
+    # a large mean, as for temperature, is no problem
+    data['temp'] = data.temp + 1e6
+    acc = accumulate(pieces(data, 3), FIELDS, COV)
+    assert acc.count == 10
+    assert np.allclose(acc.mean('temp'), data.temp.mean('time'))
+    assert np.allclose(acc.variance('ucomp', ddof=1), data.ucomp.var('time', ddof=1))
+    eddy = data - data.mean('time')
+    expected = (eddy.vcomp*eddy.temp).mean('time')
+    assert np.allclose(acc.covariance('temp', 'vcomp'), expected.transpose(*acc.mean('temp').dims))
+
+def test_merge_is_order_independent():
+    data = make_dataset(ntime=9)
+    parts = [accumulate([p], FIELDS, COV) for p in pieces(data, 2)]
+    whole = accumulate([data], FIELDS, COV).to_dataset()
+    forward = Accumulator.combine(parts).to_dataset()
+    backward = Accumulator.combine(parts[::-1]).to_dataset()
+    for name in whole.data_vars:
+        assert np.allclose(forward[name], whole[name])
+        assert np.allclose(backward[name], whole[name])
+    assert set(whole.data_vars) == {'ucomp', 'vcomp', 'temp', 'ucomp_var', 'vcomp_var', 'temp_var',
+                                    'ucomp_vcomp_cov', 'temp_vcomp_cov'}
+
+def test_dask_pieces_and_zonal_dims():
+    data = make_dataset(ntime=6)
+    acc = accumulate(pieces(data.chunk({'time': 1}), 4), ['ucomp', 'vcomp'], [('ucomp', 'vcomp')],
+                     dim=('time', 'lon'))
+    eddy = data - data.mean(('time', 'lon'))
+    expected = (eddy.ucomp*eddy.vcomp).mean(('time', 'lon'))
+    assert acc.count == 6*data.sizes['lon']
+    assert np.allclose(acc.covariance('ucomp', 'vcomp'), expected)
+
+def test_mismatched_grids_and_missing_covariance():
+    data = make_dataset()
+    acc = accumulate([data], ['ucomp'])
+    with pytest.raises(KeyError):
+        acc.covariance('ucomp', 'vcomp')
+    with pytest.raises(ValueError):
+        acc.update(data.assign_coords(lat=data.lat + 1))
+    with pytest.raises(ValueError):
+        Accumulator(['ucomp'], covariances=[('ucomp', 'vcomp')])
@@ -0,0 +1,16 @@
+import numpy as np
+import xarray as xr
+
+from iscaxr.analysis.atmosphere import jet_latitude, itcz_latitude
+
+
+def test_jet_and_itcz_latitude():
+    lat = np.linspace(-89, 89, 90)
+    lon = np.arange(0, 360, 30.0)
+    shape = (len(lat), len(lon))
+    jets = np.exp(-((lat - 45.3)/10)**2) + 0.8*np.exp(-((lat + 38.6)/10)**2)
+    u = xr.DataArray(np.broadcast_to(jets[:, None], shape), coords={'lat': lat, 'lon': lon}, dims=('lat', 'lon'))
+    assert np.isclose(jet_latitude(u), 45.3, atol=0.1)
+    assert np.isclose(jet_latitude(u, lat_range=(-90, 0)), -38.6, atol=0.1)
+    rain = xr.DataArray(np.exp(-((lat - 6.4)/5)**2) + np.exp(-((lat - 50)/5)**2), coords={'lat': lat}, dims='lat')
+    assert np.isclose(itcz_latitude(rain), 6.4, atol=0.1)
@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+
+import dask
+import numpy as np
+import pytest
+import xarray as xr
+
+# registers the accessors, e.g. the .in_units used by g_sublon
+import iscaxr.xarray_extensions
+from iscaxr import cache
+from iscaxr.analysis import exoplanet
+from iscaxr.analysis.spectral import zonal_dispersion
+
+from domain_test import make_dataset
+
+pytest.importorskip('zarr')
+
+calls = []
+
+@cache.cached
+def scaled(field, factor=2.0):
+    calls.append(factor)
+    return field*factor
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv(cache.CACHE_DIR_ENV, raising=False)
+    path = str(tmp_path / 'cache')
+    cache.set_cache_dir(path)
+    del calls[:]
+    yield path
+    cache.set_cache_dir(None)
+
+def entries(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.zarr'))
+
+def test_disabled_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv(cache.CACHE_DIR_ENV, raising=False)
+    del calls[:]
+    data = make_dataset()
+    scaled(data.temp)
+    scaled(data.temp)
+    assert calls == [2.0, 2.0]
+
+def test_results_are_reused(cache_dir):
+    data = make_dataset()
+    first = scaled(data.temp, factor=3.0)
+    again = scaled(make_dataset().temp, factor=3.0)
+    assert calls == [3.0]
+    xr.testing.assert_identical(first, again)
+    # different data or arguments are a different entry
+    scaled(data.temp + 1, factor=3.0)
+    scaled(data.temp, factor=4.0)
+    assert calls == [3.0, 3.0, 4.0]
+    assert len(entries(cache_dir)) == 3
+
+def test_environment_variable_and_lazy_results(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.CACHE_DIR_ENV, str(tmp_path))
+    wave = make_dataset(ntime=40).ucomp.isel(pfull=0).chunk({'time': 10})
+    spec = zonal_dispersion(wave, nperseg=20)
+    cached = zonal_dispersion(wave, nperseg=20)
+    assert cached.chunks is not None
+    assert cached.attrs['nsegments'] == 3
+    xr.testing.assert_allclose(spec, cached.load())
+    assert len(entries(str(tmp_path))) == 1
+
+def test_lon_to_xi_with_sublon_function(cache_dir):
+    data = make_dataset()
+    data.time.attrs['units'] = 'days since 0000-01-01 00:00:00'
+    lon0 = exoplanet.g_sublon(data, omega=1e-5, alpha=10.0)
+    xi = exoplanet.lon_to_xi(data.temp, lon0)
+    assert len(entries(cache_dir)) == 1
+    xr.testing.assert_allclose(exoplanet.lon_to_xi(data.temp, exoplanet.g_sublon(data, omega=1e-5, alpha=10.0)), xi)
+    assert len(entries(cache_dir)) == 1
+    # a function without a cache_key is not cached
+    exoplanet.lon_to_xi(data.temp, lambda t: lon0(t))
+    assert len(entries(cache_dir)) == 1
+
+def test_least_recently_used_are_evicted(cache_dir):
+    data = make_dataset()
+    scaled(data.temp, factor=1.0)
+    size = sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(cache_dir) for f in files if f != cache.LOCK_FILENAME)
+    cache.set_cache_dir(cache_dir, max_size=2.5*size)
+    scaled(data.temp, factor=2.0)
+    for i, name in enumerate(entries(cache_dir)):
+        os.utime(os.path.join(cache_dir, name), (i, i))
+    scaled(data.temp, factor=1.0)   # a hit: now the most recently used
+    scaled(data.temp, factor=3.0)   # evicts factor=2
+    assert len(entries(cache_dir)) == 2
+    scaled(data.temp, factor=1.0)
+    scaled(data.temp, factor=2.0)
+    assert calls == [1.0, 2.0, 3.0, 2.0]
+    cache.clear()
+    assert entries(cache_dir) == []
+
+def _no_compute(*args, **kwargs):
+    raise AssertionError('computed eagerly')
+
+def test_lazy_results_larger_than_the_cache_are_not_stored(cache_dir):
+    data = make_dataset().chunk({'time': 1})
+    cache.set_cache_dir(cache_dir, max_size=data.temp.nbytes//2)
+    with dask.config.set(scheduler=_no_compute):
+        result = scaled(data.temp)
+    assert result.chunks is not None
+    assert entries(cache_dir) == []
+    # small enough results are still stored
+    scaled(data.temp.isel(time=0))
+    assert len(entries(cache_dir)) == 1
+
+def test_lazy_arguments_with_mixed_chunks():
+    data = make_dataset()
+    data = data.assign(temp=data.temp.chunk({'time': 1}), ucomp=data.ucomp.chunk({'time': 2}))
+    with pytest.raises(ValueError):
+        data.chunks
+    assert cache._is_lazy([1.0, data])
+    assert not cache._is_lazy([make_dataset()])
+
+def _compute_in_worker(path):
+    cache.set_cache_dir(path)
+    return float(scaled(make_dataset().temp, factor=5.0).sum())
+
+def test_concurrent_processes(cache_dir):
+    with multiprocessing.Pool(3) as pool:
+        results = pool.map(_compute_in_worker, [cache_dir]*6)
+    assert np.allclose(results, results[0])
+    assert len(entries(cache_dir)) == 1
+    assert not [name for name in os.listdir(cache_dir) if '.tmp' in name]
+
+def test_lazily_opened_entries_are_not_evicted(cache_dir):
+    wave = make_dataset(ntime=40).ucomp.isel(pfull=0).chunk({'time': 10})
+    zonal_dispersion(wave, nperseg=20)
+    lazy = zonal_dispersion(wave, nperseg=20)
+    [entry] = entries(cache_dir)
+    pins = [name for name in os.listdir(cache_dir) if name.endswith('.pin')]
+    assert len(pins) == 1
+    cache.clear()
+    assert entries(cache_dir) == [entry]
+    lazy.load()
+    # pins of processes that have exited don't keep entries
+    os.rename(os.path.join(cache_dir, pins[0]),
+              os.path.join(cache_dir, '{}.{}.{:d}.pin'.format(entry[:-5], socket.gethostname(), 2**22 + 1)))
+    cache.clear()
+    assert entries(cache_dir) == []
+    assert not any(name.endswith('.pin') for name in os.listdir(cache_dir))
+
+def test_imports_without_fcntl(tmp_path):
+    code = ("import sys; sys.modules['fcntl'] = None\n"
+            "from iscaxr import cache\n"
+            "import iscaxr.analysis.spectral\n"
+            "cache.set_cache_dir({!r})\n"
+            "cache.clear()\n").format(str(tmp_path))
+    subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from iscaxr.dedalus_util import dedalus_to_xarray, DedalusBackendEntrypoint
+
+
+def make_dedalus_file(filename, nt=6, nx=8):
+    with h5py.File(filename, mode='w') as f:
+        scales = f.create_group('scales')
+        for tscale in ['sim_time', 'wall_time', 'timestep', 'iteration', 'write_number']:
+            scales.create_dataset(tscale, data=np.arange(nt, dtype=float))
+            scales[tscale].make_scale(tscale)
+        x = scales.create_group('x').create_dataset('1.0', data=np.linspace(0, 1, nx))
+        x.make_scale('x')
+        u = f.create_group('tasks').create_dataset('u', data=np.arange(nt*nx, dtype=float).reshape(nt, nx),
+                                                    chunks=(1, nx))
+        u.dims[0].label = 't'
+        u.dims[0].attach_scale(scales['sim_time'])
+        u.dims[1].label = 'x'
+        u.dims[1].attach_scale(x)
+
+def test_dedalus_backend(tmp_path):
+    filename = str(tmp_path / 'snapshots_s1.h5')
+    make_dedalus_file(filename)
+    assert DedalusBackendEntrypoint().guess_can_open(filename)
+
+    dset = dedalus_to_xarray(filename)
+    assert dset.u.dims == ('time', 'x')
+    assert 'write_number' in dset.coords
+    assert np.allclose(dset.u.isel(time=2).values, np.arange(16, 24))
+    assert np.allclose(dset.x, np.linspace(0, 1, 8))
+    dset.close()
+
+def test_dedalus_backend_chunks(tmp_path):
+    pytest.importorskip('dask')
+    filename = str(tmp_path / 'snapshots_s1.h5')
+    make_dedalus_file(filename)
+    dset = dedalus_to_xarray(filename, chunks={})
+    assert dset.u.chunks == ((1,)*6, (8,))
+    assert float(dset.u.sum()) == np.arange(48).sum()
+    dset.close()
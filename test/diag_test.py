@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from iscaxr import diag
+
+from loader_test import write_runs
+
+pytest.importorskip('dask')
+
+
+def test_parse_diagnostic():
+    name, params = diag.parse_diagnostic('zonal_dispersion:nperseg=4,field=temp')
+    assert name == 'zonal_dispersion'
+    assert params['nperseg'] == 4 and params['field'] == 'temp' and params['level'] == 250.0
+    with pytest.raises(ValueError):
+        diag.parse_diagnostic('zonal_dispersion:bogus=1')
+    with pytest.raises(ValueError):
+        diag.parse_diagnostic('not_a_diagnostic')
+
+def test_diag_skips_up_to_date_results(tmp_path, capsys):
+    basedir = str(tmp_path / 'exp')
+    write_runs(basedir)
+    args = [basedir, '-d', 'mass_streamfunction', '-d', 'eddy_fluxes', '-j', '1']
+    assert diag.main(args) == 0
+    outdir = os.path.join(basedir, 'diagnostics')
+    with xr.open_dataset(os.path.join(outdir, 'mass_streamfunction.nc')) as psi:
+        assert 'time' not in psi.dims
+        assert psi.attrs['iscaxr_diagnostic'] == 'mass_streamfunction'
+    with xr.open_dataset(os.path.join(outdir, 'eddy_fluxes.nc')) as fluxes:
+        assert 'ucomp_vcomp_cov' in fluxes
+    capsys.readouterr()
+
+    # nothing has changed: nothing to do
+    assert diag.main(args) == 0
+    assert capsys.readouterr().out.count('up to date') == 2
+
+    # new parameters, or a changed run, are recomputed
+    assert diag.main([basedir, '-d', 'eddy_fluxes:fields=("ucomp","vcomp")', '-j', '1']) == 0
+    assert 'wrote' in capsys.readouterr().out
+    path = os.path.join(basedir, 'run0002', 'atmos_monthly.nc')
+    os.utime(path, (0, 0))
+    assert diag.main(args) == 0
+    assert capsys.readouterr().out.count('wrote') == 2
+
+def test_diag_zarr_on_process_pool(tmp_path):
+    basedir = str(tmp_path / 'exp')
+    write_runs(basedir, ntime=4)
+    outdir = str(tmp_path / 'out')
+    assert diag.main([basedir, '-d', 'zonal_dispersion:level=None', '-d', 'jet_latitude',
+                      '--format', 'zarr', '-o', outdir, '-j', '2']) == 0
+    with xr.open_zarr(os.path.join(outdir, 'exp', 'zonal_dispersion.zarr')) as spec:
+        assert set(spec.zonal_dispersion.dims) == {'freq', 'k', 'pfull'}
+    with xr.open_zarr(os.path.join(outdir, 'exp', 'jet_latitude.zarr')) as jets:
+        assert jets.sizes['time'] == 12
+        assert np.all(jets.north > 0)
+
+def test_diag_splits_by_run(tmp_path):
+    from iscaxr.analysis import Accumulator, mass_streamfunction
+    from iscaxr.loader import open_runs
+    basedir = str(tmp_path / 'exp')
+    write_runs(basedir, nruns=3, ntime=3)
+    diagnostics = [diag.parse_diagnostic(d) for d in ('mass_streamfunction', 'eddy_fluxes', 'zonal_dispersion')]
+    tasks, _ = diag.plan([basedir], diagnostics)
+    assert [t['diagnostic'] for t in tasks].count('mass_streamfunction') == 3
+    assert [t['diagnostic'] for t in tasks].count('zonal_dispersion') == 1
+    assert diag.run(tasks, processes=2, log=lambda message: None) == []
+
+    outdir = os.path.join(basedir, 'diagnostics')
+    with open_runs(basedir, decode_times=False) as data:
+        with xr.open_dataset(os.path.join(outdir, 'mass_streamfunction.nc')) as psi:
+            assert 'iscaxr_ntime' not in psi.attrs
+            assert np.allclose(psi.mass_streamfunction, mass_streamfunction(data).mean('time'))
+        expected = Accumulator(['ucomp', 'vcomp', 'temp'], diag._flux_pairs(['ucomp', 'vcomp', 'temp']))
+        expected.update(data)
+        with xr.open_dataset(os.path.join(outdir, 'eddy_fluxes.nc')) as fluxes:
+            assert fluxes.attrs['count'] == 9
+            xr.testing.assert_allclose(fluxes, expected.to_dataset(ddof=1))
+
+def test_diag_eddy_fluxes_of_single_timestep_runs(tmp_path):
+    from iscaxr.analysis import Accumulator
+    from iscaxr.loader import open_runs
+    basedir = str(tmp_path / 'exp')
+    write_runs(basedir, nruns=3, ntime=1)
+    assert diag.main([basedir, '-d', 'eddy_fluxes', '-j', '2']) == 0
+    expected = Accumulator(['ucomp', 'vcomp', 'temp'], diag._flux_pairs(['ucomp', 'vcomp', 'temp']))
+    with open_runs(basedir, decode_times=False) as data:
+        expected.update(data)
+    with xr.open_dataset(os.path.join(basedir, 'diagnostics', 'eddy_fluxes.nc')) as fluxes:
+        assert fluxes.attrs['count'] == 3
+        xr.testing.assert_allclose(fluxes, expected.to_dataset(ddof=1))
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import iscaxr
+from iscaxr import domain, synthetic
+
+
+def make_dataset(ntime=4, nlev=5, nlat=8, nlon=16):
+    # a small synthetic dataset, in double precision for exact comparisons,
+    # with a plain numeric time from 0 that is not decoded to dates on reading
+    data = synthetic.make_dataset((nlat, nlon), ntime=ntime, nlev=nlev, dtype=np.float64)
+    return data.assign_coords(time=np.arange(ntime, dtype=float))
+
+
+def test_pfull_to_phalf_does_not_mutate_input():
+    data = make_dataset()
+    phalf = data.phalf.values.copy()
+    th = domain.pfull_to_phalf(data.temp, data)
+    assert np.allclose(data.phalf.values, phalf)
+    assert np.allclose(th.phalf, phalf[1:-1])
+    expected = 0.5*(data.temp.values[:, 1:] + data.temp.values[:, :-1])
+    assert np.allclose(th.values, expected)
+
+def test_diff_pfull_matches_diff():
+    data = make_dataset()
+    dt = domain.diff_pfull(data.temp, data)
+    assert dt.name == 'dtemp'
+    assert np.allclose(dt.values, data.temp.diff('pfull').values)
+
+def test_vertical_operators_stay_lazy():
+    dask = pytest.importorskip('dask')
+    data = make_dataset().chunk({'time': 1})
+
+    def no_compute(*args, **kwargs):
+        raise AssertionError('vertical operator triggered a compute')
+
+    with dask.config.set(scheduler=no_compute):
+        n2 = iscaxr.brunt_vaisala(data)
+        egr = iscaxr.eady_growth_rate(data)
+    for result in (n2, egr):
+        assert result.chunks is not None
+        assert result.chunks[result.get_axis_num('time')] == (1,)*len(data.time)
+
+    eager = iscaxr.brunt_vaisala(data.load())
+    assert np.allclose(n2.values, eager.values, equal_nan=True)
+
+def test_grid_is_cached_by_coordinates():
+    data = make_dataset()
+    grid = iscaxr.IscaGrid.from_dataset(data)
+    assert iscaxr.IscaGrid.from_dataset(data.copy(deep=True)) is grid
+    assert domain.calculate_dA(data) is grid.dA
+    assert domain.calculate_dA(grid) is grid.dA
+    # the cells cover the sphere
+    assert np.isclose(float(grid.dA.sum()), 4*np.pi, rtol=0.05)
+    assert np.allclose(domain.calculate_dp(data), np.diff(data.phalf)*100)
+
+    other = make_dataset(nlat=12)
+    assert iscaxr.IscaGrid.from_dataset(other) is not grid
+
+def test_grid_weights_are_readonly():
+    grid = iscaxr.IscaGrid.from_dataset(make_dataset())
+    with pytest.raises(ValueError):
+        grid.dA.values[0, 0] = 0
+
+def test_synthetic_dataset_grid():
+    from iscaxr.synthetic import make_dataset as make_synthetic
+    data = make_synthetic('T21', ntime=2, nlev=10)
+    assert data.temp.shape == (2, 10, 32, 64)
+    assert data.temp.dtype == np.float32
+    grid = iscaxr.IscaGrid.from_dataset(data)
+    assert np.isclose(float(grid.dA.sum()), 4*np.pi, rtol=1e-2)
+    assert float(domain.calculate_dz(data).max()) < 0
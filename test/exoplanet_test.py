@@ -0,0 +1,77 @@
+import numpy as np
+import xarray as xr
+import pytest
+
+import iscaxr.grid
+import iscaxr.xarray_extensions
+from iscaxr import domain
+from iscaxr.analysis import exoplanet
+
+from domain_test import make_dataset
+
+
+def moving_star_dataset(ntime=10):
+    data = make_dataset(ntime=ntime)
+    data.time.attrs['units'] = 'days since 0000-01-01 00:00:00'
+    return data
+
+def loop_lon_to_xi(field, lon0, wrap=True):
+    # reference: recentre one snapshot at a time
+    return xr.concat([domain.center_lon(field.sel(time=t), lon=float(lon0(field.time.sel(time=t))), wrap=wrap)
+                      for t in field.time], dim='time')
+
+def test_lon_to_xi_matches_snapshots():
+    data = moving_star_dataset()
+    lon0 = exoplanet.g_sublon(data, omega=1e-5, alpha=10.0)
+    xi = exoplanet.lon_to_xi(data.temp, lon0)
+    expected = loop_lon_to_xi(data.temp, lon0)
+    assert xi.dims == data.temp.dims
+    assert np.allclose(xi.lon, expected.lon)
+    assert np.allclose(xi.values, expected.values)
+
+def test_lon_to_xi_dataset_is_lazy():
+    pytest.importorskip('dask')
+    data = moving_star_dataset().chunk({'time': 3})
+    lon0 = exoplanet.g_sublon(data, omega=1e-5, alpha=10.0)
+    xi = exoplanet.lon_to_xi(data, lon0, wrap=False)
+    assert xi.temp.chunks[0] == data.temp.chunks[0]
+    assert xi.ps.dims == data.ps.dims
+    expected = loop_lon_to_xi(data.ps.load(), lon0, wrap=False)
+    assert np.allclose(xi.ps.values, expected.values)
+
+def broadcast_phase_curve(field, data):
+    # reference: the direct (time, lat, lon, lon0) broadcast
+    grid = iscaxr.grid.get_grid(data)
+    lon0 = xr.DataArray(data.lon.values, dims='lon0', coords={'lon0': data.lon.values})
+    plon = np.maximum(np.cos(np.deg2rad(data.lon - lon0)), 0)
+    return (field*grid.dA*grid.coslat*plon).sum(('lat', 'lon'))
+
+def test_phase_curve_matches_broadcast():
+    data = make_dataset(ntime=6)
+    field = data.temp.isel(pfull=-1)
+    expected = broadcast_phase_curve(field, data)
+    pc = exoplanet.make_phase_curve_calculator(data)(field.chunk({'time': 2}))
+    assert pc.dims == ('time', 'lon0')
+    assert pc.chunks[0] == (2, 2, 2)
+    assert np.allclose(pc, expected.transpose(*pc.dims))
+
+def test_phase_curve_mean_of_uniform_field():
+    data = make_dataset()
+    field = xr.ones_like(data.ps)
+    pc = exoplanet.make_phase_curve_calculator_mean(data)(field)
+    assert pc.dims == ('time', 'lon')
+    # the zonal mean of max(cos(lon - lon0), 0) is 1/pi
+    assert np.allclose(pc, 1/np.pi, rtol=0.02)
+
+def test_phase_curve_matches_points_by_coordinate():
+    data = make_dataset(ntime=3)
+    field = data.temp.isel(pfull=-1)
+    calculator = exoplanet.make_phase_curve_calculator(data)
+    expected = calculator(field)
+    rolled = field.roll(lon=5, roll_coords=True)
+    assert np.allclose(calculator(rolled), expected)
+    # longitudes in [-180, 180), as given by center_lon
+    wrapped = rolled.assign_coords(lon=(rolled.lon + 180) % 360 - 180)
+    assert np.allclose(calculator(wrapped.chunk({'time': 1})), expected)
+    with pytest.raises(ValueError):
+        calculator(field.isel(lon=slice(1, None)))
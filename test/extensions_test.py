@@ -0,0 +1,134 @@
+import dask
+import numpy as np
+import xarray as xr
+import pytest
+
+import iscaxr
+import iscaxr.xarray_extensions
+from iscaxr.analysis import derived
+
+from domain_test import make_dataset
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    fn, inputs, deps = derived.DERIVED[name]
+    def counting(*args, **kwargs):
+        calls.append(name)
+        return fn(*args, **kwargs)
+    monkeypatch.setitem(derived.DERIVED, name, (counting, inputs, deps))
+    return calls
+
+def test_derived_intermediates_computed_once(monkeypatch):
+    data = make_dataset()
+    theta_calls = count_calls(monkeypatch, 'theta')
+    dz_calls = count_calls(monkeypatch, 'dz')
+
+    result = data.isca.derive('theta', 'N2', 'egr')
+    assert len(theta_calls) == 1
+    assert len(dz_calls) == 1
+    assert np.allclose(result.N2, iscaxr.brunt_vaisala(data))
+    assert np.allclose(result.egr, iscaxr.eady_growth_rate(data), equal_nan=True)
+    assert data.isca['N2'] is data.isca['N2']
+    assert len(theta_calls) == 1
+
+def test_derived_invalidated_by_new_input(monkeypatch):
+    data = make_dataset()
+    theta_calls = count_calls(monkeypatch, 'theta')
+    f = data.isca['f']
+    n2 = data.isca['N2']
+    data['temp'] = data.temp + 10
+    assert data.isca['f'] is f
+    new_n2 = data.isca['N2']
+    assert len(theta_calls) == 2
+    assert not np.allclose(new_n2, n2)
+
+def test_derived_file_backed_stays_lazy(monkeypatch, tmp_path):
+    path = str(tmp_path / 'data.nc')
+    make_dataset().to_netcdf(path)
+    theta_calls = count_calls(monkeypatch, 'theta')
+    with xr.open_dataset(path, cache=False) as data:
+        theta = data.isca['theta']
+        assert data.isca['theta'] is theta
+        assert len(theta_calls) == 1
+        assert not data.variables['temp']._in_memory
+
+def test_derived_unknown():
+    with pytest.raises(KeyError):
+        make_dataset().isca['nonsense']
+
+def test_derived_lazy_graph():
+    pytest.importorskip('dask')
+    data = make_dataset().chunk({'time': 2})
+    result = data.isca.derive('theta', 'N2', 'egr', 'streamfunction')
+    assert all(v.chunks is not None for v in result.data_vars.values())
+    eager = make_dataset().isca.derive('theta', 'N2', 'egr', 'streamfunction')
+    for name in result.data_vars:
+        assert np.allclose(result[name].values, eager[name].values, equal_nan=True)
+
+def test_in_units_cached():
+    from iscaxr.xarray_extensions import parse_units
+    data = make_dataset()
+    data.time.attrs['units'] = 'days since 0001-01-01 00:00:00'
+    parse_units.cache_clear()
+    seconds = data.time.in_units('s')
+    assert np.allclose(seconds, data.time.values*86400)
+    assert seconds.attrs['units'] == 's'
+    data.time.in_units('s')
+    (data.time*2).in_units('hour')
+    assert parse_units.cache_info().misses == 1
+
+def test_dataset_in_units():
+    data = make_dataset()
+    data.time.attrs['units'] = 'days since 0001-01-01 00:00:00'
+    data.ps.attrs['units'] = 'Pa'
+    data.lon.attrs['units'] = 'degrees_E'
+    data.temp.attrs['units'] = 'K'
+    converted = data.in_units(time='hour', ps='hPa', lon='rad', temp='K')
+    assert np.allclose(converted.time, data.time*24)
+    assert np.allclose(converted.ps, data.ps/100)
+    assert np.allclose(converted.lon, np.deg2rad(data.lon))
+    assert converted.ps.attrs['units'] == 'hPa'
+    assert converted.ps.dims == data.ps.dims
+    # no conversion needed: data is shared, not copied
+    assert np.shares_memory(converted.temp.values, data.temp.values)
+
+
+def gaussian_jet(lat0, lat, width=10.0):
+    return np.exp(-((lat[None, :] - lat0[:, None])/width)**2)
+
+def test_coordmax_per_time_with_refinement():
+    lat = np.linspace(-88.5, 88.5, 60)
+    lat0 = np.array([30.2, 41.7, -20.0, 55.1])
+    u = xr.DataArray(gaussian_jet(lat0, lat), coords={'time': np.arange(4), 'lat': lat}, dims=('time', 'lat'))
+    coarse = u.coordmax('lat')
+    assert coarse.dims == ('time',)
+    assert np.all(np.abs(coarse - lat0) <= 1.5)
+    fine = u.chunk({'time': 1}).coordmax('lat', refine=True)
+    assert fine.chunks is not None
+    assert np.allclose(fine, lat0, atol=0.1)
+    assert np.allclose((-u).coordmin('lat', refine=True), fine)
+
+def test_coordmax_over_several_dims():
+    data = make_dataset()
+    field = data.temp.isel(pfull=0).copy()
+    field[:, 3, 5] = 1e4
+    loc = field.coordmax(['lat', 'lon'])
+    assert np.allclose(loc.lat, data.lat[3])
+    assert np.allclose(loc.lon, data.lon[5])
+    assert loc.lat.dims == ('time',)
+
+def _no_compute(*args, **kwargs):
+    raise AssertionError('computed eagerly')
+
+def test_coordmax_over_several_dims_is_lazy():
+    data = make_dataset()
+    field = data.temp.isel(pfull=0).copy()
+    field[:, 3, 5] = 1e4
+    field[1, 6, 2] = 2e4
+    with dask.config.set(scheduler=_no_compute):
+        loc = field.chunk({'time': 1, 'lat': 4}).coordmax(['lat', 'lon'])
+        assert loc.lat.chunks is not None
+    assert np.allclose(loc.lat, data.lat[[3, 6, 3, 3]])
+    assert np.allclose(loc.lon, data.lon[[5, 2, 5, 5]])
+    assert np.allclose(loc.lat, field.coordmax(['lat', 'lon']).lat)
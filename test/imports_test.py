@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+# dependencies that `import iscaxr` should not load
+HEAVY = ('spharm', 'scipy.signal', 'scipy.interpolate', 'scipy.sparse',
+         'matplotlib', 'cartopy', 'astropy', 'h5py')
+
+
+def loaded_modules(statement):
+    code = '{}\nimport sys\nprint(" ".join(sorted(sys.modules)))'.format(statement)
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return set(out.decode().split())
+
+def test_import_is_lazy():
+    modules = loaded_modules('import iscaxr')
+    assert [m for m in HEAVY if m in modules] == []
+
+def test_extensions_import_is_lazy():
+    modules = loaded_modules('import iscaxr.xarray_extensions')
+    assert [m for m in HEAVY if m in modules] == []
+
+def test_lazy_submodule():
+    modules = loaded_modules('import iscaxr\niscaxr.regrid.METHODS')
+    assert 'iscaxr.regrid' in modules
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from iscaxr import loader
+
+from domain_test import make_dataset
+
+pytest.importorskip('dask')
+
+
+def write_runs(basedir, nruns=3, ntime=2):
+    for i in range(nruns):
+        data = make_dataset(ntime=ntime)
+        data = data.assign_coords(time=data.time + i*ntime)
+        rundir = os.path.join(basedir, 'run{:04d}'.format(i+1))
+        os.makedirs(rundir)
+        data.to_netcdf(os.path.join(rundir, 'atmos_monthly.nc'))
+
+def count_scans(monkeypatch):
+    scanned = []
+    scan_file = loader.scan_file
+    def counting_scan(path):
+        scanned.append(path)
+        return scan_file(path)
+    monkeypatch.setattr(loader, 'scan_file', counting_scan)
+    return scanned
+
+def test_open_runs_reuses_index(tmp_path, monkeypatch):
+    basedir = str(tmp_path)
+    write_runs(basedir)
+    scanned = count_scans(monkeypatch)
+
+    data = loader.open_runs(basedir)
+    assert len(scanned) == 3
+    assert os.path.isfile(os.path.join(basedir, loader.INDEX_FILENAME))
+    assert np.allclose(data.time, np.arange(6))
+    assert data.temp.chunks[0] == (2, 2, 2)
+    assert data.phalf.size == 6
+    data.close()
+
+    # unchanged files aren't scanned again
+    data = loader.open_runs(basedir)
+    assert len(scanned) == 3
+    data.close()
+
+    path = os.path.join(basedir, 'run0002', 'atmos_monthly.nc')
+    os.utime(path, (0, 0))
+    loader.open_runs(basedir).close()
+    assert scanned[3:] == [path]
+
+def test_open_runs_checks_grid(tmp_path):
+    basedir = str(tmp_path)
+    write_runs(basedir, nruns=2)
+    make_dataset(nlat=4).to_netcdf(os.path.join(basedir, 'run0001', 'atmos_monthly.nc'))
+    with pytest.raises(ValueError):
+        loader.open_runs(basedir)
+
+def test_open_runs_from_index_opens_one_file(tmp_path, monkeypatch):
+    basedir = str(tmp_path)
+    write_runs(basedir)
+    files = loader.find_run_files(basedir)
+    loader.open_runs(basedir).close()
+
+    opened = []
+    open_dataset = xr.open_dataset
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return open_dataset(path, *args, **kwargs)
+    monkeypatch.setattr(xr, 'open_dataset', counting_open)
+    data = loader.open_runs(basedir, decode_times=False)
+    assert opened == [files[0]]
+    assert data.temp.chunks[0] == (2, 2, 2)
+    with xr.open_mfdataset(files, combine='by_coords', decode_times=False) as expected:
+        xr.testing.assert_identical(data.load(), expected.load())
+    data.close()
+
+    with loader.open_runs(basedir, time_range=(0.5, 2.5)) as data:
+        assert np.allclose(data.time, [0, 1, 2, 3])
+        assert data.temp.chunks[0] == (2, 2)
+
+def test_open_runs_read_only(tmp_path, monkeypatch):
+    basedir = str(tmp_path / 'archive')
+    write_runs(basedir, nruns=2)
+    monkeypatch.setattr(loader, '_is_writable', lambda directory: False)
+    monkeypatch.setattr(loader, 'USER_INDEX_DIR', str(tmp_path / 'cache'))
+    scanned = count_scans(monkeypatch)
+    loader.open_runs(basedir).close()
+    loader.open_runs(basedir).close()
+    assert len(scanned) == 2
+    assert not os.path.exists(os.path.join(basedir, loader.INDEX_FILENAME))
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 1
+
+    def read_only(index, index_path):
+        raise PermissionError(13, 'Permission denied', index_path)
+    monkeypatch.setattr(loader, 'save_index', read_only)
+    with pytest.warns(UserWarning, match='could not save'):
+        data = loader.open_runs(basedir, index_path=os.path.join(basedir, 'index.json'))
+    assert data.time.size == 4
+    data.close()
+
+def test_open_runs_shares_index_between_files(tmp_path, monkeypatch):
+    basedir = str(tmp_path)
+    write_runs(basedir)
+    for path in loader.find_run_files(basedir):
+        make_dataset(ntime=4).to_netcdf(path.replace('monthly', 'daily'))
+    scanned = count_scans(monkeypatch)
+    for filename in ['atmos_monthly.nc', 'atmos_daily.nc']*2:
+        loader.open_runs(basedir, filename).close()
+    assert len(scanned) == 6
+
+    # entries of deleted files are dropped
+    os.remove(os.path.join(basedir, 'run0003', 'atmos_daily.nc'))
+    loader.open_runs(basedir).close()
+    index = loader.load_index(os.path.join(basedir, loader.INDEX_FILENAME))
+    assert len(index) == 5
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import iscaxr
+from iscaxr.analysis import meridional_transports
+
+from domain_test import make_dataset
+
+
+def test_streamfunction_uniform_ps_matches_fixed_levels():
+    data = make_dataset()
+    data['ps'] = data.ps*0 + 1e5
+    psi = iscaxr.mass_streamfunction(data)
+    fixed = iscaxr.mass_streamfunction(data, ps_field=None)
+    assert np.allclose(psi.transpose(*fixed.dims), fixed)
+
+def test_streamfunction_scales_with_ps():
+    data = make_dataset()
+    data['ps'] = data.ps*0 + 5e4
+    psi = iscaxr.mass_streamfunction(data)
+    fixed = iscaxr.mass_streamfunction(data, ps_field=None)
+    assert np.allclose(psi.transpose(*fixed.dims), 0.5*fixed)
+
+def test_transports():
+    data = make_dataset()
+    data['sphum'] = data.temp*0
+    tr = meridional_transports(data)
+    assert set(tr.data_vars) == {'streamfunction', 'heat', 'moisture', 'angular_momentum'}
+    assert tr.heat.dims == ('time', 'lat')
+    assert np.allclose(tr.moisture, 0)
+    psi = iscaxr.mass_streamfunction(data)
+    assert np.allclose(tr.streamfunction.transpose(*psi.dims), psi)
+
+def test_transports_lazy():
+    pytest.importorskip('dask')
+    data = make_dataset()
+    lazy = meridional_transports(data.chunk({'time': 1}))
+    assert lazy.heat.chunks[0] == (1, 1, 1, 1)
+    eager = meridional_transports(data)
+    for name in eager.data_vars:
+        assert np.allclose(lazy[name].values, eager[name].values)
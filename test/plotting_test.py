@@ -0,0 +1,107 @@
+import io
+import shutil
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from iscaxr import plotting
+
+
+class FakeFFmpeg(object):
+    # records what stream_video pipes to ffmpeg
+    def __init__(self, command, stdin=None):
+        self.command = command
+        self.stdin = io.BytesIO()
+        self.stdin.close = lambda: None
+        self.returncode = None
+        self.killed = False
+        launched.append(self)
+
+    def wait(self):
+        self.returncode = -9 if self.killed else 0
+
+    def kill(self):
+        self.killed = True
+
+launched = []
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    del launched[:]
+    monkeypatch.setattr(plotting.subprocess, 'Popen', FakeFFmpeg)
+    return launched
+
+def frames(n, height=6, width=8):
+    return [np.full((height, width, 3), i, dtype=np.uint8) for i in range(n)]
+
+def test_stream_video_pipes_every_frame(ffmpeg):
+    plotting.stream_video(frames(5), 'out.mp4', framerate=10)
+    [proc] = ffmpeg
+    assert proc.command[proc.command.index('-s') + 1] == '8x6'
+    data = proc.stdin.getvalue()
+    assert len(data) == 5*6*8*3
+    assert np.array_equal(np.frombuffer(data, np.uint8).reshape(5, 6, 8, 3)[:, 0, 0, 0], np.arange(5))
+
+def test_stream_video_rejects_frames_of_another_size(ffmpeg):
+    with pytest.raises(ValueError, match='frame 2'):
+        plotting.stream_video(frames(2) + frames(1, width=10), 'out.mp4')
+    [proc] = ffmpeg
+    assert proc.killed
+    assert len(proc.stdin.getvalue()) == 2*6*8*3
+
+def test_stream_video_of_figures(tmp_path):
+    if shutil.which('ffmpeg') is None:
+        pytest.skip('ffmpeg is not installed')
+    plt = pytest.importorskip('matplotlib.pyplot')
+    images = []
+    for i in range(3):
+        fig = plt.figure(figsize=(2, 2), dpi=50)
+        fig.gca().plot([0, i])
+        images.append(plotting.figure_to_rgb(fig))
+        plt.close(fig)
+    assert images[0].shape == (100, 100, 3)
+    output = str(tmp_path / 'video.mp4')
+    plotting.stream_video(images, output)
+    assert (tmp_path / 'video.mp4').stat().st_size > 0
+
+def draw_time(snapshot):
+    # a module-level frame_fn, so that it can be sent to the workers
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(1, 1), dpi=20)
+    fig.gca().plot(snapshot.values)
+    return fig
+
+def test_make_timeseries_video_streams_from_pool(ffmpeg):
+    pytest.importorskip('matplotlib')
+    field = xr.DataArray(np.random.rand(5, 4), dims=('time', 'x'))
+    plotting.make_timeseries_video(field, draw_time, 'out.mp4', stream=True, processes=2)
+    [proc] = ffmpeg
+    assert proc.command[proc.command.index('-s') + 1] == '20x20'
+    assert len(proc.stdin.getvalue()) == 5*20*20*3
+
+class FakePool(object):
+    # runs tasks when their result is asked for, recording how many wait
+    def __init__(self):
+        self.waiting = 0
+        self.most_waiting = 0
+
+    def apply_async(self, fn, args):
+        self.waiting += 1
+        self.most_waiting = max(self.most_waiting, self.waiting)
+        pool = self
+        class Result(object):
+            def get(self):
+                pool.waiting -= 1
+                return fn(*args)
+        return Result()
+
+def test_rendered_frames_are_bounded_in_flight(monkeypatch):
+    monkeypatch.setattr(plotting, '_render_frame', lambda args: int(args[1]))
+    field = xr.DataArray(np.arange(10), dims=('time',))
+    pool = FakePool()
+    frames = plotting._rendered_frames(pool, None, field, 3)
+    assert next(frames) == 0
+    assert pool.most_waiting == 3
+    assert list(frames) == list(range(1, 10))
+    assert pool.most_waiting == 3
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import iscaxr.analysis
+import iscaxr.util
+from iscaxr import profiling
+from iscaxr.analysis import derived
+from iscaxr.analysis import atmosphere
+
+from domain_test import make_dataset
+
+
+def test_disabled_by_default():
+    assert not profiling.is_enabled()
+    assert not hasattr(iscaxr.util.detrend, '__profiled__')
+    assert not hasattr(iscaxr.analysis.pot_temp, '__profiled__')
+
+def test_profile_records_nested_calls():
+    data = make_dataset()
+    with profiling.profile() as prof:
+        # re-exported and imported-by-name functions are instrumented too
+        assert iscaxr.analysis.pot_temp.__profiled__ is not None
+        assert derived.pot_temp is iscaxr.analysis.thermodynamics.pot_temp
+        egr = data.isca['egr']
+        iscaxr.util.detrend(data.temp)
+    assert not hasattr(iscaxr.analysis.pot_temp, '__profiled__')
+    assert egr.sizes['lat'] == data.sizes['lat']
+
+    names = [r['name'] for r in prof.records]
+    assert 'iscaxr.util.detrend' in names
+    assert 'iscaxr.analysis.thermodynamics.pot_temp' in names
+    get = [r for r in prof.records if r['name'] == 'iscaxr.analysis.derived.DerivedVariables.get']
+    assert min(r['depth'] for r in get) == 1
+    theta = [r for r in prof.records if r['name'] == 'iscaxr.analysis.thermodynamics.pot_temp'][0]
+    assert theta['depth'] > 1 and theta['parent'] == 'iscaxr.analysis.derived.DerivedVariables.get'
+
+    detrend = [r for r in prof.records if r['name'] == 'iscaxr.util.detrend'][0]
+    assert detrend['depth'] == 0 and detrend['wall_time'] > 0
+    assert detrend['input_bytes'] == data.temp.nbytes
+    assert detrend['output_bytes'] == data.temp.nbytes
+    # at least the result was allocated during the call
+    assert detrend['peak_memory'] >= data.temp.nbytes
+    assert not detrend['lazy'] and detrend['graph_tasks'] == 0
+
+    report = prof.report()
+    assert report['iscaxr.util.detrend']['calls'] == 1
+    summary = json.loads(prof.to_json())['summary']
+    assert set(summary) == set(report)
+    assert len(prof.to_dataframe()) == len(prof.records)
+
+def test_profile_lazy_results():
+    data = make_dataset().chunk({'time': 1})
+    with profiling.profile(memory=False) as prof:
+        n2 = atmosphere.brunt_vaisala(data)
+        data.temp.coordmax('lat')
+    record = prof.records[-1]
+    assert record['name'] == 'iscaxr.xarray_extensions.CoordinateMaximumArray.__call__'
+    assert record['lazy'] and record['graph_tasks'] > 0 and record['peak_memory'] is None
+    bv = [r for r in prof.records if r['name'] == 'iscaxr.analysis.atmosphere.brunt_vaisala'][0]
+    assert bv['graph_tasks'] == len(n2.__dask_graph__())
+
+def test_enable_twice():
+    profiler = profiling.enable()
+    try:
+        with pytest.raises(RuntimeError):
+            profiling.enable()
+    finally:
+        assert profiling.disable() is profiler
+    assert not profiling.is_enabled()
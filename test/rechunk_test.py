@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from iscaxr import rechunk
+from iscaxr.grid import grid_hash
+
+from loader_test import write_runs
+
+pytest.importorskip('zarr')
+pytest.importorskip('dask')
+
+
+def test_parse_bytes():
+    assert rechunk.parse_bytes('4GB') == 4*10**9
+    assert rechunk.parse_bytes('1.5 MiB') == 1.5*2**20
+    assert rechunk.parse_bytes(1e6) == 10**6
+
+def test_layouts():
+    sizes = {'time': 120, 'pfull': 25, 'lat': 64, 'lon': 128}
+    ts = rechunk.target_chunks(sizes, 4, 'timeseries', 8*120*128*4)
+    assert ts == {'time': 120, 'pfull': 1, 'lat': 8, 'lon': 128}
+    maps = rechunk.target_chunks(sizes, 4, 'map', 3*25*64*128*4)
+    assert maps == {'time': 3, 'pfull': 25, 'lat': 64, 'lon': 128}
+
+def test_plan_stages_respects_budget():
+    sizes = {'time': 120, 'pfull': 25, 'lat': 64, 'lon': 128}
+    source = {'time': 1, 'pfull': 25, 'lat': 64, 'lon': 128}
+    target = {'time': 120, 'pfull': 1, 'lat': 8, 'lon': 128}
+    budget = 4*1024**2
+    stages = rechunk.plan_stages(source, target, sizes, 4, budget)
+    assert len(stages) == 2 and stages[-1] == target
+    inter = stages[0]
+    assert rechunk._copy_bytes(source, inter, sizes, 4) <= budget
+    assert rechunk._copy_bytes(inter, target, sizes, 4) <= budget
+    # with plenty of memory, a single copy
+    assert rechunk.plan_stages(source, target, sizes, 4, 2**32) == [target]
+
+def test_rechunk_runs_to_zarr(tmp_path):
+    basedir = str(tmp_path / 'exp')
+    write_runs(basedir, nruns=3, ntime=4)
+    store = str(tmp_path / 'exp.zarr')
+    # a budget that forces an intermediate stage
+    stages = rechunk.rechunk_to_zarr(basedir, store, 'timeseries', max_mem=40000, workers=1)
+    assert len(stages) == 2
+    assert not os.path.exists(store + '.tmp')
+
+    original = xr.open_mfdataset(os.path.join(basedir, 'run*', 'atmos_monthly.nc'),
+                                 combine='nested', concat_dim='time', decode_times=False)
+    converted = xr.open_zarr(store, decode_times=False)
+    assert converted.temp.chunks[0] == (12,)
+    assert converted.temp.chunks[3] == (converted.sizes['lon'],)
+    assert np.allclose(converted.temp, original.temp)
+    assert np.allclose(converted.time, original.time)
+    assert converted.attrs['iscaxr_grid_hash'] == grid_hash(original)
+    assert converted.attrs['iscaxr_layout'] == 'timeseries'
+
+    rechunk.main([basedir, store, '--layout', 'map', '-m', '1MB', '-v', 'ps'])
+    converted = xr.open_zarr(store, decode_times=False)
+    assert list(converted.data_vars) == ['ps']
+    assert converted.ps.chunks[1:] == ((converted.sizes['lat'],), (converted.sizes['lon'],))
+    assert 'phalf' in converted.coords and 'latb' in converted.coords
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import iscaxr
+from iscaxr import regrid
+from iscaxr.synthetic import make_dataset
+
+
+def wave_field(data, k=2):
+    lat, lon = np.deg2rad(data.lat), np.deg2rad(data.lon)
+    return (np.sin(lat) + np.cos(k*lon)*np.cos(lat)).transpose('lat', 'lon')
+
+def test_bilinear_linear_in_lat():
+    data = make_dataset('T21', ntime=1, nlev=2)
+    target = regrid.latlon_grid(np.linspace(-80, 80, 17), data.lon.values)
+    field = (data.lat*2.0 + data.lon*0).transpose('lat', 'lon')
+    out = regrid.Regridder(data, target)(field)
+    assert out.shape == (17, 64)
+    assert np.allclose(out, 2.0*target.lat.values[:, None])
+
+def test_conservative_preserves_integral():
+    data = make_dataset('T42', ntime=1, nlev=2)
+    coarse = make_dataset('T21', ntime=1, nlev=2)
+    out = regrid.Regridder(data, coarse, method='conservative')(data.temp)
+    assert out.shape == (1, 2, 32, 64)
+    dA_in = iscaxr.domain.calculate_dA(data)
+    dA_out = iscaxr.domain.calculate_dA(coarse)
+    mean_in = (data.temp*dA_in).sum(('lat', 'lon')) / dA_in.sum()
+    mean_out = (out*dA_out).sum(('lat', 'lon')) / dA_out.sum()
+    assert np.allclose(mean_in, mean_out, rtol=1e-3)
+
+def test_spectral_exact_in_lon():
+    data = make_dataset('T42', ntime=1, nlev=2)
+    lons = np.arange(48)*7.5
+    out = iscaxr.domain.resample_latlon(wave_field(data), lats=data.lat.values, lons=lons, method='spectral')
+    expected = wave_field(regrid.latlon_grid(data.lat.values, lons))
+    assert np.allclose(out, expected)
+
+def test_weights_cached_on_disk(tmp_path):
+    data = make_dataset('T21', ntime=1, nlev=2)
+    target = regrid.latlon_grid(np.linspace(-60, 60, 5), np.arange(0, 360, 30.0))
+    r = regrid.Regridder(data, target, cache_dir=str(tmp_path))
+    assert os.path.isfile(r._path(str(tmp_path)))
+    regrid._weights_cache.clear()
+    r2 = regrid.Regridder(data, target, cache_dir=str(tmp_path))
+    assert (r2.weights != r.weights).nnz == 0
+
+def test_regrid_lazy_dataset():
+    pytest.importorskip('dask')
+    data = make_dataset('T21', ntime=4, nlev=2)
+    target = regrid.latlon_grid(np.linspace(-60, 60, 5), np.arange(0, 360, 30.0))
+    r = regrid.Regridder(data, target)
+    lazy = r(data.chunk({'time': 1}))
+    assert lazy.temp.chunks[0] == (1, 1, 1, 1)
+    assert lazy.temp.dims == data.temp.dims
+    assert lazy.lonb.size == 13
+    assert np.allclose(lazy.temp.values, r(data.temp).values)
+
+def test_regridder_checks_source_grid():
+    data = make_dataset('T21', ntime=1, nlev=2)
+    target = regrid.latlon_grid(np.linspace(-60, 60, 5), np.arange(0, 360, 30.0))
+    regridder = regrid.Regridder(data, target)
+    expected = regridder(data.temp)
+    rolled = data.temp.roll(lon=7, roll_coords=True)
+    xr.testing.assert_allclose(regridder(rolled), expected)
+    with pytest.raises(ValueError):
+        regridder(data.temp.isel(lat=slice(2, None)))
+    with pytest.raises(ValueError):
+        regridder(data.temp.assign_coords(lon=data.lon + 1.0))
+
+def test_weights_key_is_horizontal():
+    data = make_dataset('T21', ntime=1, nlev=2)
+    target = regrid.latlon_grid(np.linspace(-60, 60, 5), np.arange(0, 360, 30.0))
+    key = regrid.Regridder(data, target).key
+    assert regrid.Regridder(data.temp, target).key == key
+    assert regrid.Regridder(make_dataset('T21', ntime=1, nlev=5), target).key == key
+    assert regrid.Regridder(data, target, method='conservative').key != key
+
+def test_resample_conservative_uses_source_bounds():
+    data = make_dataset('T42', ntime=1, nlev=2)
+    lats, lons = np.linspace(-80, 80, 9), np.arange(0, 360, 20.0)
+    expected = regrid.Regridder(data, regrid.latlon_grid(lats, lons), method='conservative')(data.temp)
+    out = iscaxr.domain.resample_latlon(data.temp, lats=lats, lons=lons, method='conservative', source=data)
+    xr.testing.assert_allclose(out, expected)
+    with pytest.warns(UserWarning, match='cell bounds'):
+        iscaxr.domain.resample_latlon(data.temp, lats=lats, lons=lons, method='conservative')
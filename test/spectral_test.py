@@ -1,7 +1,9 @@
 import numpy as np
 import xarray as xr
+import pytest
 
-from iscaxr.analysis.spectral import equatorial_waves
+from iscaxr.analysis import spectral
+from iscaxr.analysis.spectral import equatorial_waves, zonal_dispersion, fft, wheeler_kiladis, WheelerKiladis
 
 def make_eq_signal(wavenum, power=1):
     lat = np.linspace(-10, 10, 10)
@@ -34,3 +36,178 @@ def test_symmetric_eq_waves():
     # antisymmetric spectrum should be all zeros
     spec = equatorial_waves(signal, symmetric=False)
     assert np.allclose(spec, 0)
+
+def make_wave(k=3, freq=0.1, ntime=400, nlon=32, dt=1.0):
+    # an eastward travelling wave, cos(kx - ωt)
+    lon = np.linspace(0, 360, nlon, endpoint=False)
+    time = np.arange(ntime)*dt
+    phase = np.deg2rad(lon)[np.newaxis, :]*k - 2*np.pi*freq*time[:, np.newaxis]
+    return xr.DataArray(np.cos(phase), coords=(('time', time), ('lon', lon)))
+
+def test_segmented_zonal_dispersion_peak():
+    wave = make_wave()
+    spec = zonal_dispersion(wave, nperseg=100, noverlap=50)
+    assert spec.dims == ('freq', 'k')
+    assert spec.attrs['nsegments'] == 7
+    peak = spec.where(spec == spec.max(), drop=True).squeeze()
+    assert float(peak.k) == 3
+    assert np.isclose(float(peak.freq), 0.1)
+
+def test_zonal_dispersion_amplitude_or_power():
+    wave = make_wave(ntime=100)
+    whole = zonal_dispersion(wave)
+    segmented = zonal_dispersion(wave, nperseg=100, noverlap=0, ntaper=0)
+    # the same quantity whether or not the time series is segmented
+    assert np.isclose(float(whole.max()), float(segmented.max()))
+    assert np.allclose(zonal_dispersion(wave, power=True), whole**2)
+    power = zonal_dispersion(wave, nperseg=50, power=True)
+    assert power.attrs['nsegments'] == 3
+    assert np.allclose(power, zonal_dispersion(wave, nperseg=50)**2)
+
+def test_segmented_zonal_dispersion_lazy():
+    pytest.importorskip('dask')
+    wave = make_wave().astype(np.float32)
+    wave = wave.expand_dims(lat=[-1.0, 1.0]).transpose('time', 'lat', 'lon')
+    spec = zonal_dispersion(wave, nperseg=64)
+    lazy = zonal_dispersion(wave.chunk({'time': 50}), nperseg=64)
+    assert lazy.chunks is not None
+    assert spec.dims == ('freq', 'lat', 'k')
+    assert spec.dtype == np.float32
+    assert np.allclose(spec, lazy.values, rtol=1e-4)
+
+def test_fft_matches_numpy():
+    wave = make_wave(ntime=20)
+    ft = fft(wave, dim='lon')
+    expected = np.fft.fftshift(np.fft.fft(wave.values, axis=1), axes=1)
+    assert ft.dims == ('time', 'F_lon')
+    assert np.allclose(ft.values, expected)
+    assert np.allclose(ft.F_lon, np.fft.fftshift(np.fft.fftfreq(32, 1./32)))
+
+    ft = fft(wave)
+    assert ft.dims == ('F_time', 'F_lon')
+    assert np.allclose(ft.values, np.fft.fftshift(np.fft.fft2(wave.values)))
+
+def test_real_fft_power():
+    wave = make_wave(ntime=20).astype(np.float32)
+    ft = fft(wave, dim=['time', 'lon'], real=True)
+    assert ft.dtype == np.complex64
+    assert ft.shape == (20, 17)
+    assert np.all(ft.F_lon >= 0)
+    full = fft(wave, dim=['time', 'lon']).sel(F_lon=slice(0, None))
+    assert np.allclose(ft.isel(F_lon=slice(0, 16)).values, full.values, atol=1e-3)
+
+    power = fft(wave, dim=['time', 'lon'], real=True, power=True)
+    assert power.dtype == np.float32
+    assert np.allclose(power, np.abs(ft)**2)
+
+def test_real_fft_lazy():
+    pytest.importorskip('dask')
+    wave = make_wave(ntime=20).astype(np.float32)
+    lazy = fft(wave.chunk({'time': 5}), dim='lon', real=True, power=True)
+    assert lazy.chunks == ((5, 5, 5, 5), (17,))
+    assert np.allclose(lazy.values, fft(wave, dim='lon', real=True, power=True).values)
+
+def make_equatorial_wave(ntime=300, symmetric=True, k=4, freq=0.2):
+    lat = np.linspace(-14, 14, 8)
+    wave = make_wave(k=k, freq=freq, ntime=ntime)
+    profile = np.cos(np.deg2rad(lat)*6) if symmetric else np.sin(np.deg2rad(lat)*6)
+    return (wave*xr.DataArray(profile, coords=[('lat', lat)])).transpose('time', 'lat', 'lon')
+
+def test_wheeler_kiladis_separates_symmetry():
+    field = make_equatorial_wave(symmetric=True) + make_equatorial_wave(symmetric=False, k=-2, freq=0.1)
+    spectra = wheeler_kiladis(field, nperseg=100)
+    assert spectra.symmetric.dims == ('freq', 'k')
+    peak = spectra.symmetric.argmax(dim=['freq', 'k'])
+    assert float(spectra.k[peak['k']]) == 4 and np.isclose(spectra.freq[peak['freq']], 0.2)
+    peak = spectra.antisymmetric.argmax(dim=['freq', 'k'])
+    assert float(spectra.k[peak['k']]) == -2 and np.isclose(spectra.freq[peak['freq']], 0.1)
+    assert spectra.symmetric_norm.sel(k=4, freq=0.2) > 10
+
+def test_wheeler_kiladis_streaming_matches_whole():
+    field = make_equatorial_wave(ntime=310)
+    whole = WheelerKiladis(nperseg=60).update(field)
+    streamed = WheelerKiladis(nperseg=60)
+    for i0 in range(0, 310, 47):
+        streamed.update(field.isel(time=slice(i0, i0+47)).chunk({'time': 10}))
+    assert streamed.nsegments == whole.nsegments == 9
+    xr.testing.assert_allclose(streamed.result(), whole.result())
+
+def make_sphere_field(lat, nlon=16, ntime=3, npfull=2):
+    lon = np.linspace(0, 360, nlon, endpoint=False)
+    coslat = np.cos(np.deg2rad(lat))[:, np.newaxis]
+    values = [[(1 + t + p)*coslat*np.cos(np.deg2rad(lon)) + p*coslat**2 for p in range(npfull)] for t in range(ntime)]
+    return xr.DataArray(np.array(values), coords=[('time', np.arange(ntime)), ('pfull', np.arange(npfull)),
+                                                  ('lat', lat), ('lon', lon)], name='field')
+
+def test_spharm_ready_orders_lat_and_lon_lazily():
+    field = make_sphere_field(np.linspace(-80, 80, 8)).roll(lon=5, roll_coords=True)
+    ready = spectral._spharm_ready(field.chunk({'time': 1, 'lat': 3, 'lon': 4}))
+    assert ready.chunks is not None
+    assert ready.chunks[2:] == ((8,), (16,))
+    assert np.all(np.diff(ready.lat) < 0) and np.all(np.diff(ready.lon) > 0)
+    xr.testing.assert_equal(ready.compute(), field.sortby('lon').sortby('lat', ascending=False))
+
+class FakeSpharmt(object):
+    # one "coefficient" per grid point: the grid flattened in (lat, lon) order
+    def grdtospec(self, columns, ntrunc):
+        assert columns.ndim == 3
+        return columns.reshape((-1, columns.shape[-1])).copy()
+
+    def spectogrd(self, coeffs):
+        return coeffs
+
+def fake_transform(monkeypatch, ncoeffs):
+    m = np.zeros(ncoeffs, dtype=int)
+    n = np.arange(ncoeffs)
+    monkeypatch.setattr(spectral, '_spharm_transform', lambda nlon, nlat, gridtype, ntrunc: (FakeSpharmt(), m, n))
+    return m, n
+
+def test_grdtospec_keeps_columns_in_order(monkeypatch):
+    values = np.random.rand(3, 2, 4, 5)
+    fake_transform(monkeypatch, 20)
+    cc = spectral._grdtospec(values, 'gaussian', ntrunc=19)
+    assert cc.shape == (3, 2, 20, 20)
+    assert np.array_equal(cc[:, :, 0, :], values.reshape((3, 2, 20)))
+    assert np.all(cc[:, :, 1:, :] == 0)
+
+def test_filter_grid_keeps_columns_in_order(monkeypatch):
+    values = np.random.rand(3, 2, 4, 5).astype(np.float32)
+    fake_transform(monkeypatch, 20)
+    filtered = spectral._filter_grid(values, 'gaussian', l_cut=6)
+    assert filtered.shape == values.shape and filtered.dtype == np.float32
+    expected = values.reshape((3, 2, 20)).copy()
+    expected[..., 7:] = 0
+    assert np.array_equal(filtered, expected.reshape(values.shape))
+
+def spharm_field():
+    spharm = pytest.importorskip('spharm')
+    lat, _ = spharm.gaussian_lats_wts(8)
+    return make_sphere_field(lat)
+
+def test_sph_filter_round_trip():
+    field = spharm_field()
+    # the field is band-limited, so nothing is removed
+    filtered = spectral.sph_filter(field.isel(lat=slice(None, None, -1)), l_cut=7)
+    assert filtered.dims == field.dims
+    assert np.allclose(filtered.sortby('lat').values, field.values, atol=1e-6)
+    cc = spectral.spht(field)
+    assert cc.dims == ('m', 'n', 'time', 'pfull')
+    assert np.abs(cc.sel(m=1, n=1)).min() > 0
+    assert np.allclose(cc.sel(m=3), 0, atol=1e-8)
+
+def test_spht_lazy_matches_eager():
+    field = spharm_field()
+    lazy = spectral.spht(field.chunk({'time': 1, 'lat': 2}), ntrunc=5)
+    assert lazy.chunks is not None
+    xr.testing.assert_allclose(lazy.compute(), spectral.spht(field, ntrunc=5))
+
+def test_spharm_transform_is_reused():
+    field = spharm_field()
+    spectral._spharm_transform.cache_clear()
+    spectral.spht(field, ntrunc=5)
+    spectral.spht(field.isel(time=0), ntrunc=5)
+    spectral.sph_filter(field, l_cut=3)
+    spectral.sph_filter(field.isel(pfull=0), l_cut=2)
+    info = spectral._spharm_transform.cache_info()
+    # one transform each for ntrunc=5 and for the filter's ntrunc=nlat-1
+    assert info.misses == 2 and info.hits == 2
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from iscaxr.util import detrend
+
+from domain_test import make_dataset
+
+
+def test_detrend_removes_trend_at_each_point():
+    data = make_dataset(ntime=12)
+    t = data.time
+    slope = data.lat*data.pfull/1000.0
+    field = data.temp + slope*t + 0.1*slope*t**2
+    residual = detrend(field, deg=2)
+    expected = detrend(data.temp, deg=2)
+    assert residual.dims == field.dims
+    assert np.allclose(residual, expected)
+    # what remains has no trend of its own
+    assert np.allclose(detrend(residual, deg=2), residual)
+
+def test_detrend_matches_polyfit_along_other_dim():
+    data = make_dataset()
+    field = data.ucomp.chunk({'time': 1})
+    residual = detrend(field, dim='lon')
+    assert residual.chunks is not None
+    fit = data.ucomp.polyfit('lon', 1)
+    trend = xr.polyval(data.lon, fit.polyfit_coefficients)
+    assert np.allclose(residual, data.ucomp - trend)
+
+def test_detrend_datetime_coordinate():
+    time = pd.date_range('2000-01-01', periods=10, freq='MS')
+    days = (time - time[0]) / pd.Timedelta(days=1)
+    field = xr.DataArray(2.0 + 0.5*np.asarray(days), coords={'time': time}, dims='time', name='x')
+    residual = detrend(field)
+    assert residual.name == 'x'
+    assert np.allclose(residual, 0)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from iscaxr import domain
+from iscaxr.vertical import VerticalInterpolator, interpolate_to_pressure
+from iscaxr.synthetic import make_dataset
+
+
+def test_pressure_interpolation_exact_in_log_p():
+    data = make_dataset('T21', ntime=2, nlev=10)
+    logp = np.log((data.pfull/data.phalf.max())*data.ps/100.0).transpose(*data.temp.dims)
+    levels = [900.0, 500.0, 100.0]
+    out = interpolate_to_pressure(logp, data, levels)
+    assert out.dims == ('time', 'plev', 'lat', 'lon')
+    assert np.allclose(out.sel(plev=500.0), np.log(500.0))
+    # 999 hPa is below the lowest full level
+    out = interpolate_to_pressure(logp, data, [999.0])
+    assert np.all(np.isnan(out))
+
+def test_height_interpolation():
+    data = make_dataset('T21', ntime=2, nlev=10)
+    z = domain.calculate_z(data)
+    interp = VerticalInterpolator(data, [1000.0, 5000.0], coord='height')
+    assert np.allclose(interp(z), interp.levels[:, np.newaxis, np.newaxis])
+
+def test_interpolator_reused_and_lazy():
+    pytest.importorskip('dask')
+    data = make_dataset('T21', ntime=4, nlev=10)
+    lazy = data.chunk({'time': 1})
+    interp = VerticalInterpolator(lazy, [850.0, 250.0])
+    out = interp(lazy[['temp', 'ucomp', 'ps']])
+    assert out.temp.chunks[0] == (1, 1, 1, 1)
+    assert out.ps.dims == data.ps.dims
+    eager = VerticalInterpolator(data, [850.0, 250.0])(data.ucomp)
+    assert np.allclose(out.ucomp.values, eager.values, equal_nan=True)